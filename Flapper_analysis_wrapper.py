@@ -8,14 +8,1301 @@ Created on Fri Jul 31 11:40:36 2015
 
 """
 
-def analyzeFlapperData(files):
+from Flapper_data_analysis import FlapperData, FlapperPipeline, loadCombo, loadRodData, resolveFrame, resolveTables, filterFrame, defaultSchema, Profiler, enableProfiling, disableProfiling, currentMemory, saveTable, segmentLength
+
+
+class TrialCache(object):
+    """
+    An on-disk cache of FlapperData objects at intermediate stages of
+    processing (loaded, resolved, filtered, rod-subtracted), so trials
+    that haven't changed don't need to be loaded and processed again.
+    
+    Entries are keyed on the contents of the foil/rod combo files plus the
+    parameters used to get to that stage (freq, pitch, cutoffFreq,
+    resolved, ...) and the version of the analysis code (see codeVersion),
+    so editing a file, a spreadsheet row or the code makes a new entry
+    instead of re-using a stale one.  When the cache grows past
+    maxSize, the least recently used entries are deleted.
+    
+    Inputs:
+        folder - folder to keep cached files in.  Created if needed.
+        
+        maxSize - largest total size of the cache, in MB.  Default is 2000.
+    """
+    
+    def __init__(self, folder, maxSize=2000):
+        import os
+        
+        self.folder = folder
+        self.maxSize = maxSize
+        
+        #remember file hashes, so each file is only read once per size and
+        #modification time
+        self.hashes = {}
+        
+        #objects pickled by other versions of the code may not fit this one
+        self.version = codeVersion()
+        
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    
+    
+    def fileHash(self, filepath):
+        """
+        Finds the SHA-1 hash of the contents of a file.
+        """
+        import os
+        import hashlib
+        
+        info = os.stat(filepath)
+        memo = (filepath, info.st_size, info.st_mtime)
+        
+        if memo not in self.hashes:
+            h = hashlib.sha1()
+            with open(filepath, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            self.hashes[memo] = h.hexdigest()
+        
+        return self.hashes[memo]
+    
+    
+    def key(self, stage, files, params):
+        """
+        Makes the cache key for a processing stage of the given files
+        (list of filepaths) and parameters (dictionary).
+        """
+        import hashlib
+        
+        h = hashlib.sha1()
+        h.update(self.version.encode('utf-8'))
+        h.update(stage.encode('utf-8'))
+        for filepath in files:
+            h.update(self.fileHash(filepath).encode('utf-8'))
+        for name in sorted(params.keys()):
+            h.update((name + '=' + repr(params[name]) + ';').encode('utf-8'))
+        
+        return stage + '_' + h.hexdigest()
+    
+    
+    def get(self, key):
+        """
+        Returns the object cached under key, or None if there isn't one.
+        """
+        import os
+        import cPickle as pickle
+        
+        filepath = os.path.join(self.folder, key + '.pkl')
+        
+        try:
+            with open(filepath, 'rb') as f:
+                obj = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+        
+        #mark the entry as recently used
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            pass
+        
+        return obj
+    
+    
+    def put(self, key, obj):
+        """
+        Caches obj under key, then deletes the least recently used entries
+        if the cache is too big.
+        """
+        import os
+        import cPickle as pickle
+        
+        filepath = os.path.join(self.folder, key + '.pkl')
+        
+        #write to a temporary file first, so other processes never read a
+        #half-written entry
+        temp = filepath + '.' + str(os.getpid()) + '.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp, filepath)
+        
+        self.evict()
+    
+    
+    def evict(self):
+        """
+        Deletes the least recently used entries until the cache is no
+        bigger than maxSize.
+        """
+        import os
+        
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.pkl'):
+                try:
+                    info = os.stat(os.path.join(self.folder, name))
+                except OSError:
+                    continue
+                entries.append((info.st_mtime, info.st_size, name))
+        
+        total = sum([size for (used, size, name) in entries])
+        
+        #oldest first
+        for used, size, name in sorted(entries):
+            if total <= self.maxSize*1e6:
+                break
+            try:
+                os.remove(os.path.join(self.folder, name))
+            except OSError:
+                pass
+            total -= size
+
+
+class RodRegistry(object):
+    """
+    Rod data shared by all trials in a batch.  Many trials use the same
+    rod-only combo file, so each distinct rod file is loaded, resolved and
+    filtered once per combination of settings (freq, pitch, resolved,
+    cutoffFreq), and the trials read it instead of processing it again.
+    
+    When trials run in several processes, the registry is filled before
+    the processes start, so on Linux/macOS they share its memory instead of
+    each holding a copy.
+    
+    Inputs:
+        schema - the AcquisitionSchema of the rod files.  Default is None
+            (defaultSchema).
+    """
+    
+    def __init__(self, schema=None):
+        if schema is None:
+            schema = defaultSchema
+        self.schema = schema
+        self.rods = {}
+
+        #how the columns of each rod were made (see FlapperData.computed)
+        self.computed = {}
+    
+    
+    def key(self, rodpath, freq, pitch, resolved, cutoffFreq):
+        """
+        Makes the key for a rod file processed with the given settings.
+        """
+        return (rodpath, float(freq), int(pitch), int(resolved), float(cutoffFreq))
+    
+    
+    def add(self, rodpath, freq, pitch, resolved, cutoffFreq):
+        """
+        Loads, resolves (if resolved == 1), and filters a rod file, unless
+        it was already done with the same settings.
+        """
+        k = self.key(rodpath, freq, pitch, resolved, cutoffFreq)
+        
+        if k not in self.rods:
+            computed = {}
+            rodData = loadRodData(rodpath, freq, pitch=pitch, schema=self.schema)
+            if resolved == 1:
+                rodData = resolveFrame(rodData, computed=computed)
+            self.rods[k] = filterFrame(rodData, cutoffFreq, resolved, fs=self.schema.fs, computed=computed)
+            self.computed[k] = computed
+        
+        return self.rods[k]
+    
+    
+    def addAll(self, settings):
+        """
+        Adds many rod files at once: settings is a list of (rodpath, freq,
+        pitch, resolved, cutoffFreq).  The rods that need resolving are
+        resolved together (see resolveTables).  Files that can't be loaded
+        are skipped, so the trials using them report the problem.
+        """
+        #load each new rod file
+        loaded = {}
+        for setting in settings:
+            k = self.key(*setting)
+            if k in self.rods or k in loaded:
+                continue
+            try:
+                loaded[k] = loadRodData(setting[0], setting[1], pitch=setting[2], schema=self.schema)
+            except Exception:
+                pass
+
+        keys = sorted(loaded.keys())
+        computed = dict((k, {}) for k in keys)
+
+        #resolve all of them at once
+        resolve = [k for k in keys if k[3] == 1]
+        resolveTables([loaded[k] for k in resolve], computed=[computed[k] for k in resolve])
+
+        #and filter each one
+        for k in keys:
+            self.rods[k] = filterFrame(loaded[k], k[4], k[3], fs=self.schema.fs, computed=computed[k])
+            self.computed[k] = computed[k]
+
+
+    def get(self, rodpath, freq, pitch, resolved, cutoffFreq):
+        """
+        Returns the processed rod data, or None if it hasn't been added.
+        """
+        return self.rods.get(self.key(rodpath, freq, pitch, resolved, cutoffFreq))
+
+
+#The RodRegistry used by trials running in worker processes
+_sharedRods = None
+
+
+def _shareRods(rods):
+    """
+    Makes the batch's RodRegistry available to a worker process.
+    """
+    global _sharedRods
+    _sharedRods = rods
+
+
+#Columns every manifest needs, and the ones trials with rod data need too
+manifestColumns = ['trial', 'name', 'path', 'pitch', 'resolve', 'rod', 'frequency', 'nCycles', 'SavePath']
+rodColumns = ['rodname', 'rodpath']
+
+
+def readManifest(files):
+    """
+    Reads a manifest of trials (see analyzeFlapperData) to a dataframe, one
+    row per trial.  The format is found from the extension:
+    
+    -.xlsx/.xls - an Excel spreadsheet, from Sheet1 (or the first sheet)
+    -.csv - comma-separated values, with the column names on the first line
+    -.json/.yaml/.yml - a list of trials, each a mapping of column: value,
+        or a mapping with that list under 'trials'.  YAML needs PyYAML.
+    
+    A dataframe is returned as it is.
+    """
+    import os
+    import pandas as pd
+    
+    if isinstance(files, pd.DataFrame):
+        return files
+    
+    ext = os.path.splitext(files)[1].lower()
+    
+    if ext in ['.xlsx', '.xlsm', '.xls']:
+        fileSet = pd.ExcelFile(files)
+        if 'Sheet1' in fileSet.sheet_names:
+            return fileSet.parse('Sheet1', index_col=None)
+        return fileSet.parse(fileSet.sheet_names[0], index_col=None)
+    
+    if ext == '.csv':
+        return pd.read_csv(files)
+    
+    if ext in ['.json', '.yaml', '.yml']:
+        with open(files) as f:
+            if ext == '.json':
+                import json
+                rows = json.load(f)
+            else:
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError('PyYAML is needed to read ' + ext + ' manifests (pip install pyyaml).')
+                rows = yaml.safe_load(f)
+        
+        if isinstance(rows, dict) and 'trials' in rows:
+            rows = rows['trials']
+        return pd.DataFrame(rows)
+    
+    raise ValueError("Can't read a manifest from " + ext + " files.  Use .xlsx, .csv, .json or .yaml.")
+
+
+def trialFiles(trial):
+    """
+    Returns the filepaths of a trial's foil and rod combo files.  The rod
+    filepath is None if the trial doesn't use rod data (the manifest may
+    not have rodname and rodpath columns then).
+    """
+    import os
+    
+    foilpath = os.path.join(str(trial['path']), str(trial['name']) + '.xls')
+    rodpath = None
+    if int(trial['rod']) == 1:
+        rodpath = os.path.join(str(trial['rodpath']), str(trial['rodname']) + '.xls')
+    
+    return foilpath, rodpath
+
+
+def loadManifest(files, check=1, strict=0):
+    """
+    Reads a manifest of trials (see readManifest) and checks it before any
+    trial is analyzed, so a typo shows up straight away instead of partway
+    through the batch.
+    
+    The columns (see analyzeFlapperData) must all be there - rodname and
+    rodpath only if a trial uses rod data - and pitch, resolve and rod must
+    be 0 or 1, frequency a number of at least 0, and nCycles a whole
+    number of at least 1, 'auto' or blank.  Otherwise a ValueError lists
+    every problem.  Blank rows are skipped.
+    
+    Input:
+    
+    -files - the manifest file (or a dataframe)
+    
+    -check - default is 1: also check that every trial's combo files and
+        SavePath folders exist, and print a warning listing any that don't.
+        Those trials fail when they are analyzed.  Set to 0 to skip.
+    
+    -strict - set to 1 to raise an IOError for missing files instead of
+        warning.  Default is 0.
+    
+    Returns a list of trials, one dictionary per row.
+    """
+    import os
+    import pandas as pd
+    
+    fileSet = readManifest(files).dropna(how='all')
+    
+    #check the columns
+    missing = [col for col in manifestColumns if col not in fileSet.columns]
+    if len(missing) > 0:
+        raise ValueError('The manifest is missing columns: ' + ', '.join(missing))
+    
+    problems = []
+    def problem(i, message):
+        problems.append(str(fileSet['trial'].iloc[i]) + ' (row ' + str(i+1) + '): ' + message)
+    
+    #check the numbers
+    for col in ['pitch', 'resolve', 'rod', 'frequency']:
+        values = pd.to_numeric(fileSet[col], errors='coerce')
+        if col == 'frequency':
+            bad = values.isnull() | (values < 0)
+            rule = ' must be a number, at least 0'
+        else:
+            bad = ~values.isin([0, 1])
+            rule = ' must be 0 or 1'
+        for i in range(len(fileSet)):
+            if bad.iloc[i]:
+                problem(i, col + rule + ', not ' + repr(fileSet[col].iloc[i]))
+        fileSet[col] = values
+    
+    #nCycles may be 'auto' or blank, so check it one entry at a time
+    if fileSet['nCycles'].dtype == object:
+        nCycles = list(fileSet['nCycles'])
+        for i, n in enumerate(nCycles):
+            if n is None or n == 'auto' or n != n:
+                continue
+            try:
+                nCycles[i] = int(float(n))
+                ok = nCycles[i] == float(n) and nCycles[i] >= 1
+            except ValueError:
+                ok = False
+            if not ok:
+                problem(i, "nCycles must be a whole number, at least 1, or 'auto', not " + repr(n))
+        fileSet['nCycles'] = pd.Series(nCycles, index=fileSet.index, dtype=object)
+    else:
+        for i, n in enumerate(fileSet['nCycles']):
+            if n == n and (n < 1 or n != round(n)):
+                problem(i, "nCycles must be a whole number, at least 1, or 'auto', not " + repr(n))
+    
+    #rod data need to be found too
+    if (fileSet['rod'] == 1).any():
+        missing = [col for col in rodColumns if col not in fileSet.columns]
+        if len(missing) > 0:
+            problems.append('Trials use rod data, but the manifest is missing columns: ' + ', '.join(missing))
+    
+    if len(problems) > 0:
+        raise ValueError('Problems in the manifest:\n  ' + '\n  '.join(problems))
+    
+    #make a list of trials, one dictionary per row
+    trials = [fileSet.iloc[i].to_dict() for i in range(0,len(fileSet))]
+    
+    #check that the files are there
+    if check == 1:
+        missing = []
+        for trial in trials:
+            foilpath, rodpath = trialFiles(trial)
+            needed = [foilpath, str(trial['SavePath'])]
+            if trial['rod'] == 1:
+                needed += [rodpath, os.path.join(str(trial['SavePath']), 'rod')]
+            for filepath in needed:
+                if not os.path.exists(filepath):
+                    missing.append(str(trial['trial']) + ': ' + filepath)
+        
+        if len(missing) > 0:
+            message = 'Files or folders in the manifest are missing:\n  ' + '\n  '.join(missing)
+            if strict == 1:
+                raise IOError(message)
+            print 'Warning: ' + message
+            print ''
+    
+    return trials
+
+
+class Prefetcher(object):
+    """
+    Reads the foil combo files of a batch of trials on a pool of threads, a
+    few trials ahead of the one being analyzed, so reading files (which is
+    mostly spent outside Python's interpreter lock) overlaps with the
+    analysis.
+    
+    Inputs:
+        trials - list of trials (see loadManifest), in the order they will
+            be asked for
+        
+        schema - the AcquisitionSchema of the combo files.  Default is None
+            (defaultSchema).
+        
+        depth - number of trials to read ahead.  Default is 2.
+        
+        threads - number of threads to read with.  Default is 2.
+    """
+    
+    def __init__(self, trials, schema=None, depth=2, threads=2):
+        from multiprocessing.pool import ThreadPool
+        
+        self.files = [trialFiles(trial)[0] for trial in trials]
+        self.schema = schema
+        self.depth = depth
+        self.pool = ThreadPool(threads)
+        
+        #reads started but not yet collected, by trial number
+        self.pending = {}
+        self.started = 0
+    
+    
+    def get(self, i):
+        """
+        Returns trial i's foil data (a dataframe, see loadCombo), and starts
+        reading the next trials' files.  Returns None if the file couldn't
+        be read, so the trial reads it itself and reports the problem.
+        """
+        #keep depth trials ahead
+        while self.started < min(i + 1 + self.depth, len(self.files)):
+            self.pending[self.started] = self.pool.apply_async(loadCombo, (self.files[self.started],), {'schema': self.schema})
+            self.started += 1
+        
+        read = self.pending.pop(i, None)
+        if read is None:
+            return None
+        
+        try:
+            return read.get()
+        except Exception:
+            return None
+    
+    
+    def close(self):
+        """
+        Stops the threads, after any reads in progress.
+        """
+        self.pending = {}
+        self.pool.close()
+        self.pool.join()
+
+
+class ResultStore(object):
+    """
+    One SQLite file holding the results of every trial in one or more
+    batches - net values, phase averages and, optionally, the full
+    processed traces - so trials can be compared with one query instead of
+    opening a workbook for each.
+    
+    Tables:
+        trials - one row per trial: trial (the key), testtype, frequency,
+            pitch, resolve, rod, nCycles, name, path, fs, when it was
+            added, and how the rod data were lined up (align, rodLag and
+            rodConfidence - see FlapperData.combineWithRod - blank without
+            rod data).  Indexed on testtype, frequency and pitch.
+        
+        net - trial, channel, value: each net value (and confidence bound,
+            e.g. Fx_noRod_ci_low).
+        
+        phase - trial, channel, bin, time, value: each phase-averaged point
+            (and _std, _ci_ columns).
+        
+        traces - trial, channel, dtype, data: each full trace, as the bytes
+            of a numpy array.
+        
+        spectra - trial, channel, freq, psd: each point of each power
+            spectrum (see FlapperData.spectrum).
+    
+    Adding a trial that's already there replaces it, so batches can be
+    re-run or appended to the same file.  Several processes can add to
+    the store at once; SQLite takes turns.
+    
+    Inputs:
+        filepath - the SQLite file.  Created if needed.
+    """
+    
+    #columns of the trials table that queries can filter on
+    trialColumns = ['trial', 'testtype', 'frequency', 'pitch', 'resolve', 'rod', 'nCycles', 'name', 'path', 'fs', 'added',
+                    'align', 'rodLag', 'rodConfidence']
+    
+    def __init__(self, filepath):
+        self.filepath = filepath
+        
+        conn = self.connect()
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS trials (trial TEXT PRIMARY KEY, testtype TEXT,
+                    frequency REAL, pitch INTEGER, resolve INTEGER, rod INTEGER, nCycles INTEGER,
+                    name TEXT, path TEXT, fs REAL, added TEXT,
+                    align TEXT, rodLag REAL, rodConfidence REAL);
+                CREATE INDEX IF NOT EXISTS trials_testtype ON trials (testtype);
+                CREATE INDEX IF NOT EXISTS trials_frequency ON trials (frequency);
+                CREATE INDEX IF NOT EXISTS trials_pitch ON trials (pitch);
+                CREATE TABLE IF NOT EXISTS net (trial TEXT, channel TEXT, value REAL);
+                CREATE INDEX IF NOT EXISTS net_trial ON net (trial, channel);
+                CREATE TABLE IF NOT EXISTS phase (trial TEXT, channel TEXT, bin INTEGER, time REAL, value REAL);
+                CREATE INDEX IF NOT EXISTS phase_trial ON phase (trial, channel);
+                CREATE TABLE IF NOT EXISTS traces (trial TEXT, channel TEXT, dtype TEXT, data BLOB);
+                CREATE INDEX IF NOT EXISTS traces_trial ON traces (trial, channel);
+                CREATE TABLE IF NOT EXISTS spectra (trial TEXT, channel TEXT, freq REAL, psd REAL);
+                CREATE INDEX IF NOT EXISTS spectra_trial ON spectra (trial, channel);
+                """)
+            
+            #stores made before the rod alignment was kept don't have its
+            #columns yet
+            have = [row[1] for row in conn.execute('PRAGMA table_info(trials)')]
+            for col, kind in [('align', 'TEXT'), ('rodLag', 'REAL'), ('rodConfidence', 'REAL')]:
+                if col not in have:
+                    conn.execute('ALTER TABLE trials ADD COLUMN ' + col + ' ' + kind)
+            conn.commit()
+        finally:
+            conn.close()
+    
+    
+    def connect(self):
+        """
+        Opens the SQLite file, waiting up to a minute for other processes
+        writing to it.
+        """
+        import sqlite3
+        
+        return sqlite3.connect(self.filepath, timeout=60)
+    
+    
+    def add(self, trial, net=None, phaseAvg=None, traces=None, nCycles=None, fs=1000., spectrum=None, rodAlignment=None):
+        """
+        Adds (or replaces) a trial's results.
+        
+        Inputs:
+        
+        -trial - the trial's row of the manifest (see analyzeFlapperData)
+        
+        -net - its net values, as returned by netValue (a dictionary of
+            {column: [value]} or a one-row dataframe)
+        
+        -phaseAvg - its phase averages, as returned by phaseAvg
+        
+        -traces - its full traces (a dataframe, e.g. FlapperData.frame()).
+            Default is None (don't store them).
+        
+        -nCycles - the number of cycles averaged over.  Default is None
+            (trial['nCycles']).
+        
+        -fs - sampling frequency of the traces.  Default is 1000.
+        
+        -spectrum - its power spectra, as returned by FlapperData.spectrum.
+            Default is None.
+        
+        -rodAlignment - how its rod data were lined up, as kept in
+            FlapperData.rodAlignment.  Default is None (no rod data).
+        """
+        import sqlite3
+        import time
+        import numpy as np
+        import pandas as pd
+        
+        name = str(trial['trial'])
+        if nCycles is None:
+            nCycles = trial['nCycles']
+        
+        def number(x, kind=float):
+            #plain python numbers (or None for blanks), which sqlite takes
+            try:
+                if x != x:
+                    return None
+                return kind(x)
+            except (TypeError, ValueError):
+                return None
+        
+        #testtype is optional
+        testtype = trial.get('testtype')
+        if testtype is not None and testtype == testtype:
+            testtype = str(testtype)
+        else:
+            testtype = None
+        
+        if rodAlignment is None:
+            rodAlignment = {}
+        align = rodAlignment.get('method')
+        if align is not None:
+            align = str(align)
+        
+        row = (name, testtype,
+               number(trial['frequency']), number(trial['pitch'], int), number(trial['resolve'], int),
+               number(trial['rod'], int), number(nCycles, int), str(trial['name']), str(trial['path']),
+               float(fs), time.strftime('%Y-%m-%d %H:%M:%S'),
+               align, number(rodAlignment.get('lag')), number(rodAlignment.get('confidence')))
+        
+        conn = self.connect()
+        try:
+            #replace anything already stored for the trial
+            for table in ['trials', 'net', 'phase', 'traces', 'spectra']:
+                conn.execute('DELETE FROM ' + table + ' WHERE trial = ?', (name,))
+            
+            conn.execute('INSERT INTO trials (' + ', '.join(self.trialColumns) + ') VALUES (' + ','.join(['?']*len(row)) + ')', row)
+            
+            if net is not None:
+                net = pd.DataFrame(net)
+                conn.executemany('INSERT INTO net VALUES (?,?,?)',
+                                 [(name, str(col), number(net[col].iloc[0])) for col in net.columns])
+            
+            if phaseAvg is not None:
+                channels = [col for col in phaseAvg.columns if col not in ['time', 'phase']]
+                if 'time' in phaseAvg.columns:
+                    times = phaseAvg['time'].values.astype(float)
+                else:
+                    times = np.arange(phaseAvg.shape[0])/float(fs)
+                for col in channels:
+                    values = phaseAvg[col].values.astype(float)
+                    conn.executemany('INSERT INTO phase VALUES (?,?,?,?,?)',
+                                     [(name, str(col), k, float(times[k]), number(values[k])) for k in range(values.shape[0])])
+            
+            if traces is not None:
+                for col in traces.columns:
+                    values = np.ascontiguousarray(traces[col].values)
+                    conn.execute('INSERT INTO traces VALUES (?,?,?,?)',
+                                 (name, str(col), values.dtype.str, sqlite3.Binary(values.tobytes())))
+            
+            if spectrum is not None:
+                f = spectrum['freq'].values.astype(float)
+                for col in spectrum.columns:
+                    if col != 'freq':
+                        values = spectrum[col].values.astype(float)
+                        conn.executemany('INSERT INTO spectra VALUES (?,?,?,?)',
+                                         [(name, str(col), float(f[k]), number(values[k])) for k in range(values.shape[0])])
+            
+            conn.commit()
+        finally:
+            conn.close()
+    
+    
+    def where(self, filters, prefix=''):
+        """
+        Makes an SQL condition (and its values) from filters on the trials
+        table: {column: value}, or {column: [values]} for any of several.
+        """
+        clauses = []
+        values = []
+        for col in sorted(filters.keys()):
+            if col not in self.trialColumns:
+                raise ValueError("Can't filter on " + repr(col) + '.  Use one of ' + ', '.join(self.trialColumns) + '.')
+            value = filters[col]
+            if isinstance(value, (list, tuple, set)):
+                value = list(value)
+                clauses.append(prefix + col + ' IN (' + ','.join(['?']*len(value)) + ')')
+                values += value
+            else:
+                clauses.append(prefix + col + ' = ?')
+                values.append(value)
+        
+        if len(clauses) == 0:
+            return '', []
+        return ' WHERE ' + ' AND '.join(clauses), values
+    
+    
+    def query(self, sql, values=()):
+        """
+        Runs an SQL query on the store and returns the result as a
+        dataframe.
+        """
+        import pandas as pd
+        
+        conn = self.connect()
+        try:
+            return pd.read_sql_query(sql, conn, params=list(values))
+        finally:
+            conn.close()
+    
+    
+    def trials(self, **filters):
+        """
+        Returns the trials table, for the trials matching filters, e.g.
+        store.trials(testtype='flex', frequency=[1.0, 1.5]).
+        """
+        condition, values = self.where(filters)
+        return self.query('SELECT * FROM trials' + condition + ' ORDER BY trial', values)
+    
+    
+    def netValues(self, channels=None, **filters):
+        """
+        Returns the net values of the trials matching filters (see trials),
+        one row per trial, with its testtype, frequency and pitch.
+        
+        -channels - list of channels to return.  Default is None (all).
+        """
+        condition, values = self.where(filters, prefix='t.')
+        if channels is not None:
+            condition += (' AND ' if condition else ' WHERE ') + 'n.channel IN (' + ','.join(['?']*len(channels)) + ')'
+            values += list(channels)
+        
+        long = self.query('SELECT t.trial, t.testtype, t.frequency, t.pitch, n.channel, n.value '
+                          'FROM trials t JOIN net n ON n.trial = t.trial' + condition + ' ORDER BY t.trial', values)
+        
+        if long.shape[0] == 0:
+            return long
+        
+        #one column per channel
+        wide = long.pivot_table(index='trial', columns='channel', values='value', aggfunc='first', dropna=False)
+        wide.columns.name = None
+        info = long[['trial', 'testtype', 'frequency', 'pitch']].drop_duplicates('trial').set_index('trial')
+        return info.join(wide).reset_index()
+    
+    
+    def phaseAvgs(self, channels=None, **filters):
+        """
+        Returns the phase averages of the trials matching filters (see
+        trials), one row per trial, channel and bin.
+        
+        -channels - list of channels to return.  Default is None (all).
+        """
+        condition, values = self.where(filters, prefix='t.')
+        if channels is not None:
+            condition += (' AND ' if condition else ' WHERE ') + 'p.channel IN (' + ','.join(['?']*len(channels)) + ')'
+            values += list(channels)
+        
+        return self.query('SELECT t.trial, t.testtype, t.frequency, t.pitch, p.channel, p.bin, p.time, p.value '
+                          'FROM trials t JOIN phase p ON p.trial = t.trial' + condition + ' ORDER BY t.trial, p.channel, p.bin', values)
+    
+    
+    def spectra(self, channels=None, **filters):
+        """
+        Returns the power spectra of the trials matching filters (see
+        trials), one row per trial, channel and frequency.
+        
+        -channels - list of channels to return.  Default is None (all).
+        """
+        condition, values = self.where(filters, prefix='t.')
+        if channels is not None:
+            condition += (' AND ' if condition else ' WHERE ') + 's.channel IN (' + ','.join(['?']*len(channels)) + ')'
+            values += list(channels)
+        
+        return self.query('SELECT t.trial, t.testtype, t.frequency, t.pitch, s.channel, s.freq, s.psd '
+                          'FROM trials t JOIN spectra s ON s.trial = t.trial' + condition + ' ORDER BY t.trial, s.channel, s.freq', values)
+    
+    
+    def traces(self, trial, channels=None):
+        """
+        Returns a trial's full traces as a dataframe (empty if they weren't
+        stored).
+        
+        -channels - list of channels to return.  Default is None (all).
+        """
+        import numpy as np
+        import pandas as pd
+        
+        sql = 'SELECT channel, dtype, data FROM traces WHERE trial = ?'
+        values = [str(trial)]
+        if channels is not None:
+            sql += ' AND channel IN (' + ','.join(['?']*len(channels)) + ')'
+            values += list(channels)
+        
+        conn = self.connect()
+        try:
+            rows = conn.execute(sql, values).fetchall()
+        finally:
+            conn.close()
+        
+        df = pd.DataFrame()
+        for channel, dtype, data in rows:
+            df[str(channel)] = np.frombuffer(data, dtype=np.dtype(str(dtype)))
+        return df
+
+
+def codeVersion():
+    """
+    Finds the version of the analysis code: the SHA-1 hash of
+    Flapper_data_analysis.py and this file.
+    """
+    import os
+    import sys
+    import hashlib
+    import Flapper_data_analysis
+    
+    h = hashlib.sha1()
+    for module in [Flapper_data_analysis, sys.modules[__name__]]:
+        with open(os.path.splitext(module.__file__)[0] + '.py', 'rb') as f:
+            h.update(f.read())
+    
+    return h.hexdigest()
+
+
+def plainValue(x):
+    """
+    Makes a manifest value fit to save as JSON and compare later: numpy
+    numbers become python numbers, and blanks become None.
+    """
+    import numpy as np
+    
+    if isinstance(x, np.generic):
+        x = x.item()
+    if isinstance(x, float) and x != x:
+        return None
+    if x is None or isinstance(x, (bool, int, long, float, basestring)):
+        return x
+    return str(x)
+
+
+def recordPath(trial):
+    """
+    Returns the filepath of a trial's run record (see runRecord).
+    """
+    import os
+    
+    return os.path.join(str(trial['SavePath']), str(trial['trial']) + '_run.json')
+
+
+def runRecord(trial, settings, known=None):
+    """
+    Makes the record of everything a trial's results depend on: its row of
+    the manifest, the batch settings that change the results, the size,
+    modification time and SHA-1 hash of each of its combo files, and the
+    version of the code (see codeVersion).
+    
+    -known - an earlier record.  Files with the same size and modification
+        time as in it aren't hashed again.
+    """
+    import os
+    import json
+    import hashlib
+    
+    foilpath, rodpath = trialFiles(trial)
+    files = [foilpath]
+    if int(trial['rod']) == 1:
+        files.append(rodpath)
+    
+    if known is None:
+        known = {'files': {}}
+    
+    info = {}
+    for filepath in files:
+        stat = os.stat(filepath)
+        old = known['files'].get(filepath)
+        if old is not None and old['size'] == stat.st_size and old['mtime'] == stat.st_mtime:
+            info[filepath] = old
+            continue
+        
+        h = hashlib.sha1()
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        info[filepath] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': h.hexdigest()}
+    
+    record = {'row': dict((str(k), plainValue(v)) for k, v in trial.items()),
+              'settings': settings,
+              'files': info,
+              'code': codeVersion()}
+    
+    #as it will read back from the file
+    return json.loads(json.dumps(record))
+
+
+def upToDate(trial, settings):
+    """
+    Returns a trial's saved run record if its results are up to date -
+    nothing in the record has changed, and the output files are all still
+    there - or None if the trial needs to be run.
+    """
+    import os
+    import json
+    
+    try:
+        with open(recordPath(trial)) as f:
+            saved = json.load(f)
+        current = runRecord(trial, settings, known=saved)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+    
+    for name in ['row', 'settings', 'code']:
+        if saved[name] != current[name]:
+            return None
+    
+    for filepath in current['files']:
+        if saved['files'].get(filepath, {}).get('sha1') != current['files'][filepath]['sha1']:
+            return None
+    
+    for filepath in saved['outputs']:
+        if not os.path.exists(filepath):
+            return None
+    
+    return saved
+
+
+def saveRunRecord(trial, settings, outputs, net, rodAlignment=None):
+    """
+    Saves a trial's run record (see runRecord), with its output files, net
+    values and rod alignment (see FlapperData.combineWithRod), to SavePath
+    as trial_run.json.
+    """
+    import os
+    import json
+    import pandas as pd
+    
+    record = runRecord(trial, settings)
+    record['outputs'] = outputs
+    
+    net = pd.DataFrame(net)
+    record['net'] = dict((str(col), [plainValue(net[col].iloc[0])]) for col in net.columns)
+    
+    if rodAlignment is not None:
+        rodAlignment = dict((str(k), plainValue(v)) for k, v in rodAlignment.items())
+    record['rodAlignment'] = rodAlignment
+    
+    #write to a temporary file first, so a batch stopped partway never
+    #leaves a half-written record
+    filepath = recordPath(trial)
+    temp = filepath + '.' + str(os.getpid()) + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(record, f, indent=1, sort_keys=True)
+    os.rename(temp, filepath)
+
+
+def clearRunRecord(trial):
+    """
+    Deletes a trial's run record, if there is one, before its outputs are
+    written again.
+    """
+    import os
+    
+    try:
+        os.remove(recordPath(trial))
+    except OSError:
+        pass
+
+
+def analyzeTrial(trial, fmt='xlsx', cache=None, rods=None, schema=None, foilData=None, ci=0, nBoot=2000, store=None, storeTraces=0, record=None, spectrum=0, phase='rows', nBins=1000, align='heave', report=None):
+    """
+    Applies the methods in Flapper_data_analysis.py to analyze one trial.
+    
+    Input:
+    -trial - a dictionary holding one row of the spreadsheet described in
+        analyzeFlapperData
+    
+    -fmt - file format (extension) to save results in.  Default is 'xlsx'.
+        See saveTable in Flapper_data_analysis.py for the others.
+    
+    -cache - a TrialCache to re-use loaded and processed data from.
+        Default is None (no cache).
+    
+    -rods - a RodRegistry holding already processed rod data.  Default is
+        None (load and process the rod data for this trial only).
+    
+    -schema - the AcquisitionSchema of the combo files.  Default is None
+        (defaultSchema).
+    
+    -foilData - the foil combo file's data, already read (see Prefetcher).
+        Default is None (read the file here).
+    
+    -ci, nBoot - confidence level and number of replicates for bootstrap
+        confidence intervals on the net and phase-averaged values (see
+        FlapperData.netValue).  Default is 0 (none).
+    
+    -store - a ResultStore to also add the results to.  Default is None.
+    
+    -storeTraces - set to 1 to add the full processed traces to the store
+        too.  Default is 0.
+    
+    -record - the batch settings to save a run record with (see
+        runRecord), once the trial is done.  Default is None (no record).
+    
+    -spectrum - set to 1 to also save the power spectra of the raw force
+        and torque channels (see FlapperData.spectrum), and print the
+        cutoff frequency they suggest.  With a cache, the spectra are
+        cached with the data, so they aren't found again.  Default is 0.
+    
+    -phase, nBins - how to cut the data into cycles for the net and
+        phase-averaged values (see FlapperData.phaseAvg).  Default is
+        'rows' (and 1000 phases per cycle for 'freq' or 'heave').
+    
+    -align - how to line up the rod data with the foil data (see
+        FlapperData.combineWithRod).  Default is 'heave'.
+    
+    -report - a dictionary to add how the rod data were lined up to, under
+        'rodAlignment' (see FlapperData.combineWithRod; None without rod
+        data).  Default is None.
+        
+    Returns the net values found for the trial.
+    """
+    
+    if schema is None:
+        schema = defaultSchema
+    
+    #Determine if rod data will be analyzed
+    r = int(trial['rod'])
+    
+    #Determine if forces need to be resolved
+    res = int(trial['resolve'])
+    
+    #find the foil and rod data files
+    foilpath, rodpath = trialFiles(trial)
+    files = [foilpath]
+    if r == 1:
+        files.append(rodpath)
+    
+    #Use the batch's shared rod data, if it's there
+    sharedRod = None
+    if r == 1 and rods is not None:
+        sharedRod = rods.get(rodpath, trial['frequency'], trial['pitch'], res, 7)
+    
+    #Only process the rod data here if it isn't shared
+    if sharedRod is None:
+        rodProc = r
+    else:
+        rodProc = 0
+
+    #The outputs wanted: with the rod subtracted if rod is included,
+    #otherwise filtered (and resolved, if needed) forces and torque
+    filtered = ['Tz_filt']
+    if res == 1:
+        filtered = ['Res_Fx_filt', 'Res_Fy_filt'] + filtered
+    else:
+        filtered = ['Fx_filt', 'Fy_filt'] + filtered
+
+    if r == 1:
+        columns = ['Fx_noRod', 'Fy_noRod', 'Tz_noRod']
+    else:
+        columns = filtered
+
+    #The processing stages, in order, with the parameters each one (and
+    #all earlier stages) depends on and the columns it makes.  The pipeline
+    #works out the rest; the stages are where the cache saves its copies.
+    params = {'freq': float(trial['frequency']), 'pitch': int(trial['pitch']), 'rod': r,
+              'sharedRod': sharedRod is not None, 'phase': phase, 'nBins': int(nBins),
+              'schema': (schema.fs, schema.duration, sorted(schema.channels.items()), sorted(schema.dropped))}
+    stages = [('loaded', dict(params), [])]
+
+    #If forces need to be resolved,
+    if res == 1:
+        params['resolved'] = 1
+        stages.append(('resolved', dict(params), ['Res_Fx', 'Res_Fy']))
+
+    params['resolved'] = res
+    params['cutoffFreq'] = 7
+    stages.append(('filtered', dict(params), filtered))
+
+    #If rod is included,
+    if r == 1:
+        params['align'] = align
+        stages.append(('rodSubtracted', dict(params), columns))
+    
+    #If spectra are wanted, cache them with the data
+    if spectrum == 1:
+        params['spectrum'] = 1
+        stages.append(('spectra', dict(params), []))
+    
+    def spectra(dataSet):
+        """
+        A helper-code that finds the spectra of the raw forces and torques
+        (and the rod's, on the same frequencies).  Spectra already kept in
+        dataSet are re-used.  Returns them and the segment length used.
+        """
+        n = dataSet.foilData.shape[0]
+        if r == 1:
+            n = min(n, dataSet.rodData.shape[0])
+        rows = segmentLength(n, trial['frequency'], schema.fs)
+        
+        psd = dataSet.spectrum(trial['frequency'], nperseg = rows).copy()
+        if r == 1:
+            rodPsd = dataSet.spectrum(trial['frequency'], rod = 1, nperseg = rows)
+            for col in rodPsd.columns:
+                if col != 'freq':
+                    psd[col+'_rod'] = rodPsd[col].values
+        
+        return psd, rows
+    
+    #Start from the latest stage that's already in the cache
+    dataSet = None
+    done = 0
+    if cache is not None:
+        keys = [cache.key(stage, files, stageParams) for (stage, stageParams, made) in stages]
+        for k in range(len(stages), 0, -1):
+            dataSet = cache.get(keys[k-1])
+            if dataSet is not None:
+                done = k
+                print str(trial['trial']) + ' loaded from cache (' + stages[k-1][0] + ').'
+                print ''
+                break
+    
+    #Run the rest of the stages
+    for k in range(done, len(stages)):
+        stage, stageParams, made = stages[k]
+
+        if stage == 'loaded':
+            #import foil and rod data, using the foil data already read if
+            #it's there
+            if foilData is None:
+                foilData = foilpath
+            dataSet = FlapperData(foilData,
+                             freq=trial['frequency'],
+                             pitch = trial['pitch'],
+                             rod = r,
+                             rodpath = rodpath,
+                             rodData = sharedRod,
+                             schema = schema
+                             )
+
+            #Note how the shared rod data were processed
+            if sharedRod is not None:
+                dataSet.computed['rod'] = dict(rods.computed[rods.key(rodpath, trial['frequency'], trial['pitch'], res, 7)])
+
+            #Indicate dataSet is loaded
+            print str(trial['trial']) + ' is loaded.'
+            print ''
+            print dataSet
+            print ''
+
+        elif stage == 'spectra':
+            #Find the spectra, so they're kept in dataSet when it's cached
+            spectra(dataSet)
+
+        else:
+            #Compute the stage's columns, for the rod data too if it's
+            #processed here
+            pipe = FlapperPipeline(dataSet, cutoffFreq = 7, resolved = res, align = align)
+            if rodProc == 1 and stage != 'rodSubtracted':
+                pipe.require(made, 'rod')
+            pipe.require(made)
+
+        #Save the stage for next time
+        if cache is not None:
+            cache.put(keys[k], dataSet)
+
+    #Set up the pipeline for further analysis; columns already made are
+    #not computed again
+    pipe = FlapperPipeline(dataSet, cutoffFreq = 7, resolved = res, align = align)
+
+    #Check the number of cycles against the data ('auto' or blank uses
+    #every whole cycle)
+    nCycles = dataSet.chooseCycles(trial['frequency'], trial['nCycles'], phase = phase)
+
+    #The files to save to
+    outputs = [str(trial['SavePath']) + '/' + str(trial['trial']) + '_netValue_resfix_' + str(nCycles) + 'reps.' + fmt,
+               str(trial['SavePath']) + '/' + str(trial['trial']) + '_phaseAvg_wstdev_resfix_' + str(nCycles) + 'reps.' + fmt,
+               str(trial['SavePath']) + '/' + str(trial['trial']) + '_resfix.' + fmt]
+    if r == 1:
+        outputs.append(str(trial['SavePath']) + '/rod/' + str(trial['trial']) + '_resfix_rod.' + fmt)
+    if spectrum == 1:
+        outputs.append(str(trial['SavePath']) + '/' + str(trial['trial']) + '_spectrum.' + fmt)
+
+    #The old run record no longer holds once the files change
+    if record is not None:
+        clearRunRecord(trial)
+
+    #Find and save the net values for Fx, Fy, and Tz
+    net = pipe.netValue(columns, 
+                     trial['frequency'], 
+                     nCycles, 
+                     rod = 0,
+                     save = 1,
+                     filepath = outputs[0],
+                     phase = phase,
+                     ci = ci,
+                     nBoot = nBoot
+                     )
+
+    #Find and save the phase-averaged traces for Fx, Fy, and Tz
+    phase = pipe.phaseAvg(columns,
+                     trial['frequency'], 
+                     nCycles, 
+                     outputs[1],
+                     rod = 0,
+                     phase = phase,
+                     nBins = nBins,
+                     ci = ci,
+                     nBoot = nBoot
+                     )
+
+    #Save out the analyzed data
+    dataSet.saveOut(outputs[2],
+                    rod = r,
+                    rodpath = str(trial['SavePath']) + '/rod/' + str(trial['trial']) + '_resfix_rod.' + fmt
+                    )
+    
+    #Find and save the spectra of the raw forces and torques (and the
+    #rod's, on the same frequencies), and suggest a cutoff frequency
+    psd = None
+    if spectrum == 1:
+        psd, rows = spectra(dataSet)
+        
+        saveTable(psd, outputs[-1])
+        print 'Saved file as ' + outputs[-1].split('/')[-1]
+        print 'Suggested cutoff frequency: ' + str(dataSet.suggestCutoff(trial['frequency'], nperseg = rows)) + ' Hz (7 Hz used)'
+    
+    #How the rod data were lined up
+    if r == 1:
+        rodAlignment = dataSet.rodAlignment
+    else:
+        rodAlignment = None
+    if report is not None:
+        report['rodAlignment'] = rodAlignment
+    
+    #Add the results to the batch's store
+    if store is not None:
+        if storeTraces == 1:
+            traces = dataSet.frame()
+        else:
+            traces = None
+        store.add(trial, net=net, phaseAvg=phase, traces=traces, nCycles=nCycles, fs=schema.fs, spectrum=psd,
+                  rodAlignment=rodAlignment)
+    
+    #Note what the results were made from, so they aren't made again
+    if record is not None:
+        saveRunRecord(trial, record, outputs, net, rodAlignment)
+    
+    return net
+
+
+def _runTrial(trial, fmt='xlsx', cache=None, schema=None, profile=0, foilData=None, ci=0, nBoot=2000, store=None, storeTraces=0, record=None, spectrum=0, phase='rows', nBins=1000, align='heave'):
+    """
+    Runs analyzeTrial, catching any error so one bad trial doesn't stop the
+    rest of the batch.  Returns a dictionary with the trial name, status
+    ('ok' or 'error'), net values, rod alignment (see analyzeTrial), and
+    error message.  With profile = 1,
+    it also holds the trial's profiling records ('profile') - one for each
+    stage, and a 'trial' record for the whole trial.
+    """
+    import time
+    import traceback
+
+    if profile == 1:
+        profiler = enableProfiling(Profiler(trial=trial['trial']))
+        mem = currentMemory()
+        t = time.time()
+
+    report = {}
+    try:
+        net = analyzeTrial(trial, fmt=fmt, cache=cache, rods=_sharedRods, schema=schema, foilData=foilData, ci=ci, nBoot=nBoot,
+                           store=store, storeTraces=storeTraces, record=record, spectrum=spectrum, phase=phase, nBins=nBins,
+                           align=align, report=report)
+        outcome = {'trial': trial['trial'], 'status': 'ok', 'net': net, 'rodAlignment': report.get('rodAlignment'), 'error': ''}
+    except Exception:
+        outcome = {'trial': trial['trial'], 'status': 'error', 'net': None, 'rodAlignment': None, 'error': traceback.format_exc()}
+
+    if profile == 1:
+        disableProfiling()
+        profiler.record('trial', time.time() - t, 0, currentMemory() - mem)
+        outcome['profile'] = profiler.records
+
+    return outcome
+
+
+def analyzeFlapperData(files, workers=1, fmt='xlsx', cacheDir='none', cacheSize=2000, shareRods=1, schema=None, profile=0, profilePath='none', prefetch=2, strict=0, ci=0, nBoot=2000, storePath='none', storeTraces=0, incremental=0, spectrum=0, phase='rows', nBins=1000, align='heave'):
     """
     Takes the files and associated information, and applies the methods in
     Flapper_data_analysis.py to analyze the data.
     
     Input:
-    -files - an Excel spreadsheet containing information in the following
-        columns:
+    -files - a manifest of the trials - an Excel spreadsheet, or a .csv,
+        .json or .yaml file (see readManifest) - containing information in
+        the following columns:
         
         -trial - the trial name
         -testtype - (optional) - if there are test categories, ID what type here
@@ -29,133 +1316,242 @@ def analyzeFlapperData(files):
         -rodpath - filepath where the rod data combo file can be found
         -frequency - flapping frequency
         -nCycles - number of cycles of data to use in calculating net values 
-            AND phase-averaging
+            AND phase-averaging.  Enter 'auto' (or leave blank) to use every
+            whole cycle in the data; too many cycles are cut back, with a
+            warning.
         -SavePath - path where analyzed data should be saved
+    
+    -workers - number of processes to analyze trials in.  Default is 1 (one
+        trial after another).  Trials are independent, so set to the number
+        of CPU cores to analyze several at once.
+    
+    -fmt - file format (extension) to save results in.  Default is 'xlsx'.
+        'parquet', 'feather' or 'npz' files are much faster to write and
+        read back.  See saveTable in Flapper_data_analysis.py.
+    
+    -cacheDir - folder to cache loaded and processed data in (see
+        TrialCache).  Default is 'none' (no cache).  When set, trials whose
+        combo files and settings haven't changed since an earlier run are
+        not loaded and processed again.
+    
+    -cacheSize - largest size of the cache, in MB.  Default is 2000.
+    
+    -shareRods - default is 1: each distinct rod file (and settings) is
+        loaded and processed once for the whole batch and shared by the
+        trials that use it (see RodRegistry).  Set to 0 to process the rod
+        data separately for every trial.
+    
+    -schema - an AcquisitionSchema describing how the combo files were
+        recorded (sampling frequency, etc.).  Default is None
+        (defaultSchema: 1000 Hz).
+
+    -profile - default is 0 (off).  Set to 1 to record the wall time, rows
+        and change in memory use of each stage (loading, each FlapperData
+        method, saving files) of each trial, and print a summary table,
+        slowest stages first, at the end of the batch.  See Profiler in
+        Flapper_data_analysis.py.
+
+    -profilePath - when profile = 1, a .csv or .json file to save every
+        record to.  Default is 'none' (summary only).
+    
+    -prefetch - number of trials ahead to read combo files for, on
+        background threads, while a trial is analyzed (see Prefetcher).
+        Default is 2; set to 0 to read each file when its trial starts.
+        Used when workers = 1.
+    
+    -strict - the manifest is checked before any trial runs (see
+        loadManifest).  Default is 0: trials whose files are missing are
+        listed, then fail on their own.  Set to 1 to stop before starting
+        instead.
+    
+    -ci - confidence level, e.g. 0.95, for bootstrap confidence intervals
+        on each trial's net and phase-averaged values, saved alongside them
+        (see FlapperData.netValue).  Default is 0 (none).
+    
+    -nBoot - number of bootstrap replicates when ci is set.  Default is
+        2000.
+    
+    -storePath - an SQLite file to also add every trial's net values and
+        phase averages to (see ResultStore), for comparing trials with one
+        query, e.g. ResultStore(storePath).netValues(testtype='flex').
+        Trials already in it are replaced; others are kept.  Default is
+        'none'.
+    
+    -storeTraces - set to 1 to also add the full processed traces to the
+        store.  Default is 0.
+    
+    -incremental - default is 0 (run every trial).  Set to 1 to skip
+        trials whose results are up to date.  Each finished trial leaves a
+        run record (trial_run.json) in its SavePath, noting its manifest
+        row, the settings above that change results, the hashes of its
+        combo files, the version of the code, and its output files.  A
+        trial runs again if any of these has changed (or an output is
+        gone).  A batch that stopped partway picks up where it left off,
+        since unfinished trials have no record.
+    
+    -spectrum - set to 1 to also save each trial's power spectra (Welch
+        PSDs of the raw force and torque channels, and the rod's) as
+        trial_spectrum, add them to the store, and print the cutoff
+        frequency they suggest (see FlapperData.suggestCutoff).  Default
+        is 0.
+    
+    -phase - how to cut each trial into cycles for its net and
+        phase-averaged values.  Default is 'rows' (cycles of fs/freq rows,
+        rounded).  Set to 'freq' or 'heave' to find the phase of every row
+        and interpolate each cycle onto nBins phases, which keeps
+        non-integer periods (e.g. 1.7 Hz at 1000 Hz) exact.  See
+        FlapperData.phaseAvg.
+    
+    -nBins - number of phases per cycle when phase is 'freq' or 'heave'.
+        Default is 1000.
+    
+    -align - how to line up each trial's rod data with its foil data.
+        Default is 'heave' (match the first foil heave position).  Set to
+        'xcorr' to match the whole heave trace instead, which copes with
+        noisy encoder data.  See FlapperData.combineWithRod.
+
+    Returns a list with a dictionary for each trial (in spreadsheet order)
+    giving the trial name, status ('ok', 'error' or 'skipped' - up to
+    date), net values, rod alignment ('rodAlignment': the method, the lag
+    in rows and a confidence score, or None without rod data), and error
+    message.  Trials whose rod alignment confidence is below 0.9 are listed
+    at the end.  A trial that fails is reported and skipped; the rest of the
+    batch still runs.
         
     Note that this code was custom-written for KL's use and reflects the
     defaults she required.
     """
     #Import useful packages
     import pandas as pd
+    from functools import partial
 
     
-    #load the file directory
-    fileSet = pd.ExcelFile(files)
-    fileSet = fileSet.parse('Sheet1', index_col=None)
+    #load and check the file directory, one dictionary per row
+    trials = loadManifest(files, strict=strict)
+    
+    #set up the cache of processed data
+    if cacheDir != 'none':
+        cache = TrialCache(cacheDir, maxSize=cacheSize)
+    else:
+        cache = None
+    
+    #and the store of results
+    if storePath != 'none':
+        store = ResultStore(storePath)
+    else:
+        store = None
     
-    #run analysis on each trial
-    for i in range(0,len(fileSet.trial)):
+    #find the trials that are already up to date
+    done = {}
+    if incremental == 1:
+        if schema is None:
+            used = defaultSchema
+        else:
+            used = schema
+        settings = {'schema': [used.fs, used.duration, sorted(used.channels.items()), sorted(used.dropped)],
+                    'fmt': fmt, 'ci': ci, 'nBoot': nBoot, 'storePath': storePath, 'storeTraces': storeTraces,
+                    'spectrum': spectrum, 'phase': phase, 'nBins': nBins, 'align': align}
         
-        #import foil and rod data
-        dataSet = FlapperData(str(fileSet.path[i]) + '/' + str(fileSet.name[i]) + '.xls',
-                         freq=fileSet.frequency[i],
-                         pitch = fileSet.pitch[i],
-                         rod = fileSet.rod[i],
-                         rodpath = str(fileSet.rodpath[i]) + '/' + str(fileSet.rodname[i]) + '.xls'
-                         )
+        for i, trial in enumerate(trials):
+            saved = upToDate(trial, settings)
+            if saved is not None:
+                done[i] = saved
         
-        #Indicate dataSet is loaded
-        print str(fileSet.trial[i]) + ' is loaded.'
+        print str(len(done)) + ' of ' + str(len(trials)) + ' sets are up to date.'
         print ''
-        print dataSet
-        print ''
-        
-        #Determine if rod data will be analyzed
-        r = fileSet.rod[i]
-        
-        #If forces need to be resolved,
-        if fileSet.resolve[i] == 1:
-            
-            #Resolve forces
-            dataSet.resolveForces(rod = r)
-            
-            #Filter the resolved dataset
-            dataSet.filterData(cutoffFreq = 7, resolved = 1, rod = r)
-            
-            #If rod is included,
-            if r == 1:
-                
-                #Subtract out the rod
-                dataSet.combineWithRod(resolved = 1)
-                
-                #Set columns of interest for further analysis
-                columns = ['Fx_noRod', 'Fy_noRod', 'Tz_noRod']
-          
-            #If rod is not included
-            else:
-                
-                #Set a different set of columns of interest
-                columns = ['Res_Fx_filt', 'Res_Fy_filt', 'Tz_filt']
-            
-
-            #Find and save the net values for Fx, Fy, and Tz
-            dataSet.netValue(columns, 
-                             fileSet.frequency[i], 
-                             fileSet.nCycles[i], 
-                             rod = 0,
-                             save = 1,
-                             filepath = str(fileSet.SavePath[i]) + '/' + str(fileSet.trial[i]) + '_netValue_resfix_' + str(fileSet.nCycles[i]) + 'reps.xlsx'
-                             )
+    else:
+        settings = None
+    
+    #the trials to run
+    todo = [trial for i, trial in enumerate(trials) if i not in done]
+    
+    #collect profiling records from every trial
+    if profile == 1:
+        profiler = enableProfiling(Profiler(trial='shared rods'))
 
-            #Find and save the phase-averaged traces for Fx, Fy, and Tz
-            dataSet.phaseAvg(columns,
-                             fileSet.frequency[i], 
-                             fileSet.nCycles[i], 
-                             str(fileSet.SavePath[i]) + '/' + str(fileSet.trial[i]) + '_phaseAvg_wstdev_resfix_' + str(fileSet.nCycles[i]) + 'reps.xlsx',
-                             rod = 0
-                             )
+    #load and process each distinct rod file once, resolving them together
+    rods = RodRegistry(schema)
+    if shareRods == 1:
+        rods.addAll([(trialFiles(trial)[1],
+                      trial['frequency'], trial['pitch'], trial['resolve'], 7)
+                     for trial in todo if trial['rod'] == 1])
+    _shareRods(rods)
 
-            #Save out the analyzed data
-            dataSet.saveOut(str(fileSet.SavePath[i]) + '/' + str(fileSet.trial[i]) + '_resfix.xlsx',
-                            rod = r,
-                            rodpath = str(fileSet.SavePath[i]) + '/rod/' + str(fileSet.trial[i]) + '_resfix_rod.xlsx'
-                            )
+    if profile == 1:
+        disableProfiling()
 
-        #if forces do not need to be resolved:
-        else:    
-            
-            #Filter unresolved data
-            dataSet.filterData(cutoffFreq = 7, resolved = 0, rod = r)
+    #run analysis on each trial, in turn or in several processes at once.
+    #Either way, results come back in spreadsheet order.
+    runTrial = partial(_runTrial, fmt=fmt, cache=cache, schema=schema, profile=profile, ci=ci, nBoot=nBoot,
+                       store=store, storeTraces=storeTraces, record=settings, spectrum=spectrum, phase=phase, nBins=nBins,
+                       align=align)
+    reader = None
+    if workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(workers, initializer=_shareRods, initargs=(rods,))
+        outcomes = pool.imap(runTrial, todo)
+    
+    #reading the next trials' files in the background
+    elif prefetch > 0:
+        pool = None
+        reader = Prefetcher(todo, schema=schema, depth=prefetch)
+        outcomes = (runTrial(trial, foilData=reader.get(i)) for i, trial in enumerate(todo))
+    
+    else:
+        pool = None
+        outcomes = (runTrial(trial) for trial in todo)
+    
+    results = []
+    try:
+        for i, trial in enumerate(trials):
+            #up-to-date trials report their saved net values
+            if i in done:
+                outcome = {'trial': trial['trial'], 'status': 'skipped', 'net': pd.DataFrame(done[i]['net']),
+                           'rodAlignment': done[i].get('rodAlignment'), 'error': ''}
+            else:
+                outcome = next(outcomes)
             
-            #If rod is included,
-            if r == 1:
-                
-                #Subtract out the rod
-                dataSet.combineWithRod(resolved = 0)
-                
-                #Set columns of interest for further analysis
-                columns = ['Fx_noRod', 'Fy_noRod', 'Tz_noRod']
+            results.append(outcome)
+            if profile == 1 and 'profile' in outcome:
+                profiler.records.extend(outcome['profile'])
             
-            #if rod is not included,
+            #Indicate set done and current progress
+            if outcome['status'] == 'ok':
+                print 'Completed ' + str(outcome['trial'])
+            elif outcome['status'] == 'skipped':
+                print str(outcome['trial']) + ' is up to date.'
             else:
-                
-                #Set a different set of columns of interest
-                columns = ['Fx_filt', 'Fy_filt', 'Tz_filt']
-
-            #Find and save the net values for Fx, Fy, and Tz
-            dataSet.netValue(columns, 
-                             fileSet.frequency[i], 
-                             fileSet.nCycles[i], 
-                             rod = 0,
-                             save = 1,
-                             filepath = str(fileSet.SavePath[i]) + '/' + str(fileSet.trial[i]) + '_netValue_resfix_' + str(fileSet.nCycles[i]) + 'reps.xlsx'
-                             )
+                print 'FAILED ' + str(outcome['trial']) + ':'
+                print outcome['error']
+            print str(i+1) + ' of ' + str(len(trials)) + ' sets complete.'
+            print ''
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if reader is not None:
+            reader.close()
+    
+    #Summarize any failures
+    failed = [outcome['trial'] for outcome in results if outcome['status'] == 'error']
+    if len(failed) > 0:
+        print str(len(failed)) + ' of ' + str(len(trials)) + ' sets failed: ' + ', '.join([str(f) for f in failed])
+        print ''
 
-            #Find and save the phase-averaged traces for Fx, Fy, and Tz
-            dataSet.phaseAvg(columns,
-                             fileSet.frequency[i], 
-                             fileSet.nCycles[i], 
-                             str(fileSet.SavePath[i]) + '/' + str(fileSet.trial[i]) + '_phaseAvg_wstdev_resfix_' + str(fileSet.nCycles[i]) + 'reps.xlsx',
-                             rod = 0
-                             )
+    #and any rod data that didn't line up well
+    doubtful = [str(outcome['trial']) + ' (' + str(round(outcome['rodAlignment']['confidence'], 3)) + ')'
+                for outcome in results if outcome.get('rodAlignment') is not None and outcome['rodAlignment']['confidence'] < 0.9]
+    if len(doubtful) > 0:
+        print 'Rod alignment confidence below 0.9: ' + ', '.join(doubtful)
+        print ''
 
-            #Save out the analyzed data
-            dataSet.saveOut(str(fileSet.SavePath[i]) + '/' + str(fileSet.trial[i]) + '_resfix.xlsx',
-                            rod = r,
-                            rodpath = str(fileSet.SavePath[i]) + '/rod/' + str(fileSet.trial[i]) + '_resfix_rod.xlsx'
-                            )
+    #Summarize where the time went
+    if profile == 1:
+        print 'Time (s), rows, and memory change (MB) by stage:'
+        print profiler.summary()
+        print ''
+        if profilePath != 'none':
+            profiler.report(profilePath)
+            print 'Saved profile as ' + profilePath.split('/')[-1]
 
-        #Indicate set done and current progress
-        print 'Completed ' + str(fileSet.trial[i])
-        print str(i+1) + ' of ' + str(len(fileSet.trial)) + ' sets complete.'
-        print ''
\ No newline at end of file
+    return results
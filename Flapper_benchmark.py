@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for Flapper_data_analysis.py and Flapper_analysis_wrapper.py.
+
+Makes synthetic combo files (same columns as the real ones), times
+loading them (the original read-drop-rename against loadCombo), each
+FlapperData method and analyzeFlapperData across data sizes and numbers
+of trials, and saves wall times and peak memory use to a JSON file.
+Compare a new run to a saved baseline with compareBenchmarks to see if
+anything got slower.
+
+Run from the command line with:
+
+    python Flapper_benchmark.py benchmark.json [baseline.json]
+
+
+"""
+
+#Columns of a combo file, in the order the acquisition software writes them
+comboHeaders = ['Fx (N)',
+                'Fy (N)',
+                'Fz (N)',
+                'Tx (N-mm)',
+                'Ty (N-mm)',
+                'Tz (N-mm)',
+                'Pressure 1 Ai2',
+                'Pressure 2 Ai3',
+                'Pressure 3 Ai4',
+                'Pressure 4 Ai5',
+                'X axis encoder 6602 degrees',
+                'Y axis encoder 6602 meters',
+                'digital in loop start 6221',
+                'camera trigger echo 6221',
+                'Loop Pulse']
+
+
+def makeCombo(filepath, freq=1.0, duration=10., fs=1000., pitch=1, pitchAmp=20., heaveAmp=0.02, noise=0.5, phase=0., seed=0):
+    """
+    Writes a synthetic combo file: sinusoidal pitch and heave encoder
+    traces, with forces and torques at twice the flapping frequency plus
+    random noise.
+
+    Input:
+
+    -filepath - where to write the file
+
+    -freq - flapping frequency, in Hz.  Default is 1.0.
+
+    -duration - length of the recording, in seconds.  Default is 10.
+
+    -fs - sampling frequency, in Hz.  Default is 1000.
+
+    -pitch - default is 1 (pitch the foil by pitchAmp degrees).  Set to 0
+        for a heave only program.
+
+    -pitchAmp, heaveAmp - pitch (degrees) and heave (m) amplitudes.
+        Defaults are 20 and 0.02.
+
+    -noise - standard deviation of the noise added to forces and torques.
+        Default is 0.5.
+
+    -phase - phase of the motion at the first row, in radians.  Default is
+        0.  Use a different phase for rod files so they have to be lined
+        up with the foil data.
+
+    -seed - random seed, so the same file is made every time.  Default is 0.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.RandomState(seed)
+    n = int(round(duration*fs))
+
+    #phase of the motion at each row
+    w = 2*np.pi*freq*np.arange(n)/float(fs) + phase
+
+    data = {}
+
+    #encoders - pitch leads heave by a quarter cycle; heave has a small
+    #offset, like a real rig
+    data['X axis encoder 6602 degrees'] = pitch*pitchAmp*np.cos(w)
+    data['Y axis encoder 6602 meters'] = heaveAmp*np.sin(w) + 0.001
+
+    #forces and torques
+    for k, col in enumerate(['Fx (N)', 'Fy (N)', 'Fz (N)', 'Tx (N-mm)', 'Ty (N-mm)', 'Tz (N-mm)']):
+        data[col] = (k+1)*np.sin(2*w + k) + noise*rng.randn(n)
+
+    #everything else is just noise
+    for col in comboHeaders:
+        if col not in data:
+            data[col] = rng.randn(n)
+
+    pd.DataFrame(data, columns=comboHeaders).to_csv(filepath, sep='\t', index=False)
+
+
+def makeTrials(folder, nTrials, freq=1.0, duration=10., fs=1000., rod=1, resolve=1, nCycles='auto'):
+    """
+    Writes nTrials synthetic foil combo files, one rod combo file, and a
+    spreadsheet describing them (see analyzeFlapperData) to folder.
+    Results are set to be saved in folder/out.
+
+    Returns the spreadsheet's filepath.
+    """
+    import os
+    import pandas as pd
+
+    for sub in ['out', os.path.join('out', 'rod')]:
+        if not os.path.isdir(os.path.join(folder, sub)):
+            os.makedirs(os.path.join(folder, sub))
+
+    #use most of the recording, leaving room to line up the rod data
+    if nCycles == 'auto':
+        nCycles = max(1, int(duration*freq) - 1)
+
+    makeCombo(os.path.join(folder, 'rod.xls'), freq, duration, fs, phase=1.0, seed=nTrials)
+
+    rows = []
+    for i in range(nTrials):
+        name = 'trial' + str(i)
+        makeCombo(os.path.join(folder, name + '.xls'), freq, duration, fs, seed=i)
+        rows.append({'trial': name, 'testtype': 'benchmark', 'name': name, 'path': folder,
+                     'pitch': 1, 'resolve': resolve, 'rod': rod, 'rodname': 'rod', 'rodpath': folder,
+                     'frequency': freq, 'nCycles': nCycles, 'SavePath': os.path.join(folder, 'out')})
+
+    files = os.path.join(folder, 'trials.xlsx')
+    columns = ['trial', 'testtype', 'name', 'path', 'pitch', 'resolve', 'rod', 'rodname', 'rodpath',
+               'frequency', 'nCycles', 'SavePath']
+    pd.DataFrame(rows, columns=columns).to_excel(files, sheet_name='Sheet1', index=False)
+
+    return files
+
+
+def peakRSS():
+    """
+    Peak memory use (resident set size) of this process so far, in MB.
+    None where it can't be measured (Windows).
+    """
+    import sys
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    #kB on Linux, bytes on macOS
+    if sys.platform == 'darwin':
+        return peak/1e6
+    return peak/1e3
+
+
+def _isolated(func, args, queue):
+    """
+    Runs func(*args) in a separate process (see isolated), quietly, and
+    passes back its result or error.
+    """
+    import os
+    import sys
+    import traceback
+
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        queue.put(('ok', func(*args)))
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
+
+
+def isolated(func, *args):
+    """
+    Runs func(*args) in a new process and returns its result, so each
+    benchmark's peak memory use is measured on its own rather than on top
+    of the ones before.  func must be a module-level function.
+    """
+    from multiprocessing import Process, Queue
+
+    queue = Queue()
+    proc = Process(target=_isolated, args=(func, args, queue))
+    proc.start()
+    status, result = queue.get()
+    proc.join()
+
+    if status == 'error':
+        raise RuntimeError('Benchmark failed:\n' + result)
+    return result
+
+
+def _loadTimes(filepath, method):
+    """
+    Times loading one combo file, either the original way ('readDropRename'
+    - read every column, parsed to floats, then drop the unneeded ones and
+    rename the rest) or with loadCombo ('loadCombo', which only reads the
+    needed columns).  Returns {'wall': s, 'peakRSS':
+    MB, 'startRSS': MB}; startRSS is the peak memory use before loading, so
+    peakRSS - startRSS is what loading took.
+    """
+    import time
+    import pandas as pd
+    from Flapper_data_analysis import loadCombo, comboColumns, droppedColumns
+
+    start = peakRSS()
+    t = time.time()
+
+    if method == 'readDropRename':
+        df = pd.read_csv(filepath, delimiter='\t')
+        df = df.drop(droppedColumns, axis=1)
+        df = df.rename(columns=comboColumns)
+    elif method == 'loadCombo':
+        df = loadCombo(filepath)
+    else:
+        raise ValueError("method must be 'readDropRename' or 'loadCombo', not " + repr(method))
+
+    return {'wall': time.time() - t, 'peakRSS': peakRSS(), 'startRSS': start}
+
+
+def _methodTimes(folder, duration, freq, fs, fmt):
+    """
+    Times each FlapperData method, in the order the wrapper uses them, on
+    one synthetic trial.  Returns {method: {'wall': s, 'peakRSS': MB}};
+    peakRSS is the peak memory use of the process up to the end of the
+    method.
+    """
+    import os
+    import time
+    from Flapper_data_analysis import FlapperData, AcquisitionSchema
+
+    schema = AcquisitionSchema(fs=fs)
+    foil = os.path.join(folder, 'trial0.xls')
+    rod = os.path.join(folder, 'rod.xls')
+    out = os.path.join(folder, 'out')
+    nCycles = max(1, int(duration*freq) - 1)
+    columns = ['Fx_noRod', 'Fy_noRod', 'Tz_noRod']
+
+    times = {'start': {'wall': 0., 'peakRSS': peakRSS()}}
+
+    def timed(name, func, *args, **kwargs):
+        t = time.time()
+        result = func(*args, **kwargs)
+        times[name] = {'wall': time.time() - t, 'peakRSS': peakRSS()}
+        return result
+
+    dataSet = timed('load', FlapperData, foil, freq, pitch=1, rod=1, rodpath=rod, schema=schema)
+    timed('resolveForces', dataSet.resolveForces, rod=1)
+    timed('filterData', dataSet.filterData, 7, resolved=1, rod=1)
+    timed('combineWithRod', dataSet.combineWithRod, resolved=1)
+    timed('findPhase', dataSet.findPhase, freq)
+    timed('netValue', dataSet.netValue, columns, freq, nCycles)
+    timed('phaseAvg', dataSet.phaseAvg, columns, freq, nCycles, os.path.join(out, 'phaseAvg.' + fmt))
+    timed('saveOut', dataSet.saveOut, os.path.join(out, 'trial0.' + fmt), rod=1, rodpath=os.path.join(out, 'rod', 'rod.' + fmt))
+
+    return times
+
+
+def _batchTime(files, workers, fmt, fs):
+    """
+    Times analyzeFlapperData on a spreadsheet of trials.  Returns
+    {'wall': s, 'peakRSS': MB, 'failed': number of trials that failed}.
+    """
+    import time
+    from Flapper_analysis_wrapper import analyzeFlapperData
+    from Flapper_data_analysis import AcquisitionSchema
+
+    t = time.time()
+    results = analyzeFlapperData(files, workers=workers, fmt=fmt, schema=AcquisitionSchema(fs=fs))
+    wall = time.time() - t
+
+    failed = len([outcome for outcome in results if outcome['status'] == 'error'])
+    return {'wall': wall, 'peakRSS': peakRSS(), 'failed': failed}
+
+
+def runBenchmarks(filepath='none', durations=[10, 60, 300], trialCounts=[1, 4, 16], freq=1.0, fs=1000., workers=1, fmt='xlsx', folder='none'):
+    """
+    Runs the benchmarks and saves the results as JSON.
+
+    Input:
+
+    -filepath - JSON file to save results in.  Default is 'none' (don't
+        save).
+
+    -durations - lengths of recording (seconds) to time the FlapperData
+        methods on.  Default is [10, 60, 300].
+
+    -trialCounts - numbers of 10 second trials to time analyzeFlapperData
+        on.  Default is [1, 4, 16].
+
+    -freq, fs - flapping and sampling frequencies of the synthetic data, in
+        Hz.  Defaults are 1.0 and 1000.
+
+    -workers - passed to analyzeFlapperData.  Default is 1.
+
+    -fmt - file format to save results in.  Default is 'xlsx'.
+
+    -folder - where to write the synthetic data.  Default is 'none' (a
+        temporary folder, deleted afterwards).
+
+    Returns a dictionary of results:
+        {'load': {duration: {method: {'wall': s, 'peakRSS': MB, 'startRSS': MB}}},
+         'methods': {duration: {method: {'wall': s, 'peakRSS': MB}}},
+         'batch': {nTrials: {'wall': s, 'peakRSS': MB, 'failed': n}},
+         'settings': {...}}
+    Wall times are in seconds and peak memory use in MB.  Each size (and
+    each way of loading) runs in its own process.
+    """
+    import os
+    import sys
+    import json
+    import shutil
+    import platform
+    import tempfile
+    import numpy
+    import pandas
+
+    #the synthetic data are made in their own processes too, since each
+    #benchmark process starts from this one's peak memory use
+    if folder == 'none':
+        root = tempfile.mkdtemp(prefix='flapper_benchmark_')
+    else:
+        root = folder
+
+    results = {'load': {}, 'methods': {}, 'batch': {},
+               'settings': {'freq': freq, 'fs': fs, 'workers': workers, 'fmt': fmt,
+                            'python': platform.python_version(), 'numpy': numpy.__version__,
+                            'pandas': pandas.__version__, 'platform': sys.platform}}
+
+    try:
+        #each FlapperData method, on one trial of each length
+        for duration in durations:
+            sub = os.path.join(root, 'methods_' + str(duration) + 's')
+            os.makedirs(sub)
+            isolated(makeTrials, sub, 1, freq, duration, fs)
+            
+            #loading the foil file, the original way and with loadCombo
+            results['load'][str(duration)] = dict([(method, isolated(_loadTimes, os.path.join(sub, 'trial0.xls'), method))
+                                                   for method in ['readDropRename', 'loadCombo']])
+            print 'Timed loading ' + str(duration) + ' s of data: ' + ', '.join(
+                [name + ' %.3f s, %.1f MB' % (times['wall'], times['peakRSS'] - times['startRSS']) for (name, times) in sorted(results['load'][str(duration)].items())])
+            
+            results['methods'][str(duration)] = isolated(_methodTimes, sub, duration, freq, fs, fmt)
+            print 'Timed methods on ' + str(duration) + ' s of data: ' + ', '.join(
+                [name + ' %.3f s' % times['wall'] for (name, times) in sorted(results['methods'][str(duration)].items()) if name != 'start'])
+
+        #the whole batch, for each number of trials
+        for nTrials in trialCounts:
+            sub = os.path.join(root, 'batch_' + str(nTrials))
+            os.makedirs(sub)
+            files = isolated(makeTrials, sub, nTrials, freq, 10., fs)
+            results['batch'][str(nTrials)] = isolated(_batchTime, files, workers, fmt, fs)
+            print 'Timed analyzeFlapperData on ' + str(nTrials) + ' trials: %.3f s' % results['batch'][str(nTrials)]['wall']
+
+    finally:
+        if folder == 'none':
+            shutil.rmtree(root, True)
+
+    if filepath != 'none':
+        with open(filepath, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print 'Saved benchmarks as ' + filepath
+
+    return results
+
+
+def compareBenchmarks(baseline, current, tolerance=0.2, minChange=0.01):
+    """
+    Compares benchmark results to a baseline and prints any wall time or
+    peak memory use more than tolerance (default 0.2, i.e. 20%) above it.
+    baseline and current are result dictionaries or JSON filepaths.
+    Changes smaller than minChange (default 0.01 s or MB) are ignored, so
+    timing noise in very fast methods isn't reported.
+
+    Returns a list of (section, size, name, measure, baseline value,
+    current value) for each regression.
+    """
+    import json
+
+    def load(results):
+        if isinstance(results, dict):
+            return results
+        with open(results) as f:
+            return json.load(f)
+
+    baseline = load(baseline)
+    current = load(current)
+
+    #collect (section, size, name) -> measurements from each
+    def flatten(results):
+        flat = {}
+        for size, methods in results.get('load', {}).items():
+            for name, times in methods.items():
+                flat[('load', size, name)] = times
+        for size, methods in results['methods'].items():
+            for name, times in methods.items():
+                flat[('methods', size, name)] = times
+        for size, times in results['batch'].items():
+            flat[('batch', size, 'analyzeFlapperData')] = times
+        return flat
+
+    old = flatten(baseline)
+    new = flatten(current)
+
+    regressions = []
+    for key in sorted(new.keys()):
+        if key not in old or key[2] == 'start':
+            continue
+        for measure in ['wall', 'peakRSS']:
+            before = old[key].get(measure)
+            after = new[key].get(measure)
+            if before is None or after is None or before <= 0:
+                continue
+            if after > before*(1 + tolerance) and after - before > minChange:
+                regressions.append(key + (measure, before, after))
+                print 'Regression: ' + key[2] + ' (' + key[0] + ', ' + key[1] + ') ' + measure + ' %.3f -> %.3f' % (before, after)
+
+    if len(regressions) == 0:
+        print 'No regressions.'
+
+    return regressions
+
+
+if __name__ == '__main__':
+    import sys
+
+    results = runBenchmarks(sys.argv[1] if len(sys.argv) > 1 else 'none')
+    if len(sys.argv) > 2:
+        compareBenchmarks(sys.argv[2], results)
@@ -8,12 +8,197 @@ Created on Wed Jul 29 11:23:27 2015
 
 """
 
+class Profiler(object):
+    """
+    Collects the wall time, rows of data and change in memory use of each
+    profiled stage (the FlapperData methods, loadCombo, resolveFrame,
+    filterFrame and saveTable) while it is enabled with enableProfiling.
+    Profiling is off unless enabled, and then costs one check per call.
+
+    Stages can be nested - e.g. phaseAvg includes the saveTable it calls -
+    so times for different stages shouldn't be added up.  Only calls on
+    the thread that enabled profiling are recorded, so work done in the
+    background (e.g. reading files ahead, see Prefetcher in
+    Flapper_analysis_wrapper.py) isn't counted in the stage running at the
+    time.
+
+    Inputs:
+        trial - name of the trial being profiled, saved with each record.
+            Default is ''.
+    """
+
+    def __init__(self, trial=''):
+        self.trial = trial
+        self.records = []
+
+
+    def record(self, stage, wall, rows, memDelta):
+        """
+        Adds a record for one run of a stage: wall time (s), rows of data
+        and change in memory use (MB).
+        """
+        self.records.append({'trial': self.trial, 'stage': stage, 'wall': wall,
+                             'rows': rows, 'memDelta': memDelta})
+
+
+    def table(self):
+        """
+        Returns the records as a dataframe, one row per run of a stage.
+        """
+        import pandas as pd
+
+        return pd.DataFrame(self.records, columns=['trial', 'stage', 'wall', 'rows', 'memDelta'])
+
+
+    def summary(self):
+        """
+        Returns a dataframe with, for each stage, the number of runs and
+        the total, mean, and longest wall time, total rows, and total
+        change in memory use - slowest stages first.
+        """
+        import pandas as pd
+
+        table = self.table()
+        if table.shape[0] == 0:
+            return pd.DataFrame(columns=['runs', 'wall', 'meanWall', 'maxWall', 'rows', 'memDelta'])
+
+        groups = table.groupby('stage')
+        summary = pd.DataFrame({'runs': groups.wall.count(),
+                                'wall': groups.wall.sum(),
+                                'meanWall': groups.wall.mean(),
+                                'maxWall': groups.wall.max(),
+                                'rows': groups.rows.sum(),
+                                'memDelta': groups.memDelta.sum()},
+                               columns=['runs', 'wall', 'meanWall', 'maxWall', 'rows', 'memDelta'])
+
+        return summary.sort_values('wall', ascending=False)
+
+
+    def report(self, filepath):
+        """
+        Saves the records to filepath, as JSON (.json) or CSV (any other
+        extension).
+        """
+        import json
+
+        if filepath.lower().endswith('.json'):
+            with open(filepath, 'w') as f:
+                json.dump(self.records, f, indent=2)
+        else:
+            self.table().to_csv(filepath, index=False)
+
+
+#The Profiler collecting records, or None when profiling is off, and the
+#thread it records
+_profiler = None
+_profilerThread = None
+
+
+def enableProfiling(profiler=None):
+    """
+    Starts profiling into profiler (a new Profiler if None) and returns it.
+    Calls on the current thread are recorded.
+    """
+    import threading
+    global _profiler, _profilerThread
+
+    if profiler is None:
+        profiler = Profiler()
+    _profiler = profiler
+    _profilerThread = threading.current_thread()
+
+    return profiler
+
+
+def disableProfiling():
+    """
+    Stops profiling and returns the Profiler that was in use (or None).
+    """
+    global _profiler
+
+    profiler = _profiler
+    _profiler = None
+
+    return profiler
+
+
+def currentMemory():
+    """
+    Memory in use (resident set size) by this process, in MB.  Where it
+    can't be read (not Linux), the peak memory use so far is given
+    instead, or 0 on Windows.
+    """
+    import os
+    import sys
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')/1e6
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return 0.
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak/1e6
+    return peak/1e3
+
+
+def profiled(stage):
+    """
+    Decorator that records each call of a method or function as stage in
+    the enabled Profiler.  Rows are those of the FlapperData object's foil
+    data, or of the dataframe passed in or returned.
+    """
+    import time
+    import threading
+    from functools import wraps
+
+    def decorate(func):
+
+        @wraps(func)
+        def run(*args, **kwargs):
+            #profiling is off, or this is another thread
+            if _profiler is None or threading.current_thread() is not _profilerThread:
+                return func(*args, **kwargs)
+
+            profiler = _profiler
+            mem = currentMemory()
+            t = time.time()
+            result = func(*args, **kwargs)
+            wall = time.time() - t
+
+            #count the rows worked on
+            rows = 0
+            if len(args) > 0 and hasattr(args[0], 'foilData'):
+                rows = args[0].foilData.shape[0]
+            elif hasattr(result, 'columns'):
+                rows = result.shape[0]
+            elif len(args) > 0 and hasattr(args[0], 'columns'):
+                rows = args[0].shape[0]
+
+            profiler.record(stage, wall, rows, currentMemory() - mem)
+
+            return result
+
+        return run
+
+    return decorate
+
+
+
 class FlapperData(object):
     """
     Load Flapper data as this class type to perform data analysis.
     
     Inputs:
-        foil - (str) filepath and name for foil combo file
+        foil - (str) filepath and name for foil combo file, or the file's
+            data already read with loadCombo (a dataframe or ChannelTable).
+            Data passed in are shared, not copied, and never changed.
         
         pitch - default is 0 (False - a heave only program was used).  Set to
             1 (True) if pitch, including 0angle, was applied.
@@ -24,6 +209,36 @@ class FlapperData(object):
         
         rodpath - set to the filepath and name of the rod combo file when
             rod = 1
+        
+        dtype - number type to load data as.  Default is 'float64'; set to
+            'float32' to halve memory use.
+        
+        engine - pandas parser to read combo files with: 'c' (the
+            default) or 'python'.  See loadCombo.
+        
+        rodData - rod data that has already been loaded with loadRodData
+            (and optionally resolved and filtered), to use instead of
+            loading rodpath - a ChannelTable (or a dataframe, which is
+            converted).  The ChannelTable is shared, not copied, so don't
+            resolve or filter it again through this object (use rod = 0 in
+            resolveForces and filterData).  See RodRegistry in
+            Flapper_analysis_wrapper.py.  If it was processed, set
+            self.computed['rod'] to the record of how (see below).
+        
+        storeDir - default is 'none' (load combo files into memory).  Set to
+            a folder to instead convert each combo file, once, to a
+            memory-mapped store there (see storeCombo) and open it from
+            disk.  The raw data pages are then shared by every process that
+            opens the same file, instead of each holding its own copy.
+        
+        storeTag - when storeDir is set, the tag of processed columns saved
+            earlier with storeDerived to map along with the raw data.
+            Default is 'none'.
+        
+        schema - an AcquisitionSchema describing how the data were recorded
+            (sampling frequency, length, combo file columns).  Default is
+            None (defaultSchema: 1000 Hz, every row in the file).  All of
+            the methods use its sampling frequency.
             
             
     The methods associated with Flapper Data objects can be used to:
@@ -33,10 +248,25 @@ class FlapperData(object):
         -plot time traces of data
         -find phase-averaged forces/torques
         -find net force/torque over one or more complete motion cycles
-        
+        -find where motion cycles start, and how many whole cycles there are
+        -find power spectra and harmonic amplitudes, and suggest a filter
+            cutoff frequency
+
+    The data are kept in self.foilData (and self.rodData) as
+    ChannelTables - one row of a 2-D array for each channel, looked up by
+    name, e.g. self.foilData['Fx_filt'].  Use self.frame() for a
+    dataframe, e.g. to export.
+
+    The methods that add columns note how each one was made (with which
+    cutoff frequency, from which columns, ...) in self.computed, a
+    dictionary of {column: record} for each of 'foil' and 'rod'.  A
+    FlapperPipeline uses these records to only compute the columns it
+    needs, and only again when a setting they depend on has changed.
+
     """
     
-    def __init__(self, foil, freq, pitch=0, rod=0, rodpath='none'):
+    @profiled('load')
+    def __init__(self, foil, freq, pitch=0, rod=0, rodpath='none', dtype='float64', engine='c', rodData=None, storeDir='none', storeTag='none', schema=None):
         """
         Tells Python what to do when Flapper data is loaded
         """
@@ -49,101 +279,56 @@ class FlapperData(object):
         pd.set_option('display.width', 500)
         pd.set_option('display.max_columns', 100)
         
-        #Load the foil data to a dataframe
-        self.foilData = pd.read_csv(foil,delimiter='\t')
-        
-        #Get rid of columns that don't show force, torque, or position data
-        self.foilData = self.foilData.drop(['Pressure 1 Ai2',
-                                            'Pressure 2 Ai3',
-                                            'Pressure 3 Ai4',
-                                            'Pressure 4 Ai5',
-                                            'digital in loop start 6221',
-                                            'camera trigger echo 6221',
-                                            'Loop Pulse'],
-                                            axis=1)
-        
-        #Give the dataframe columns names
-        self.foilData = self.foilData.rename(columns = {'X axis encoder 6602 degrees':'pitch_pos',
-                                                        'Y axis encoder 6602 meters':'heave_pos',
-                                                        'Fx (N)':'Fx',
-                                                        'Fy (N)':'Fy',
-                                                        'Fz (N)':'Fz',
-                                                        'Tx (N-mm)':'Tx',
-                                                        'Ty (N-mm)':'Ty',
-                                                        'Tz (N-mm)':'Tz'
-                                                        })
-                                                        
-        #Add a time column
-        self.foilData['time']=np.linspace(0, 9.999, num=10000)
+        #Note how the data were recorded
+        if schema is None:
+            schema = defaultSchema
+        self.schema = schema
+
+        #Note how processed columns were made, for foil and rod data
+        self.computed = {'foil': {}, 'rod': {}}
         
-        #Set pitch to 0 degrees in heave only datasets
-        if pitch == 0:
-            self.foilData['pitch_pos'] = 0.
-        
-        #Center pitch_pos and heave_pos on the x-axis by subtracting the mean
-        #from each data point
-        isEven = 10. % freq
-        if isEven == 0:
-            self.foilData['heave_pos']=self.foilData['heave_pos'] - self.foilData.heave_pos.mean()
-        elif freq == 0:
-            self.foilData['heave_pos']= 0.
+        #Spectra found so far (see spectrum)
+        self.spectra = {}
+        
+        #Use foil data that's already been read
+        if not isinstance(foil, basestring):
+            self.foilStore = 'none'
+            if isinstance(foil, ChannelTable):
+                self.foilData = foil.view()
+            else:
+                self.foilData = ChannelTable.fromFrame(foil)
+
+        #Load the force, torque, and position columns of the foil data to a
+        #ChannelTable, with the columns given names
+        elif storeDir == 'none':
+            self.foilStore = 'none'
+            self.foilData = ChannelTable.fromFrame(loadCombo(foil, dtype=dtype, engine=engine, schema=schema))
+        
+        #or map them from a store on disk
         else:
-            last = int(1000.*freq*int(10./freq))
-            heave_avg = np.mean(self.foilData['heave_pos'][0:last])
-            self.foilData['heave_pos']=self.foilData['heave_pos'] - heave_avg
-        
-        if pitch == 1:
-            self.foilData['pitch_pos']=self.foilData['pitch_pos'] - self.foilData.pitch_pos.mean()
-            
-            
-        
-        #Optionally load rod data and set up the same type of dataframe.
-        if rod == 1: 
-            #Load the foil data to a dataframe
-            self.rodData = pd.read_csv(rodpath,delimiter='\t')
-            
-            #Get rid of columns that don't show force, torque, or position data
-            self.rodData = self.rodData.drop(['Pressure 1 Ai2',
-                                            'Pressure 2 Ai3',
-                                            'Pressure 3 Ai4',
-                                            'Pressure 4 Ai5',
-                                            'digital in loop start 6221',
-                                            'camera trigger echo 6221',
-                                            'Loop Pulse'],
-                                            axis=1)
-            
-            #Give the dataframe columns names
-            self.rodData = self.rodData.rename(columns = {'X axis encoder 6602 degrees':'pitch_pos',
-                                                            'Y axis encoder 6602 meters':'heave_pos',
-                                                            'Fx (N)':'Fx',
-                                                            'Fy (N)':'Fy',
-                                                            'Fz (N)':'Fz',
-                                                            'Tx (N-mm)':'Tx',
-                                                            'Ty (N-mm)':'Ty',
-                                                            'Tz (N-mm)':'Tz'
-                                                            })
-                                                            
-            #Add a time column
-            self.rodData['time']=np.linspace(0, 0.9999, num=10000)
-            
-            #Set pitch to 0 degrees in heave only datasets
-            if pitch == 0:
-                self.rodData['pitch_pos'] = 0.
-            
-            #Center pitch_pos and heave_pos on the x-axis by subtracting the mean
-            #from each data point
-            isEven = 10. % freq
-            if isEven == 0:
-                self.rodData['heave_pos']=self.rodData['heave_pos'] - self.rodData.heave_pos.mean()
-            elif freq == 0:
-                self.rodData['heave_pos']= 0.
+            self.foilStore = storeCombo(foil, storeDir, dtype=dtype, engine=engine, schema=schema)
+            self.foilData = openStore(self.foilStore, tag=storeTag)
+                                                        
+        #Add a time column, from the sampling frequency
+        self.foilData['time']=np.arange(self.foilData.shape[0])/float(schema.fs)
+        
+        #Set pitch to 0 degrees in heave only datasets, and center pitch_pos
+        #and heave_pos on the x-axis
+        self.foilData = centerPositions(self.foilData, freq, pitch, fs=schema.fs)
+        
+        #Optionally load rod data and set up the same type of table,
+        #or use rod data that's already been loaded.
+        self.rodStore = 'none'
+        self.rodShared = rodData is not None
+        if rod == 1:
+            if rodData is None and storeDir != 'none':
+                self.rodStore = storePath(rodpath, storeDir)
+            if rodData is None:
+                self.rodData = loadRodData(rodpath, freq, pitch=pitch, dtype=dtype, engine=engine, storeDir=storeDir, storeTag=storeTag, schema=schema)
+            elif isinstance(rodData, ChannelTable):
+                self.rodData = rodData.view()
             else:
-                last = int(1000.*freq*int(10./freq))
-                heave_avg = np.mean(self.rodData['heave_pos'][0:last])
-                self.rodData['heave_pos']=self.rodData['heave_pos'] - heave_avg
-            
-            if pitch == 1:
-                self.rodData['pitch_pos']=self.rodData['pitch_pos'] - self.rodData.pitch_pos.mean()
+                self.rodData = ChannelTable.fromFrame(rodData)
                 
     
     
@@ -167,57 +352,55 @@ class FlapperData(object):
         #Otherwise, just display foil text
         except:
              return outcome
+
+
+    def frame(self, columns=None, rod=0):
+        """
+        Returns the foil data (or the rod data, with rod = 1) as a
+        dataframe, e.g. for exporting or plotting.  Default columns is None
+        (all of them).
+        """
+        if rod == 1:
+            return self.rodData.frame(columns)
+        return self.foilData.frame(columns)
              
     
     
-    def resolveForces(self, rod=0):
+    @profiled('resolveForces')
+    def resolveForces(self, rod=0, torques=0):
         """
         Resolves forces collected during pitch programs - with a rotating
         force-torque sensor - to upstream (Fx) and lateral (Fy) components.
         Reports data in new columns Res_Fx and Res_Fy
-        
+
         Input:
         -rod - default is 0 (False - do not load rod data).  Set to 1 (True)
             to load corresponding rod-only combo file, if subtraction of rod
             data is needed.
-            
+
+        -torques - default is 0.  Set to 1 to also resolve Tx and Ty the
+            same way, into Res_Tx and Res_Ty.
+
+        To resolve many trials at once, see resolveTrials.
+
         """
-        def resolve_forces(df):
-            """"
-            A helper-code that performs the resolve Fx and Fy calculation:
-            
-            Res_Fx = Fx*cos(pitch_pos) + Fy*sin(pitch_pos)
-            Res_Fy = -Fx*sin(pitch_pos) - Fy*cos(pitch_pos)
-            
-            Note that pitch_pos is converted to radians from degrees before
-            calculation.
-            
-            """
-            #load a package            
-            import numpy as np
-            
-            #Resolve Fx = Fx*cos(pitch)+Fy*sin(pitch)
-            df['Res_Fx']=df.Fx*np.cos(np.radians(df.pitch_pos))+df.Fy*np.sin(np.radians(df.pitch_pos))
-            #Resolve Fy = -Fx*sin(pitch)-Fy*cos(pitch)
-            #df['Res_Fy']=-(df.Fx*np.sin(np.radians(df.pitch_pos)))-df.Fy*np.cos(np.radians(df.pitch_pos))
-            df['Res_Fy']=-(df.Fx*np.sin(np.radians(df.pitch_pos)))+df.Fy*np.cos(np.radians(df.pitch_pos))
-            return df
-            
-        #Resolve forces and insert into the dataframe
-        self.foilData = resolve_forces(self.foilData)
-        
+        #Resolve forces and insert into the data
+        self.foilData = resolveFrame(self.foilData, computed=self.computed['foil'], torques=torques)
+
         #If rod data is provided, repeat for the rod data.
         if rod == 1:
-            self.rodData = resolve_forces(self.rodData)
+            self.rodData = resolveFrame(self.rodData, computed=self.computed['rod'], torques=torques)
         
     
-    def filterData(self, cutoffFreq=10, resolved=0, rod=0):
+    @profiled('filterData')
+    def filterData(self, cutoffFreq=10, resolved=0, rod=0, channels=None):
         """
         Applies a low-pass Butterworth filter to Flapper data & inserts 
         filtered data into new columns Fx_filt (or Res_Fx_filt),
             Fy_filt (or Res_Fy_filt), and Tz_filt
         
-        Operates on Fx (or Res_Fx), Fy (or Res_Fy), and Tz
+        Operates on Fx (or Res_Fx), Fy (or Res_Fy), and Tz, or on any list
+        of channels
         
         Input:
         
@@ -230,52 +413,19 @@ class FlapperData(object):
         -rod - default is 0 (False - do not load rod data).  Set to 1 (True)
             to load corresponding rod-only combo file, if subtraction of rod
             data is needed.
+        
+        -channels - list of columns to filter, e.g. ['Fx', 'Fy', 'Fz', 'Tx',
+            'Ty', 'Tz', 'heave_pos'].  Each is saved as a new column with
+            '_filt' added to its name.  Default is None (the three columns
+            above, chosen by resolved).
             
         """
-        #Load filtering functions
-        from scipy.signal import butter, filtfilt
-
-        def apply_filter(df):
-            """
-            A helper-code that applies a Butterworth filter to the Flapper data
-            & inserts results into new columns
-            
-            Applies the Butterworth filter in 2 pass - at a fraction of the 
-            cut-off frequency each time - to eliminate phase-shifts from the 
-            outcome.
-            """
-            
-            #C is a proprotionality factor by which the desired cutoff 
-            #frequency will be adjusted to account for multiple passes.
-            #C = 0.802 for n=2 passes, calculated by:
-            # C = (2^(1/n)-1)^(1/4)
-            
-            C = 0.802
-            
-            #Create filter operation
-            #'1000/2' is the Nyquist frequency, or half of the sampling frequency
-            b, a = butter(2, (cutoffFreq/C)/(1000/2), btype = 'low')
-            
-            #Apply the filter
-            if resolved == 0:
-                df['Fx_filt'] = filtfilt(b, a, df.Fx)
-                df['Fy_filt'] = filtfilt(b, a, df.Fy)
-                df['Tz_filt'] = filtfilt(b, a, df.Tz)
-            
-            #Apply the filter instead to the resolved forces, if available.
-            else:
-                df['Res_Fx_filt'] = filtfilt(b, a, df.Res_Fx)
-                df['Res_Fy_filt'] = filtfilt(b, a, df.Res_Fy)
-                df['Tz_filt'] = filtfilt(b, a, df.Tz)
-            
-            return df
-            
         #Filter foil data
-        self.foilData = apply_filter(self.foilData)
-        
+        self.foilData = filterFrame(self.foilData, cutoffFreq, resolved, channels=channels, fs=self.schema.fs, computed=self.computed['foil'])
+
         #If rod data are available, filter the rod data
         if rod == 1:
-            self.rodData = apply_filter(self.rodData)
+            self.rodData = filterFrame(self.rodData, cutoffFreq, resolved, channels=channels, fs=self.schema.fs, computed=self.computed['rod'])
             
         
     def simplePlot(self, x, y):
@@ -290,7 +440,8 @@ class FlapperData(object):
         plt.plot(x,y)
         
     
-    def combineWithRod(self, resolved=0):
+    @profiled('combineWithRod')
+    def combineWithRod(self, resolved=0, align='heave', minConfidence=0.9):
         """
         Subtracts rod data from foil data to eliminate the contribution of 
         the rod & reports results in new columns Fx_noRod, Fy_noRod,
@@ -302,123 +453,348 @@ class FlapperData(object):
         -resolved - default = 0 (False - forces were not resolved).  Set equal
             to 1 if forces have been resolved.
         
+        -align - how to line up the rod data with the foil data.  Default is
+            'heave' (use the first rod point matching the first foil heave
+            position, within 0.00005 m, and direction).  Set to 'xcorr' to
+            instead find the lag that best matches the whole heave trace,
+            using FFT cross-correlation refined to a fraction of a sample.
+            Use 'xcorr' on noisy encoder data.
+        
+        -minConfidence - a warning is printed if the confidence score of the
+            alignment (below) is less than this.  Default is 0.9.
+        
+        The alignment used is stored in self.rodAlignment, a dictionary with
+        the 'method', the 'lag' (rod row matching the first foil row), and
+        a 'confidence' score - the correlation between foil and lined-up rod
+        heave positions, where 1 is a perfect match.
+        
+        Raises a ValueError if align='heave' and no point in the rod data
+        matches the first heave position and direction of the foil data.
+        
         """
         
-        #Find the first heave position in the foil data.
-        firstHeave = self.foilData.heave_pos[0]
+        import numpy as np
         
-        #Find out if heave is decreasing or increasing by comparing to next
-        #heave position.
-        if firstHeave < self.foilData.heave_pos[1]:
-            direction = 'incr'
-        else:
-            direction = 'decr'
-        
-        #initialize an index to let us note where we are in rod data (below)
-        i=0
-        
-        #Read each heave position in the rod data, one at a time.
-        for heave in self.rodData.heave_pos:
-        
-        #If heave position in the rod data matches the one noted from foil data
-        #(Because different passes of the Flapper rarely are identical in
-        #position reports, allow for error of 0.00005 m.)
-            if firstHeave - heave < 0.00005:
-            
-                #Determine if heave is increasing or decreasing at the first
-                #occurance by comparing to the next heave position.
-                try:
-                    if heave < self.rodData.heave_pos[i+1]:
-                        rDirection = 'incr'
-                    else:
-                        rDirection = 'decr'
-                
-                #If the matching heave occurs at the end of the list of heave 
-                #positions, check for incr/decr using the previous value instead
-                except:
-                    if heave < self.rodData.heave_pos[i-1]:
-                        rDirection = 'decr'
-                    else:
-                        rDirection = 'incr'
-            
-                #if direction of motion matches,
-                if direction == rDirection:
-                    
-                    #note the index in rod where this happens.
-                    matchIndex = i
-                
-                    #break out of loop
-                    break
-                
-                #else, continue searching for the next appearance of that heave
-                #position in the rod data.
+        #Get the heave positions as plain arrays so the search below can be
+        #done on whole arrays instead of one row at a time
+        foilHeave = self.foilData['heave_pos']
+        rodHeave = self.rodData['heave_pos']
+        
+        #number of rows in the foil and rod data
+        nFoil = foilHeave.shape[0]
+        nRod = rodHeave.shape[0]
+        
+        def heave_match():
+            """
+            A helper-code that finds the first row in the rod data where the
+            heave position and direction of motion match the first row of the
+            foil data.
+            """
+            
+            #Find the first heave position in the foil data.
+            firstHeave = foilHeave[0]
+            
+            #Find out if heave is increasing by comparing to next heave position.
+            incr = firstHeave < foilHeave[1]
+            
+            #Determine if heave is increasing at each point in the rod data by
+            #comparing to the next heave position.
+            rodIncr = np.empty(nRod, dtype=bool)
+            rodIncr[:-1] = rodHeave[:-1] < rodHeave[1:]
+            
+            #For the last heave position in the rod data, check for incr/decr
+            #using the previous value instead
+            rodIncr[-1] = not (rodHeave[-1] < rodHeave[-2])
+            
+            #Find rod heave positions that match the one noted from foil data
+            #(Because different passes of the Flapper rarely are identical in
+            #position reports, allow for error of 0.00005 m.) and where the
+            #direction of motion also matches
+            matches = np.flatnonzero((firstHeave - rodHeave < 0.00005) & (rodIncr == incr))
+            
+            #If no match exists, the rod data can't be lined up with the foil
+            if matches.shape[0] == 0:
+                raise ValueError('No heave position in the rod data matches the start of the foil data.')
+            
+            #note the index in rod where the first match happens.
+            return float(matches[0])
+            
+        def xcorr_lag():
+            """
+            A helper-code that finds the lag between foil and rod heave
+            positions from the peak of their circular cross-correlation:
+            
+            c[s] = sum over k of foil[k]*rod[(s+k) % nRod]
+            
+            computed with FFTs.  The peak is refined to a fraction of a sample
+            by fitting a parabola through it and its two neighbors.
+            """
+            
+            #use as much foil data as fits in one pass of the rod data
+            m = min(nFoil, nRod)
+            
+            #remove the means so the offsets don't dominate the correlation
+            f = foilHeave[0:m] - foilHeave[0:m].mean()
+            r = rodHeave - rodHeave.mean()
             
-            #increment i
-            i+=1
+            #cross-correlate every lag at once
+            c = np.fft.irfft(np.conj(np.fft.rfft(f, nRod)) * np.fft.rfft(r), nRod)
             
-        #initialize storage for corrected data
-        newFx = []
-        newFy = []
-        newTz = []
+            #find the best whole-sample lag
+            s = int(np.argmax(c))
+            
+            #refine with a parabola through the peak and its neighbors
+            left = c[(s-1) % nRod]
+            right = c[(s+1) % nRod]
+            curve = left - 2.*c[s] + right
+            if curve < 0:
+                shift = 0.5*(left - right)/curve
+            else:
+                shift = 0.
+            
+            return (s + shift) % nRod
         
-        #initialize index to go through rod data row-by-row
-        j=matchIndex
+        #Find the rod row corresponding to the first foil row
+        if align == 'heave':
+            lag = heave_match()
+        elif align == 'xcorr':
+            lag = xcorr_lag()
+        else:
+            raise ValueError("align must be 'heave' or 'xcorr', not " + repr(align))
         
+        #Going row by row from the beginning of foil data, the corresponding
+        #row in the rod data starts at the lag and wraps back around to the
+        #beginning of the rod data whenever we run out rows.
+        rodPos = (lag + np.arange(nFoil)) % nRod
         
+        #Split into whole rows and the fraction of the way to the next row
+        rodIndex = np.floor(rodPos).astype(int)
+        frac = rodPos - rodIndex
         
-        #going line by line, starting at the beginning of foil data and
-        #the noted index from rod data (corresponding points)
-        for index in range(0,self.foilData.shape[0]):
+        def rod_values(values):
+            """
+            A helper-code that reads rod values (one channel, or a channels
+            x rows array) at the lined-up rows, interpolating linearly when
+            the lag is not a whole number of rows.
+            """
+            if lag == int(lag):
+                return values[..., rodIndex]
+            else:
+                nextIndex = (rodIndex + 1) % nRod
+                return (1.-frac)*values[..., rodIndex] + frac*values[..., nextIndex]
+        
+        #Score the alignment by the correlation between the foil heave and
+        #the lined-up rod heave
+        f = foilHeave - foilHeave.mean()
+        r = rod_values(rodHeave)
+        r = r - r.mean()
+        norm = np.sqrt(np.sum(f**2)*np.sum(r**2))
+        if norm > 0:
+            confidence = np.sum(f*r)/norm
+        else:
+            confidence = 0.
         
-            if resolved == 0:
-            
-                try:
-                    
-                    #subtract the rod Fx, Fy, and Tz (filtered) from the foil
-                    newFx.append(self.foilData.Fx_filt[index] - self.rodData.Fx_filt[j])
-                    newFy.append(self.foilData.Fy_filt[index] - self.rodData.Fy_filt[j])
-                    newTz.append(self.foilData.Tz_filt[index] - self.rodData.Tz_filt[j])
+        #Keep a record of the alignment
+        self.rodAlignment = {'method': align, 'lag': lag, 'confidence': confidence}
         
-                #when we run out rows in the rod data,
-                except:
+        #Flag alignments that don't look right
+        if confidence < minConfidence:
+            print 'Warning: rod alignment confidence is ' + str(round(confidence, 3)) + ' (lag ' + str(round(lag, 2)) + ' rows).  Check the rod data.'
         
-                    #start at the beginning of the rod data
-                    j=0
-                    newFx.append(self.foilData.Fx_filt[index] - self.rodData.Fx_filt[j])
-                    newFy.append(self.foilData.Fy_filt[index] - self.rodData.Fy_filt[j])
-                    newTz.append(self.foilData.Tz_filt[index] - self.rodData.Tz_filt[j])
-                
-                #and continue to next row
-                j+=1
+        #Choose the filtered columns to subtract
+        if resolved == 0:
+            cols = ['Fx_filt', 'Fy_filt', 'Tz_filt']
+        else:
+            cols = ['Res_Fx_filt', 'Res_Fy_filt', 'Tz_filt']
         
-            else:
-            
-                try:
-                    
-                    #subtract the rod Fx, Fy, and Tz (filtered) from the foil
-                    newFx.append(self.foilData.Res_Fx_filt[index] - self.rodData.Res_Fx_filt[j])
-                    newFy.append(self.foilData.Res_Fy_filt[index] - self.rodData.Res_Fy_filt[j])
-                    newTz.append(self.foilData.Tz_filt[index] - self.rodData.Tz_filt[j])
-        
-                #when we run out rows in the rod data,
-                except:
-                    #start at the beginning of the rod data
-                    j=0
-                    newFx.append(self.foilData.Res_Fx_filt[index] - self.rodData.Res_Fx_filt[j])
-                    newFy.append(self.foilData.Res_Fy_filt[index] - self.rodData.Res_Fy_filt[j])
-                    newTz.append(self.foilData.Tz_filt[index] - self.rodData.Tz_filt[j])
-                
-                #and continue to next row
-                j+=1
-          
-        #add the corrected data to the foil dataframe
-        self.foilData['Fx_noRod']=newFx
-        self.foilData['Fy_noRod']=newFy
-        self.foilData['Tz_noRod']=newTz
+        #subtract the rod Fx, Fy, and Tz (filtered) from the foil, all at once
+        newData = self.foilData.take(cols) - rod_values(self.rodData.take(cols))
+
+        #add the corrected data to the foil data
+        self.foilData['Fx_noRod']=newData[0]
+        self.foilData['Fy_noRod']=newData[1]
+        self.foilData['Tz_noRod']=newData[2]
+
+        #Note what they were made from
+        made = ('noRod', resolved, align,
+                tuple([self.computed['foil'].get(col, 'raw') for col in cols]),
+                tuple([self.computed['rod'].get(col, 'raw') for col in cols]))
+        for col in ['Fx_noRod', 'Fy_noRod', 'Tz_noRod']:
+            self.computed['foil'][col] = made
         
         
     
-    def netValue(self, columns, freq, nCycles, rod=0, save=0, filepath='none'):
+    @profiled('findPhase')
+    def findPhase(self, freq, phase='freq', rod=0):
+        """
+        Finds how many motion cycles have passed at each row of data, as a
+        decimal number of cycles.  The whole-number part is the cycle
+        number and the fraction (in [0, 1)) is the phase within the cycle.
+        
+        Input:
+        
+        -freq - flapping frequency used
+        
+        -phase - how to find the phase.  Default is 'freq' (cycles = time *
+            freq, starting at the first row).  Set to 'heave' to instead
+            start each cycle where heave_pos crosses zero going up (located
+            to a fraction of a row), which follows the actual motion of the
+            Flapper.  Rows before the first upward crossing get negative
+            values.
+            
+        -rod - set equal to 1 to find the phase of the rod data instead
+        
+        """
+        import numpy as np
+        
+        #Choose the data
+        if rod == 1:
+            df = self.rodData
+        else:
+            df = self.foilData
+        
+        #row numbers
+        rows = np.arange(df.shape[0], dtype=float)
+        
+        #sampling frequency
+        fs = float(self.schema.fs)
+        
+        #In static case (0 Hz), treat each second of rows as a cycle
+        if freq == 0:
+            return rows/fs
+        
+        if phase == 'freq':
+            #cycles = time*freq, with time = rows/fs
+            return rows*freq/fs
+        
+        elif phase == 'heave':
+            return heaveCycles(df['heave_pos'], fs, freq)
+        
+        else:
+            raise ValueError("phase must be 'rows', 'freq' or 'heave', not " + repr(phase))
+
+
+    @profiled('findCycles')
+    def findCycles(self, freq=0, channel='heave_pos', method='zero', rod=0):
+        """
+        Finds the rows where each motion cycle starts, from the encoder data
+        (see the findCycles function).  Consecutive values bound one whole
+        cycle.
+
+        Input:
+
+        -freq - flapping frequency, if known.  Default is 0 (find it from
+            the data).
+
+        -channel - position channel to use.  Default is 'heave_pos'; set to
+            'pitch_pos' to use pitch instead.
+
+        -method - default is 'zero' (cycles start where the position
+            crosses zero going up).  Set to 'peak' to start them at the
+            peaks instead.
+
+        -rod - set equal to 1 to use the rod data instead
+
+        """
+        if rod == 1:
+            df = self.rodData
+        else:
+            df = self.foilData
+
+        return findCycles(df[channel], self.schema.fs, freq, method=method)
+
+
+    def countCycles(self, freq, phase='rows', rod=0):
+        """
+        Finds the largest number of whole cycles that netValue and phaseAvg
+        can use with the given phase option (see phaseAvg), i.e. the most
+        nCycles can be.  In the static case (freq = 0), cycles are seconds
+        of data.
+
+        Input:
+
+        -freq - flapping frequency used
+
+        -phase - default is 'rows'.  See phaseAvg.
+
+        -rod - set equal to 1 to count the rod data's cycles instead
+
+        """
+        import numpy as np
+
+        if rod == 1:
+            n = self.rodData.shape[0]
+        else:
+            n = self.foilData.shape[0]
+        fs = float(self.schema.fs)
+
+        #whole cycles of fs/freq rows, rounded to whole rows (1-second
+        #chunks in the static case)
+        if phase == 'rows':
+            if freq == 0:
+                return int(n // int(round(fs)))
+            return int(n // int(round(fs/freq)))
+
+        #whole cycles after the first cycle start (see findPhase, which
+        #also counts seconds in the static case)
+        cycles = self.findPhase(freq, phase=phase, rod=rod)
+        return max(0, int(np.floor(cycles[-1] + 1e-9)))
+
+
+    def chooseCycles(self, freq, nCycles='auto', phase='rows', rod=0, tolerance=0.05):
+        """
+        Checks the number of cycles to use in netValue and phaseAvg against
+        the data, so a wrong spreadsheet entry doesn't run past the end of
+        the data.
+
+        Input:
+
+        -freq - flapping frequency used
+
+        -nCycles - number of cycles wanted.  Default is 'auto' (the most
+            whole cycles in the data).  If more are asked for than there
+            are, a warning is printed and the most there are is used.
+            A blank (NaN) entry counts as 'auto'.
+
+        -phase - default is 'rows'.  See phaseAvg.
+
+        -rod - set equal to 1 to also count the rod data's cycles
+
+        -tolerance - a warning is printed if the flapping frequency found
+            from the heave data differs from freq by more than this fraction.
+            Default is 0.05.
+
+        Returns the number of cycles to use.
+        """
+        import numpy as np
+
+        available = self.countCycles(freq, phase=phase)
+        if rod == 1:
+            available = min(available, self.countCycles(freq, phase=phase, rod=1))
+
+        if available < 1:
+            raise ValueError('There is less than one whole cycle of data.')
+
+        #compare freq to the motion
+        if freq != 0:
+            starts = self.findCycles()
+            if starts.shape[0] >= 2:
+                found = self.schema.fs/np.median(np.diff(starts))
+                if abs(found - freq) > tolerance*freq:
+                    print 'Warning: frequency is ' + str(freq) + ' Hz, but heave_pos cycles at ' + str(round(found, 3)) + ' Hz.'
+
+        if nCycles == 'auto' or nCycles is None or nCycles != nCycles:
+            return available
+
+        if int(nCycles) > available:
+            print 'Warning: ' + str(nCycles) + ' cycles asked for, but only ' + str(available) + ' whole cycles in the data.  Using ' + str(available) + '.'
+            return available
+
+        return int(nCycles)
+
+
+    @profiled('netValue')
+    def netValue(self, columns, freq, nCycles, rod=0, save=0, filepath='none', phase='rows', ci=0, nBoot=2000, seed=0, workers=1):
         """
         Finds the net (time-averaged) value of data columns over
         the first n cycles.
@@ -431,16 +807,43 @@ class FlapperData(object):
         -freq - flapping frequency used
         
         -nCycles - the number of cycles to take the average over.  Must
-            be at least 1, and no more than 10 seconds worth of time.
-            
+            be at least 1, and no more than the data hold (see
+            countCycles).  Set to 'auto' to use every whole cycle.
+
         -rod - if average values for the rod are also desired, set equal to 1
-        
-        -save - set to 1 to save net values to an Excel file.
+
+        -save - set to 1 to save net values to a file.
         
         -filepath - when save == 1, set equal to the filepath where net
-            values should be saved
-        
+            values should be saved.  The file extension sets the format
+            (see saveTable).
+        
+        -phase - default is 'rows' (average over the first nCycles*fs/freq
+            rows, rounded to a whole row, where fs is the sampling
+            frequency).  Set to 'freq' or 'heave' to
+            instead average the rows within the first nCycles whole cycles
+            found by findPhase, which keeps non-integer periods exact.
+
+        -ci - confidence level for bootstrap confidence intervals, e.g.
+            0.95.  Default is 0 (none).  Whole cycles are resampled nBoot
+            times (see bootstrapCycles) and the bounds are given in
+            col_ci_low and col_ci_high.  Needs at least 2 cycles.
+
+        -nBoot - number of bootstrap replicates.  Default is 2000.
+
+        -seed - seed for the resampling, so intervals can be repeated.
+            Default is 0.
+
+        -workers - number of threads to find the intervals with.  Default
+            is 1.
+
         """
+        import numpy as np
+
+        #Use every whole cycle, if asked
+        if nCycles == 'auto':
+            nCycles = self.chooseCycles(freq, phase=phase, rod=rod)
+
         #So don't divide by zero in static case (0 Hz)
         if freq == 0:
             print 'Static case.  Finding net values by averaging over ' +str(nCycles) + ' subsets of time trace.'
@@ -451,8 +854,8 @@ class FlapperData(object):
             #find period of motion cycle in s
             p = 1./freq
         
-        #convert to ms
-        p *=1000
+        #convert to rows, using the sampling frequency
+        p *= self.schema.fs
         #p equals the number of dataframe rows per 1 motion cycle
         
         #find total number of rows for nCycles
@@ -460,32 +863,87 @@ class FlapperData(object):
         
         #round p to an integer
         p = int(round(p))
+
+        #Make sure there's enough data for nCycles
+        if phase == 'rows' and p > self.foilData.shape[0]:
+            raise ValueError(str(nCycles) + ' cycles need ' + str(p) + ' rows, but there are only ' + str(self.foilData.shape[0]) + '.  See countCycles.')
+
+        def select_rows(r):
+            """
+            A helper-code that picks the rows to average: the first p rows,
+            or the rows within the first nCycles cycles.
+            """
+            if phase == 'rows':
+                return slice(0, p)
+            else:
+                cycles = self.findPhase(freq, phase=phase, rod=r)
+                
+                #Make sure there's enough data for nCycles
+                if cycles[0] > 0 or cycles[-1] < nCycles:
+                    raise ValueError(str(nCycles) + ' cycles were asked for, but only ' + str(max(0, int(np.floor(cycles[-1] + 1e-9)))) + ' whole cycles are available.  See countCycles.')
+                
+                return (cycles >= 0) & (cycles < nCycles)
         
-        #Create a dictionary to store averages in
-        avgs = {}
-        
-        #for each column to calculate an average for:
-        for col in columns:
+        def cycle_sums(values, r):
+            """
+            A helper-code that splits the rows picked by select_rows into
+            cycles, for the bootstrap.  Returns the sum of each column over
+            each cycle (cycles, columns), and the number of rows in each.
+            """
+            if phase == 'rows':
+                #nCycles runs of (nearly) equal numbers of rows
+                n = int(round(nCycles))
+                cycle = (np.arange(0, p)*n)//p
+                values = values[:, 0:p]
+            else:
+                cycles = self.findPhase(freq, phase=phase, rod=r)
+                keep = (cycles >= 0) & (cycles < nCycles)
+                cycle = np.floor(cycles[keep]).astype(int)
+                values = values[:, keep]
+                n = cycle.max() + 1
+            
+            sizes = np.bincount(cycle, minlength=n)
+            sums = np.array([np.bincount(cycle, weights=v, minlength=n) for v in values]).T
             
-            #Find the average of the first p rows of the column
-            a = self.foilData[col][0:p].mean()
+            return sums, sizes
+        
+        def add_intervals(df, suffix, r):
+            """
+            A helper-code that adds bootstrap confidence intervals for the
+            net values to the dictionary.
+            """
+            sums, sizes = cycle_sums(df.take(columns), r)
+            low, high = bootstrapCycles(sums, sizes=sizes, nBoot=nBoot, ci=ci, seed=seed, workers=workers)
             
-            #add it to the dictionary
-            avgs[col]= [a]
+            for k, col in enumerate(columns):
+                avgs[col+suffix+'_ci_low'] = [low[k]]
+                avgs[col+suffix+'_ci_high'] = [high[k]]
+        
+        #Create a dictionary to store averages in
+        avgs = {}
+        
+        #Find the averages of all columns at once
+        a = self.foilData.take(columns)[:, select_rows(0)].mean(axis=1)
+        
+        #add them to the dictionary
+        for k, col in enumerate(columns):
+            avgs[col]= [a[k]]
+        
+        #and their confidence intervals, if asked
+        if ci > 0:
+            add_intervals(self.foilData, '', 0)
         
         #if rod data is desired too
         if rod == 1:
             
             #do the same thing for the rod data
+            a = self.rodData.take(columns)[:, select_rows(1)].mean(axis=1)
             
-            #for each column to calculate an average for:
-            for col in columns:
-                
-                #Find the average of the first p rows of the column
-                a = self.rodData[col][0:p].mean()
-                
-                #add it to the dictionary
-                avgs[col+'_rod'] = [a]
+            for k, col in enumerate(columns):
+                avgs[col+'_rod'] = [a[k]]
+            
+            if ci > 0:
+                add_intervals(self.rodData, '_rod', 1)
                 
         #optionally save the net values
         if save == 1:
@@ -498,8 +956,8 @@ class FlapperData(object):
             #convert dictionary to a dataframe
             avgs=pd.DataFrame(avgs, columns=avgs.keys())
             
-            #save to an excel file
-            avgs.to_excel(filepath)
+            #save to a file, in the format given by the file extension
+            saveTable(avgs, filepath)
             
             #confirm done
             print 'Saved file as ' + filepath.split('/')[-1]
@@ -508,13 +966,16 @@ class FlapperData(object):
         return avgs
         
     
+    @profiled('saveOut')
     def saveOut(self, filepath, rod=0, rodpath='none'):
         """
-        Save out dataframe to Excel at the given filepath.
+        Save out dataframe at the given filepath.
         
         Inputs:
         
-        -filepath - including file name; where to save file
+        -filepath - including file name; where to save file.  The file
+            extension sets the format (see saveTable) - e.g. .xlsx for Excel
+            or .parquet for a much faster and smaller file.
         
         -rod - set equal to 1 to also save out the rod dataframe; otherwise,
             only save out foil data
@@ -523,16 +984,45 @@ class FlapperData(object):
             
         """
         #save foil data
-        self.foilData.to_excel(filepath)
+        saveTable(self.foilData.frame(), filepath)
         print 'Foil data saved'
-        
+
         #optionally save rod data
         if rod == 1:
-            self.rodData.to_excel(rodpath)
+            saveTable(self.rodData.frame(), rodpath)
             print 'Rod data saved'
             
     
-    def phaseAvg(self, columns, freq, nCycles, filepath, rod=0):
+    @profiled('storeDerived')
+    def storeDerived(self, tag, rod=0):
+        """
+        Writes the columns added by processing (e.g. Res_Fx, Fx_filt,
+        Fx_noRod) to memory-mapped files next to the raw data in the
+        store, so other processes can map them (FlapperData with storeDir
+        and storeTag, or openStore) instead of repeating the processing.
+        Only available when the data were loaded with storeDir.
+        
+        Inputs:
+        
+        -tag - name for this set of processed columns, e.g. 'cut7_res'.
+            Use a different tag for each set of processing settings.
+        
+        -rod - set equal to 1 to also store the rod data's processed columns
+        
+        """
+        if self.foilStore == 'none':
+            raise ValueError('Data were not loaded with storeDir, so there is no store to write to.')
+        
+        storeDerived(self.foilData, self.foilStore, tag)
+        
+        if rod == 1:
+            if self.rodStore == 'none':
+                raise ValueError('Rod data were not loaded from a store, so there is no store to write to.')
+            storeDerived(self.rodData, self.rodStore, tag)
+        
+    
+    @profiled('phaseAvg')
+    def phaseAvg(self, columns, freq, nCycles, filepath='none', rod=0, phase='rows', nBins=1000, ci=0, nBoot=2000, seed=0, workers=1):
         """
         Phase averages data in columns over nCycles.
         
@@ -544,147 +1034,2334 @@ class FlapperData(object):
         -freq - flapping frequency used
         
         -nCycles - the number of cycles to take the average over.  Must
-            be at least 1, and no more than 10 seconds worth of time.
+            be at least 1, and no more than the data hold (see
+            countCycles).  Set to 'auto' to use every whole cycle.
             
-        -filepath - where to save phase-averaged data
+        -filepath - where to save phase-averaged data.  Default is 'none'
+            (don't save).  The file extension sets the format (see
+            saveTable).
             
         -rod - if average values for the rod are also desired, set equal to 1
         
-        """
+        -phase - default is 'rows' (cut the data into cycles of fs/freq
+            rows, rounded to a whole row, where fs is the sampling
+            frequency).  Set to 'freq' or 'heave' to
+            instead find the phase of every row with findPhase and
+            interpolate each cycle onto nBins evenly spaced phases.  Use
+            this when fs/freq is not a whole number of rows (e.g. 0.3 or
+            1.7 Hz at 1000 Hz), where rounding drifts by a row every cycle.
+        
+        -nBins - number of phases per cycle when phase is 'freq' or
+            'heave'.  Default is 1000.
+
+        -ci - confidence level for bootstrap confidence intervals, e.g.
+            0.95.  Default is 0 (none).  Whole cycles are resampled nBoot
+            times (see bootstrapCycles) and the bounds are given in
+            col_ci_low and col_ci_high, for every time point.  Needs at
+            least 2 cycles.
+
+        -nBoot - number of bootstrap replicates.  Default is 2000.
+
+        -seed - seed for the resampling, so intervals can be repeated.
+            Default is 0.
+
+        -workers - number of threads to find the intervals with.  Default
+            is 1.
+
+        Returns a dataframe with the phase-average of each column, its
+        standard deviation (col_std), and a time column (plus col_rod and
+        col_rod_std when rod == 1).  When phase is 'freq' or 'heave', a
+        phase column (fraction of a cycle) is included too.
+        
+        Notes:
+        -The standard deviation is the sample standard deviation across
+            cycles - the sum of square errors is divided by nCycles-1.
+            Earlier versions always divided by 2, which was only correct for
+            nCycles = 3.  With nCycles = 1, the standard deviation is NaN.
+        -Earlier versions re-used the foil lists of values and standard
+            deviations for the rod, so the rod standard deviations (and the
+            last foil column's standard deviation) were wrong.  Rod data is
+            now averaged on its own.
         
-        import numpy as np        
+        """
         
+        import numpy as np
+        import pandas as pd
+
+        #Use every whole cycle, if asked
+        if nCycles == 'auto':
+            nCycles = self.chooseCycles(freq, phase=phase, rod=rod)
+
         #So don't divide by zero in static case (0 Hz)
         if freq == 0:
             print 'Static case.  Phase-averaging over ' +str(nCycles) + ' subsets of time trace.'
             print ''
             #p is the number of dataframe rows in 1 motion cycle.  In static case,
-            #break video into 1000-frame chunks
-            p = 1000
+            #break video into 1-second chunks
+            p = int(round(self.schema.fs))
         
         else:
             #find period of motion cycle in s
             p = 1./freq
         
-            #convert to ms
-            p *= 1000
+            #convert to rows, using the sampling frequency
+            p *= self.schema.fs
             #p equals the number of dataframe rows per 1 motion cycle
             
             #round p to an integer
             p = int(round(p))
         
-        #Create a dictionary to store averages in
-        avgs = {}
+        nCycles = int(nCycles)
         
-        #for each column to calculate an average for:
-        for col in columns:
+        #When resampling, every cycle is interpolated onto nBins phases
+        if phase != 'rows':
+            p = int(nBins)
             
-            #make a list of the each time-point's phase-average and standard deviation
-            averageList = []            
-            stdevList = []
+            #the phases to sample, in cycles: (nCycles, nBins)
+            grid = np.arange(0,p)/float(p)
+            targets = (np.arange(0,nCycles).reshape(-1,1) + grid).ravel()
+        
+        def stack_cycles(df, r):
+            """
+            A helper-code that stacks the cycles of every column on top of
+            each other - an (nCycles, p, columns) array.
+            """
             
-            #look at the ith row in a cycle
-            for i in range(0,p):
-                
-                #initialize storage for the sum of corresponding values
-                total = 0
-                #make a list of the values
-                values = []
-                
-                #look at the ith row in the nth cycle (all in turn)
-                for n in range(0, nCycles):
-                    
-                    #Get the value in the ith row of the nth cycle
-                    total += self.foilData[col][i+n*p]
-                
-                    #Get the values themselves
-                    values.append(self.foilData[col][i+n*p])
+            #Cut the data into cycles of p rows
+            if phase == 'rows':
                 
-                #divide by nCycles to get the average for that time point
-                newAvg = total/nCycles
+                #Make sure there's enough data for nCycles
+                if nCycles*p > df.shape[0]:
+                    raise ValueError(str(nCycles) + ' cycles of ' + str(p) + ' rows need more than the ' + str(df.shape[0]) + ' rows available.')
                 
-                #add the average to the collection
-                averageList.append(newAvg)
-                
-                #make a list of square errors
-                sqerrors = []
+                values = df.take(columns)[:, 0:nCycles*p]
+                return values.reshape(len(columns), nCycles, p).transpose(1, 2, 0)
+            
+            #Or interpolate each column onto the phase grid
+            else:
+                cycles = self.findPhase(freq, phase=phase, rod=r)
                 
-                #calculate the standard deviation
-                for v in values:
-                    sqerrors.append(abs(v-newAvg)**2.)
-                sumsqerrors = np.sum(sqerrors)
-                stdev = np.sqrt(sumsqerrors/2.)
+                #Make sure there's enough data for nCycles
+                if cycles[0] > 0 or cycles[-1] < nCycles:
+                    raise ValueError(str(nCycles) + ' cycles need more than the ' + str(round(cycles[-1] - max(cycles[0], 0), 2)) + ' cycles available.')
                 
-                #add standard deviation to the list
-                stdevList.append(stdev)                
+                values = df.take(columns)
+                stacked = np.empty((targets.shape[0], len(columns)))
+                for k in range(0, len(columns)):
+                    stacked[:,k] = np.interp(targets, cycles, values[k])
                 
-            #add the phased-average column to the dictionary    
-            avgs[col] = averageList
-            #add the error column to the dictionary
-            avgs[(col+'_std')] = stdevList
+                return stacked.reshape(nCycles, p, len(columns))
+        
+        def cycle_stats(df, r):
+            """
+            A helper-code that finds the average and standard deviation of
+            each time point across the stacked cycles, and the bounds of
+            their confidence intervals (None if ci = 0).
+            """
+            
+            #Stack the cycles
+            cycles = stack_cycles(df, r)
+            
+            #Average corresponding time points across cycles
+            average = cycles.mean(axis=0)
+            
+            #Find the sample standard deviation across cycles
+            if nCycles > 1:
+                stdev = cycles.std(axis=0, ddof=1)
+            else:
+                stdev = np.nan*np.ones_like(average)
+            
+            #Resample whole cycles for confidence intervals
+            if ci > 0:
+                low, high = bootstrapCycles(cycles, nBoot=nBoot, ci=ci, seed=seed, workers=workers)
+            else:
+                low, high = None, None
+            
+            return average, stdev, low, high
+        
+        #Find the phase-averages and standard deviations for the foil
+        average, stdev, low, high = cycle_stats(self.foilData, 0)
+        
+        #Create a dataframe to store averages in
+        avgs = pd.DataFrame(index=range(0,p))
+        
+        #add the phase-averaged and error columns to the dataframe
+        for k, col in enumerate(columns):
+            avgs[col] = average[:,k]
+            avgs[col+'_std'] = stdev[:,k]
+            if ci > 0:
+                avgs[col+'_ci_low'] = low[:,k]
+                avgs[col+'_ci_high'] = high[:,k]
         
         #make a time sequence
-        time = np.array(range(0,p))
-        time = time/1000.
-        avgs['time']=time
+        if phase == 'rows':
+            avgs['time'] = np.arange(0,p)/float(self.schema.fs)
+        else:
+            avgs['phase'] = grid
+            if freq == 0:
+                avgs['time'] = grid
+            else:
+                avgs['time'] = grid/freq
         
         if rod == 1:
-            #for each column to calculate an average for:
-            for col in columns:
-                
-                #make a list of the each time-point's phase-average
-                averageList = []            
-                
-                #look at the ith row in a cycle
-                for i in range(0,p):
-                    
-                    #initialize storage for the sum of corresponding values
-                    total = 0
-                    
-                    #look at the ith row in the nth cycle (all in turn)
-                    for n in range(0, nCycles):
-                        
-                        #Get the value in the ith row of the nth cycle
-                        total += self.rodData[col][i+n*p]
-                        
-                        #Get the values themselves
-                        values.append(self.rodData[col][i+n*p])
-                
-                    
-                    #divide by nCycles to get the average for that time point
-                    newAvg = total/nCycles
-                    
-                    #add the average to the collection
-                    averageList.append(newAvg)
-                    
-                    #make a list of square errors
-                    sqerrors = []
-                
-                    #calculate the standard deviation
-                    for v in values:
-                        sqerrors.append(abs(v-newAvg)**2.)
-                    sumsqerrors = np.sum(sqerrors)
-                    stdev = np.sqrt(sumsqerrors/2.)
-                
-                    #add standard deviation to the list
-                    stdevList.append(stdev)
-                    
-                #add the phase-averaged column to the dictionary    
-                avgs[col+'_rod'] = averageList
-                #add the error column to the dictionary
-                avgs[(col+'_rod_std')] = stdevList
-                
-        #save the dictionary to filepath
+            #repeat for the rod data
+            average, stdev, low, high = cycle_stats(self.rodData, 1)
             
-        #import the dataframe-making package
-        import pandas as pd
-            
-        #convert dictionary to a dataframe
-        avgs=pd.DataFrame(avgs, columns=avgs.keys())
+            for k, col in enumerate(columns):
+                avgs[col+'_rod'] = average[:,k]
+                avgs[col+'_rod_std'] = stdev[:,k]
+                if ci > 0:
+                    avgs[col+'_rod_ci_low'] = low[:,k]
+                    avgs[col+'_rod_ci_high'] = high[:,k]
+                
+        #optionally save the phase-averages
+        if filepath != 'none':
             
-        #save to an excel file
-        avgs.to_excel(filepath)
+            #save to a file, in the format given by the file extension
+            saveTable(avgs, filepath)
             
-        #confirm done
-        print 'Saved file as ' + filepath.split('/')[-1]
-        
\ No newline at end of file
+            #confirm done
+            print 'Saved file as ' + filepath.split('/')[-1]
+        
+        #deliver the phase-averages
+        return avgs
+    
+    
+    @profiled('spectrum')
+    def spectrum(self, freq, columns=None, rod=0, nperseg='auto'):
+        """
+        Finds the power spectral density of each column, all in one Welch
+        pass (see welchSpectra).  Spectra are kept in self.spectra and
+        re-used until the columns they came from are made again.
+        
+        Input:
+        
+        -freq - flapping frequency used
+        
+        -columns - list of columns.  Default is None (the force and torque
+            channels, see forceChannels).
+        
+        -rod - set equal to 1 to use the rod data instead
+        
+        -nperseg - rows in each Welch segment.  Default is 'auto' (see
+            segmentLength: 4 cycles, or 4 seconds in the static case).
+        
+        Returns a dataframe with a freq column (Hz) and the PSD of each
+        column (units^2/Hz).  To find spectra of many trials at once, see
+        trialSpectra.
+        
+        """
+        return trialSpectra([self], freq, columns=columns, rod=rod, nperseg=nperseg)[0]
+    
+    
+    def harmonics(self, freq, columns=None, rod=0, nHarmonics=10, nperseg='auto'):
+        """
+        Finds the amplitude of each column at 1, 2, ... nHarmonics times
+        the flapping frequency, from its spectrum (see spectrum and
+        harmonicAmplitudes).
+        
+        Input:
+        
+        -freq - flapping frequency used.  Must be more than 0.
+        
+        -columns, rod, nperseg - see spectrum
+        
+        -nHarmonics - number of harmonics.  Default is 10.
+        
+        Returns a dataframe with one row per harmonic (1, 2, ...): a freq
+        column (Hz), and the amplitude of each column (NaN above the
+        Nyquist frequency).
+        
+        """
+        import numpy as np
+        import pandas as pd
+        
+        if freq <= 0:
+            raise ValueError('Harmonics need a flapping frequency more than 0.')
+        
+        psd = self.spectrum(freq, columns=columns, rod=rod, nperseg=nperseg)
+        columns = [col for col in psd.columns if col != 'freq']
+        
+        amplitudes = harmonicAmplitudes(psd['freq'].values, psd[columns].values.T, freq, nHarmonics)
+        
+        result = pd.DataFrame(amplitudes.T, columns=columns, index=range(1, nHarmonics+1))
+        result.insert(0, 'freq', freq*np.arange(1, nHarmonics+1))
+        
+        return result
+    
+    
+    def suggestCutoff(self, freq, columns=None, rod=0, nHarmonics=10, snr=10., nperseg='auto'):
+        """
+        Suggests a cutoff frequency for filterData from the spectra of the
+        columns (see spectrum and suggestCutoff).
+        
+        Input:
+        
+        -freq - flapping frequency used
+        
+        -columns, rod, nperseg - see spectrum
+        
+        -nHarmonics, snr - see the suggestCutoff function
+        
+        """
+        psd = self.spectrum(freq, columns=columns, rod=rod, nperseg=nperseg)
+        columns = [col for col in psd.columns if col != 'freq']
+        
+        return suggestCutoff(psd['freq'].values, psd[columns].values.T, freq,
+                             nHarmonics=nHarmonics, snr=snr, fs=self.schema.fs)
+
+
+
+class ChannelTable(object):
+    """
+    Flapper data as a 2-D array with one row per channel (Fx, heave_pos,
+    Fx_filt, ...) and one column per sample, and a map from channel name to
+    row.  Each channel is one contiguous run of memory, so whole-channel
+    math and filtering don't copy the data, and new channels are written
+    into spare rows set aside for them instead of rebuilding a dataframe.
+
+    table['Fx'] (or table.Fx) is the channel's row, as a numpy array;
+    table['Fx_filt'] = values adds or replaces a channel;
+    table.take(['Fx', 'Fy']) is a channels x samples array; and
+    table.frame() is a dataframe, for export.
+
+    Channels are only overwritten in place in memory the table set aside
+    itself.  Replacing a channel of an array passed in (e.g. a dataframe's
+    values or a memory-mapped file) puts it in a spare row instead, so the
+    array is never changed.
+
+    Inputs:
+        values - channels x samples array of the first channels
+
+        names - list of their names
+
+        spare - number of rows to set aside at a time for new channels.
+            Default is 8.
+
+        owned - default is 0.  Set to 1 if values is the table's own copy,
+            which it may overwrite.
+    """
+
+    def __init__(self, values, names, spare=8, owned=0):
+        import numpy as np
+
+        values = np.asarray(values)
+        if values.ndim != 2 or values.shape[0] != len(names):
+            raise ValueError('values must be a 2-D array with one row per name')
+
+        self.blocks = []
+        self.index = {}
+        self.names = []
+        self.nSamples = values.shape[1]
+        self.spare = spare
+
+        #rows not used yet in each block, and which blocks the table may
+        #overwrite
+        self.free = []
+        self.owned = []
+
+        self.addBlock(values, names, owned=owned)
+
+
+    @classmethod
+    def fromFrame(cls, df):
+        """
+        Makes a ChannelTable from a dataframe.  Columns of one number type
+        are usually stored this way already, so they aren't copied (and
+        the table never changes them).
+        """
+        import numpy as np
+
+        return cls(np.ascontiguousarray(df.values.T), [str(col) for col in df.columns])
+
+
+    def addBlock(self, values, names, owned=0):
+        """
+        Adds channels from an existing channels x samples array (e.g. a
+        memory-mapped file) without copying it.  Set owned to 1 if the
+        table may overwrite the array.
+        """
+        if values.shape[1] != self.nSamples:
+            raise ValueError('Channels must have ' + str(self.nSamples) + ' samples, not ' + str(values.shape[1]))
+
+        self.blocks.append(values)
+        self.free.append(0)
+        self.owned.append(owned)
+        for k, name in enumerate(names):
+            if name not in self.index:
+                self.names.append(name)
+            self.index[name] = (len(self.blocks) - 1, k)
+
+
+    @property
+    def columns(self):
+        """
+        Channel names, in order.
+        """
+        return list(self.names)
+
+
+    @property
+    def shape(self):
+        """
+        (samples, channels), as for a dataframe.
+        """
+        return (self.nSamples, len(self.names))
+
+
+    def __len__(self):
+        return self.nSamples
+
+
+    def __contains__(self, name):
+        return name in self.index
+
+
+    def __getitem__(self, name):
+        try:
+            b, k = self.index[name]
+        except KeyError:
+            raise KeyError('No channel ' + repr(name))
+        return self.blocks[b][k]
+
+
+    def __getattr__(self, name):
+        #channels can be read as attributes too, like dataframe columns
+        index = self.__dict__.get('index', {})
+        if name in index:
+            b, k = index[name]
+            return self.blocks[b][k]
+        raise AttributeError(name)
+
+
+    def __setitem__(self, name, values):
+        import numpy as np
+
+        values = np.asarray(values)
+
+        #overwrite an existing channel in place, if its memory is the table's
+        #own
+        if name in self.index:
+            b, k = self.index[name]
+            if self.owned[b] == 1 and (values.ndim == 0 or values.dtype == self.blocks[b].dtype):
+                self.blocks[b][k] = values
+                return
+
+        #otherwise use a spare row of the same number type, setting aside
+        #more if needed
+        if values.ndim == 0:
+            dtype = self.blocks[0].dtype
+        else:
+            dtype = values.dtype
+        spares = [b for b in range(len(self.blocks)) if self.free[b] > 0 and self.blocks[b].dtype == dtype]
+        if len(spares) == 0:
+            self.blocks.append(np.empty((self.spare, self.nSamples), dtype=dtype))
+            self.free.append(self.spare)
+            self.owned.append(1)
+            spares = [len(self.blocks) - 1]
+
+        b = spares[0]
+        k = self.blocks[b].shape[0] - self.free[b]
+        self.blocks[b][k] = values
+        self.free[b] -= 1
+
+        if name not in self.index:
+            self.names.append(name)
+        self.index[name] = (b, k)
+
+
+    def take(self, names):
+        """
+        Returns the named channels as a channels x samples array - a view
+        when they are next to each other in memory, otherwise a copy.
+        """
+        import numpy as np
+
+        for name in names:
+            if name not in self.index:
+                raise KeyError('No channel ' + repr(name))
+        if len(names) == 0:
+            return np.empty((0, self.nSamples))
+
+        rows = [self.index[name] for name in names]
+        b = rows[0][0]
+        first = rows[0][1]
+        if all([row == (b, first + k) for k, row in enumerate(rows)]):
+            return self.blocks[b][first:first + len(rows)]
+
+        return np.vstack([self.blocks[b][k] for (b, k) in rows])
+
+
+    def frame(self, columns=None):
+        """
+        Returns the channels (all of them, or a list of columns) as a
+        dataframe with one column per channel.  Each column keeps its
+        channel's number type.
+        """
+        import pandas as pd
+        from collections import OrderedDict
+
+        if columns is None:
+            columns = self.names
+        columns = list(columns)
+
+        #one number type - a single block, which pandas can use as it is
+        if len(set([self[col].dtype for col in columns])) <= 1:
+            return pd.DataFrame(self.take(columns).T, columns=columns, copy=False)
+
+        return pd.DataFrame(OrderedDict([(col, self[col]) for col in columns]), columns=columns)
+
+
+    def copy(self):
+        """
+        Returns a copy with its own memory (e.g. of a memory-mapped table).
+        """
+        import numpy as np
+
+        return ChannelTable(np.array(self.take(self.names)), self.names, spare=self.spare, owned=1)
+
+
+    def view(self):
+        """
+        Returns a table of the same channels that shares this table's
+        memory.  Channels added or replaced in it go in rows of its own, so
+        this table never changes.
+        """
+        table = object.__new__(ChannelTable)
+        table.blocks = list(self.blocks)
+        table.index = dict(self.index)
+        table.names = list(self.names)
+        table.nSamples = self.nSamples
+        table.spare = self.spare
+        table.free = [0] * len(self.blocks)
+        table.owned = [0] * len(self.blocks)
+
+        return table
+
+
+    def __getstate__(self):
+        #save only the rows in use
+        return {'names': self.names, 'values': self.take(self.names), 'spare': self.spare}
+
+
+    def __setstate__(self, state):
+        self.__init__(state['values'], state['names'], spare=state['spare'], owned=1)
+
+
+
+@profiled('saveTable')
+def saveTable(df, filepath, compression='default'):
+    """
+    Saves a dataframe to filepath, in the format given by the file
+    extension:
+        .xlsx or .xls - Excel
+        .parquet - Parquet (needs pyarrow or fastparquet)
+        .feather - Feather (needs pyarrow)
+        .npz - compressed NumPy archive
+        .csv - comma-separated text
+    
+    Parquet, Feather and .npz files are much faster to write and read back
+    than Excel, and much smaller.  Other formats can be added to
+    tableWriters (and tableReaders, for loadTable).
+    
+    Inputs:
+    
+    -df - the dataframe to save
+    
+    -filepath - including file name; where to save file
+    
+    -compression - compression to use for Parquet and Feather files.
+        Default is 'default' (snappy for Parquet, lz4 for Feather).  Set to
+        None for no compression.
+    
+    """
+    import os
+    
+    #find the format from the file extension
+    ext = os.path.splitext(filepath)[1].lower()
+    
+    if ext not in tableWriters:
+        raise ValueError('No table writer for ' + repr(ext) + ' files.  Use one of: ' + ', '.join(sorted(tableWriters.keys())))
+    
+    tableWriters[ext](df, filepath, compression)
+    
+    
+def loadTable(filepath):
+    """
+    Loads a dataframe saved by saveTable, in the format given by the file
+    extension (see saveTable).
+    """
+    import os
+    
+    #find the format from the file extension
+    ext = os.path.splitext(filepath)[1].lower()
+    
+    if ext not in tableReaders:
+        raise ValueError('No table reader for ' + repr(ext) + ' files.  Use one of: ' + ', '.join(sorted(tableReaders.keys())))
+    
+    return tableReaders[ext](filepath)
+
+
+def _writeExcel(df, filepath, compression):
+    df.to_excel(filepath)
+
+def _writeParquet(df, filepath, compression):
+    if compression == 'default':
+        compression = 'snappy'
+    df.to_parquet(filepath, compression=compression)
+
+def _writeFeather(df, filepath, compression):
+    from pyarrow import feather
+    if compression == 'default':
+        compression = 'lz4'
+    #Feather doesn't store the index, so keep it as a column
+    try:
+        feather.write_feather(df.reset_index(), filepath, compression=compression)
+    #pyarrow before 0.17 can't compress Feather files
+    except TypeError:
+        feather.write_feather(df.reset_index(), filepath)
+
+def _writeNpz(df, filepath, compression):
+    import numpy as np
+    #store each column as its own array, plus the index and column order
+    arrays = {'__index__': df.index.values,
+              '__columns__': np.array([str(col) for col in df.columns])}
+    for col in df.columns:
+        arrays[str(col)] = df[col].values
+    np.savez_compressed(filepath, **arrays)
+
+def _writeCsv(df, filepath, compression):
+    df.to_csv(filepath)
+
+
+def _readExcel(filepath):
+    import pandas as pd
+    return pd.read_excel(filepath, index_col=0)
+
+def _readParquet(filepath):
+    import pandas as pd
+    return pd.read_parquet(filepath)
+
+def _readFeather(filepath):
+    from pyarrow import feather
+    df = feather.read_feather(filepath).set_index('index')
+    df.index.name = None
+    return df
+
+def _readNpz(filepath):
+    import pandas as pd
+    import numpy as np
+    arrays = np.load(filepath)
+    columns = list(arrays['__columns__'])
+    return pd.DataFrame(dict((col, arrays[col]) for col in columns),
+                        index=arrays['__index__'], columns=columns)
+
+def _readCsv(filepath):
+    import pandas as pd
+    return pd.read_csv(filepath, index_col=0)
+
+
+#File formats saveTable and loadTable know, by file extension
+tableWriters = {'.xlsx': _writeExcel,
+                '.xls': _writeExcel,
+                '.parquet': _writeParquet,
+                '.feather': _writeFeather,
+                '.npz': _writeNpz,
+                '.csv': _writeCsv}
+
+tableReaders = {'.xlsx': _readExcel,
+                '.xls': _readExcel,
+                '.parquet': _readParquet,
+                '.feather': _readFeather,
+                '.npz': _readNpz,
+                '.csv': _readCsv}
+
+
+#Columns of a combo file that hold force, torque, and position data, and the
+#names they are given in FlapperData.
+comboColumns = {'X axis encoder 6602 degrees':'pitch_pos',
+                'Y axis encoder 6602 meters':'heave_pos',
+                'Fx (N)':'Fx',
+                'Fy (N)':'Fy',
+                'Fz (N)':'Fz',
+                'Tx (N-mm)':'Tx',
+                'Ty (N-mm)':'Ty',
+                'Tz (N-mm)':'Tz'
+                }
+
+#Columns of a combo file that don't show force, torque, or position data,
+#and aren't loaded.
+droppedColumns = ['Pressure 1 Ai2',
+                  'Pressure 2 Ai3',
+                  'Pressure 3 Ai4',
+                  'Pressure 4 Ai5',
+                  'digital in loop start 6221',
+                  'camera trigger echo 6221',
+                  'Loop Pulse']
+
+
+class AcquisitionSchema(object):
+    """
+    Describes how Flapper data were recorded, so the analysis doesn't have
+    to assume 1000 Hz and 10 seconds.
+    
+    Inputs:
+        fs - sampling frequency, in Hz.  Default is 1000.
+        
+        duration - seconds of data to use from each combo file.  Default is
+            None (every row in the file).
+        
+        channels - dictionary of combo file columns to load and the names
+            to give them.  Default is None (comboColumns).
+        
+        dropped - list of combo file columns to skip.  Default is None
+            (droppedColumns).  Any other columns are loaded with their
+            names unchanged.
+    """
+    
+    def __init__(self, fs=1000., duration=None, channels=None, dropped=None):
+        
+        self.fs = float(fs)
+        self.duration = duration
+        
+        if channels is None:
+            channels = comboColumns
+        self.channels = dict(channels)
+        
+        if dropped is None:
+            dropped = droppedColumns
+        self.dropped = list(dropped)
+    
+    
+    def __repr__(self):
+        return 'AcquisitionSchema(fs=' + repr(self.fs) + ', duration=' + repr(self.duration) + ')'
+
+
+#The schema used when none is given - the lab's 1000 Hz set-up
+defaultSchema = AcquisitionSchema()
+
+
+def wholeCycleRows(n, freq, fs=1000.):
+    """
+    Gives the number of rows, out of the first n, that make up whole motion
+    cycles at flapping frequency freq and sampling frequency fs.  Gives n
+    if there is less than one whole cycle.
+    """
+    if freq == 0:
+        return n
+    
+    rowsPerCycle = float(fs)/freq
+    last = int(round(int(n/rowsPerCycle + 1e-9)*rowsPerCycle))
+    
+    if last == 0:
+        return n
+    return min(last, n)
+
+
+def dominantFreq(x, fs=1000.):
+    """
+    Finds the strongest frequency (Hz) in a trace x sampled at fs, from the
+    peak of its spectrum.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    power = np.abs(np.fft.rfft(x - x.mean()))
+    power[0] = 0.
+
+    return np.argmax(power)*float(fs)/x.shape[0]
+
+
+def findCycles(x, fs=1000., freq=0, method='zero'):
+    """
+    Finds where each motion cycle starts in a position trace (heave_pos or
+    pitch_pos), working on the whole array at once.
+
+    Inputs:
+
+    -x - the position trace
+
+    -fs - sampling frequency, in Hz.  Default is 1000.
+
+    -freq - flapping frequency, in Hz, if known.  Default is 0 (use the
+        strongest frequency in x).  Cycle starts less than half a period
+        after the first start of a group are noise around that start, and
+        are counted once.
+
+    -method - default is 'zero': cycles start where x crosses zero going
+        up, located to a fraction of a row by linear interpolation (x
+        should be centered on zero, as FlapperData does).  Only crossings
+        where x was last below -h (rather than above +h) count, with h a
+        quarter of the amplitude, so noise around zero on the way down
+        isn't taken for a cycle start.  Set to 'peak' to
+        start them at the peaks of x instead, located to a fraction of a row
+        with a parabola through each peak and its neighbors (x doesn't need
+        to be centered).
+
+    Both methods work on x smoothed with a centered moving average over a
+    twentieth of a period, which takes out encoder noise without moving
+    the crossings or peaks of the motion.
+
+    Returns an array of the (fractional) rows where cycles start.  Each
+    pair of consecutive values bounds one whole cycle.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+
+    if freq <= 0:
+        freq = dominantFreq(x, fs)
+    if freq <= 0:
+        return np.empty(0)
+    gap = 0.5*fs/freq
+
+    #smooth with a centered moving average (narrower near the ends, so it
+    #stays centered)
+    width = int(round(0.05*fs/freq))//2
+    rows = np.arange(x.shape[0])
+    half = np.minimum(width, np.minimum(rows, x.shape[0] - 1 - rows))
+    total = np.concatenate([[0.], np.cumsum(x)])
+    x = (total[rows + half + 1] - total[rows - half])/(2*half + 1)
+
+    if method == 'zero':
+        #rows where x crosses zero going up
+        up = np.flatnonzero((x[:-1] < 0) & (x[1:] >= 0))
+
+        #whether x was last below -h (-1) or above +h (1) at each row
+        low, high = np.percentile(x, [1, 99])
+        h = 0.25*0.5*(high - low)
+        level = np.where(x > h, 1, np.where(x < -h, -1, 0))
+
+        #rows near the ends, smoothed over less than a whole window, are
+        #too noisy to go by
+        level[half < width] = 0
+        if level[0] == 0:
+            #(from the first row smoothed over a whole window)
+            level[0] = np.where(x[min(width, x.shape[0] - 1)] < 0, -1, 1)
+        last = np.maximum.accumulate(np.where(level != 0, np.arange(x.shape[0]), 0))
+        level = level[last]
+
+        #only crossings coming up from below -h start a cycle
+        up = up[level[up] == -1]
+
+        #locate each crossing between rows by linear interpolation
+        starts = up - x[up]/(x[up+1] - x[up])
+        height = np.zeros_like(starts)
+
+    elif method == 'peak':
+        #local maxima in the top quarter of the trace, so noise near the
+        #troughs isn't counted
+        low, high = np.percentile(x, [1, 99])
+        k = np.flatnonzero((x[1:-1] > x[:-2]) & (x[1:-1] >= x[2:]) & (x[1:-1] > low + 0.75*(high - low))) + 1
+
+        #(leaving out rows near the ends, smoothed over less than a whole
+        #window)
+        k = k[half[k] == width]
+
+        #refine with a parabola through each peak and its neighbors
+        left = x[k-1]
+        right = x[k+1]
+        curve = left - 2.*x[k] + right
+        shift = np.zeros(k.shape[0])
+        bent = curve < 0
+        shift[bent] = 0.5*(left[bent] - right[bent])/curve[bent]
+        starts = k + shift
+        height = x[k]
+
+    else:
+        raise ValueError("method must be 'zero' or 'peak', not " + repr(method))
+
+    if starts.shape[0] == 0:
+        return starts
+
+    #group starts less than half a period after the first start of their
+    #group, and keep one from each group - the first crossing, or the
+    #highest peak
+    group = np.zeros(starts.shape[0], dtype=int)
+    anchor = starts[0]
+    for i in range(1, starts.shape[0]):
+        group[i] = group[i-1]
+        if starts[i] - anchor >= gap:
+            group[i] += 1
+            anchor = starts[i]
+    order = np.lexsort((starts, -height, group))
+    first = np.concatenate([[True], np.diff(group[order]) > 0])
+
+    return starts[order[first]]
+
+
+def heaveCycles(heave, fs=1000., freq=0):
+    """
+    Finds how many motion cycles have passed at each row of a (centered)
+    heave_pos trace, with each cycle starting where heave crosses zero
+    going up (see findCycles).  Rows before the first crossing get
+    negative values, and rows after the last are extended using the
+    average period.  Used by FlapperData.findPhase with phase = 'heave'.
+    """
+    import numpy as np
+
+    rows = np.arange(len(heave), dtype=float)
+
+    #find rows where heave crosses zero going up
+    crossings = findCycles(heave, fs, freq, method='zero')
+
+    if crossings.shape[0] < 2:
+        raise ValueError('Need at least 2 upward zero crossings of heave_pos to find the phase.')
+
+    #count cycles between crossings, and extend past the first and
+    #last crossings using the average period
+    cycles = np.interp(rows, crossings, np.arange(crossings.shape[0], dtype=float))
+    period = (crossings[-1] - crossings[0])/(crossings.shape[0] - 1)
+    before = rows < crossings[0]
+    after = rows > crossings[-1]
+    cycles[before] = (rows[before] - crossings[0])/period
+    cycles[after] = crossings.shape[0] - 1 + (rows[after] - crossings[-1])/period
+
+    return cycles
+
+
+def bootstrapCycles(values, sizes=None, nBoot=2000, ci=0.95, seed=0, workers=1):
+    """
+    Finds bootstrap (percentile) confidence intervals for an average over
+    motion cycles, by resampling whole cycles with replacement, so the
+    rows within a cycle - which aren't independent - stay together.
+
+    Each replicate is summarized by how many times it draws each cycle, so
+    the replicate averages of every column (and phase bin) are found
+    together with one matrix product: (counts . values)/(counts . sizes).
+
+    Inputs:
+
+    -values - an array with one entry per cycle along its first axis, e.g.
+        (cycles, phase bins, columns).  When sizes is given, these are the
+        sums over each cycle's rows instead.
+
+    -sizes - number of rows in each cycle, when values are sums.  Default
+        is None (every cycle counts the same).
+
+    -nBoot - number of replicates.  Default is 2000.
+
+    -ci - confidence level.  Default is 0.95 (the 2.5th to 97.5th
+        percentiles of the replicates).
+
+    -seed - seed for the random draws.  Default is 0.  The same seed gives
+        the same intervals, for any number of workers.
+
+    -workers - number of threads to share the columns between.  Default is
+        1.  (numpy's matrix products and sorting run outside Python's
+        interpreter lock, so threads use several cores.)
+
+    Returns the lower and upper bounds, each shaped like one cycle of
+    values.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    n = values.shape[0]
+    if n < 2:
+        raise ValueError('Confidence intervals need at least 2 cycles.')
+    flat = values.reshape(n, -1)
+
+    if sizes is None:
+        sizes = np.ones(n)
+
+    #how many times each replicate draws each cycle: (cycles, nBoot)
+    counts = np.random.RandomState(seed).multinomial(n, np.ones(n)/n, size=nBoot).astype(float).T
+    totals = np.asarray(sizes, dtype=float).dot(counts)
+
+    percentiles = [50.*(1 - ci), 50.*(1 + ci)]
+
+    def bounds(chunk):
+        """
+        A helper-code that finds the bounds for a chunk of columns.
+        """
+        #(columns, nBoot), so each column's replicates are together
+        replicates = flat[:, chunk].T.dot(counts)/totals
+        return np.percentile(replicates, percentiles, axis=1)
+
+    #work through the columns in chunks of about 8 MB of replicates (the
+    #same chunks for any number of workers)
+    m = flat.shape[1]
+    step = max(1, 2**20//nBoot)
+    chunks = [slice(i, i + step) for i in range(0, m, step)]
+
+    if workers > 1 and len(chunks) > 1:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+        try:
+            found = pool.map(bounds, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        found = [bounds(chunk) for chunk in chunks]
+
+    found = np.concatenate(found, axis=1)
+
+    return found[0].reshape(values.shape[1:]), found[1].reshape(values.shape[1:])
+
+
+def centerPositions(df, freq, pitch, fs=1000.):
+    """
+    Sets up the position columns of Flapper data (a ChannelTable or
+    dataframe): sets
+    pitch_pos to 0 degrees in heave only datasets (pitch = 0), and centers
+    pitch_pos and heave_pos on the x-axis by subtracting the mean from each
+    data point.  The heave mean is found over whole motion cycles only, so
+    a part-cycle at the end doesn't shift it; in the static case (freq = 0)
+    heave is set to 0.
+    """
+    import numpy as np
+    
+    #Set pitch to 0 degrees in heave only datasets
+    if pitch == 0:
+        df['pitch_pos'] = 0.
+    
+    #Center heave_pos on its mean over whole cycles
+    if freq == 0:
+        df['heave_pos'] = 0.
+    else:
+        last = wholeCycleRows(df.shape[0], freq, fs)
+        df['heave_pos'] = df['heave_pos'] - np.mean(np.asarray(df['heave_pos'])[0:last])
+
+    #Center pitch_pos
+    if pitch == 1:
+        df['pitch_pos'] = df['pitch_pos'] - np.mean(df['pitch_pos'])
+    
+    return df
+
+
+@profiled('loadCombo')
+def loadCombo(filepath, dtype='float64', engine='c', names=None, chunksize=None, schema=None):
+    """
+    Loads the force, torque, and position columns of a tab-delimited combo
+    file to a dataframe, and gives the columns names (see AcquisitionSchema).
+    
+    Only the needed columns are read - the schema's dropped columns
+    (pressures and triggers) are skipped - and they are parsed straight to
+    numbers, which is faster and uses less memory than reading every column.
+    When the schema has a duration, only that many seconds of rows are
+    read.
+    
+    Inputs:
+    
+    -filepath - filepath and name of the combo file
+    
+    -dtype - number type to load data as.  Default is 'float64'.
+    
+    -engine - pandas parser to use: 'c' (the default) or 'python'.  Other
+        parsers (e.g. 'pyarrow') can't pick columns with a function, read
+        a set number of rows or read in chunks, so they raise a
+        ValueError.
+    
+    -names - list of (new) column names to load, e.g. ['heave_pos'].
+        Default is None (all of comboColumns).
+    
+    -chunksize - when set, returns an iterator of dataframes of chunksize
+        rows each instead of one dataframe, for files too big to load at
+        once.
+    
+    -schema - an AcquisitionSchema.  Default is None (defaultSchema).
+    
+    """
+    import pandas as pd
+    
+    if engine not in ('c', 'python'):
+        raise ValueError("engine must be 'c' or 'python', not " + repr(engine) + '.  Combo files are read with options only those parsers have.')
+    
+    if schema is None:
+        schema = defaultSchema
+    channels = schema.channels
+    
+    #find the columns to read - the ones not dropped, and of those, the
+    #ones asked for
+    def usecol(col):
+        if col in schema.dropped:
+            return False
+        return names is None or channels.get(col, col) in names
+    
+    #find the number of rows to read
+    if schema.duration is None:
+        nrows = None
+    else:
+        nrows = int(round(schema.duration*schema.fs))
+    
+    df = pd.read_csv(filepath,
+                     delimiter='\t',
+                     usecols=usecol,
+                     dtype=dtype,
+                     engine=engine,
+                     nrows=nrows,
+                     chunksize=chunksize)
+    
+    if chunksize is None:
+        return df.rename(columns=channels)
+    else:
+        return (chunk.rename(columns=channels) for chunk in df)
+
+
+def loadRodData(rodpath, freq, pitch=0, dtype='float64', engine='c', storeDir='none', storeTag='none', schema=None):
+    """
+    Loads a rod-only combo file and sets it up the same way as the foil data
+    in FlapperData (named columns, time column, centered positions).
+    Returns a ChannelTable.
+    
+    Inputs:
+    
+    -rodpath - filepath and name of the rod combo file
+    
+    -freq, pitch, dtype, engine, storeDir, storeTag, schema - as for
+        FlapperData
+    
+    """
+    import numpy as np
+    
+    #Load the rod data to a ChannelTable, with the columns given names
+    if storeDir == 'none':
+        rodData = ChannelTable.fromFrame(loadCombo(rodpath, dtype=dtype, engine=engine, schema=schema))
+    else:
+        rodData = openStore(storeCombo(rodpath, storeDir, dtype=dtype, engine=engine, schema=schema), tag=storeTag)
+    
+    if schema is None:
+        schema = defaultSchema
+    
+    #Add a time column, from the sampling frequency.  (This used to run from
+    #0 to 0.9999 s over 10 s of data.)
+    rodData['time']=np.arange(rodData.shape[0])/float(schema.fs)
+    
+    #Set pitch to 0 degrees in heave only datasets, and center pitch_pos
+    #and heave_pos on the x-axis
+    rodData = centerPositions(rodData, freq, pitch, fs=schema.fs)
+    
+    return rodData
+
+
+@profiled('resolveFrame')
+def resolveFrame(df, computed=None, torques=0):
+    """
+    Performs the resolve Fx and Fy calculation on a ChannelTable or
+    dataframe (see FlapperData.resolveForces) & inserts results into new
+    columns Res_Fx and Res_Fy:
+
+    Res_Fx = Fx*cos(pitch_pos) + Fy*sin(pitch_pos)
+    Res_Fy = -Fx*sin(pitch_pos) + Fy*cos(pitch_pos)
+
+    Note that pitch_pos is converted to radians from degrees before
+    calculation.
+
+    With torques = 1, Tx and Ty are resolved the same way, into Res_Tx and
+    Res_Ty.
+
+    If computed (a dictionary, see FlapperData.computed) is given, the new
+    columns are noted in it.
+
+    """
+    #load a package
+    import numpy as np
+
+    #Find the pitch angle in radians, and its cosine and sine, just once
+    pitch = np.radians(np.asarray(df['pitch_pos']))
+    c = np.cos(pitch)
+    s = np.sin(pitch)
+
+    for x, y in resolvePairs(torques):
+        X = np.asarray(df[x])
+        Y = np.asarray(df[y])
+
+        #Resolve Fx = Fx*cos(pitch)+Fy*sin(pitch)
+        df['Res_'+x] = X*c + Y*s
+        #Resolve Fy = -Fx*sin(pitch)+Fy*cos(pitch)
+        #(was -Fx*sin(pitch)-Fy*cos(pitch))
+        df['Res_'+y] = -(X*s) + Y*c
+
+        if computed is not None:
+            computed['Res_'+x] = ('resolve',)
+            computed['Res_'+y] = ('resolve',)
+
+    return df
+
+
+def resolvePairs(torques=0):
+    """
+    The (x, y) channel pairs to resolve: forces, and with torques = 1,
+    torques too.
+    """
+    if torques == 1:
+        return [('Fx', 'Fy'), ('Tx', 'Ty')]
+    return [('Fx', 'Fy')]
+
+
+@profiled('resolveTables')
+def resolveTables(tables, torques=0, computed=None):
+    """
+    Resolves forces (see resolveFrame) in many ChannelTables or
+    dataframes - e.g. every trial of a campaign - at once.
+
+    The channels of all the tables are stacked into padded 2-D arrays (one
+    row per table, zeros after the end of shorter tables), the cosine and
+    sine of pitch are found once for all of them, and the rotation
+
+    [Res_Fx]   [ cos(pitch)  sin(pitch)] [Fx]
+    [Res_Fy] = [-sin(pitch)  cos(pitch)] [Fy]
+
+    is applied to every pair of channels with one einsum.
+
+    Inputs:
+
+    -tables - list of ChannelTables (or dataframes) to resolve
+
+    -torques - default is 0.  Set to 1 to also resolve Tx and Ty.
+
+    -computed - list of dictionaries, one for each table, to note the new
+        columns in (see FlapperData.computed).  Default is None.
+    """
+    import numpy as np
+
+    if len(tables) == 0:
+        return tables
+
+    pairs = resolvePairs(torques)
+    lengths = [len(table) for table in tables]
+    n = max(lengths)
+
+    #stack pitch and the channel pairs: (tables, rows) and
+    #(pairs, 2, tables, rows)
+    pitch = np.zeros((len(tables), n))
+    values = np.zeros((len(pairs), 2, len(tables), n))
+    for t, table in enumerate(tables):
+        pitch[t, 0:lengths[t]] = table['pitch_pos']
+        for p, pair in enumerate(pairs):
+            for j, col in enumerate(pair):
+                values[p, j, t, 0:lengths[t]] = table[col]
+
+    #cosine and sine of pitch, once for every table
+    pitch = np.radians(pitch)
+    c = np.cos(pitch)
+    s = np.sin(pitch)
+
+    #rotate every pair at once
+    rotation = np.array([[c, s], [-s, c]])
+    resolved = np.einsum('ijtn,pjtn->pitn', rotation, values)
+
+    #put the results back into each table, in its own number type
+    for t, table in enumerate(tables):
+        for p, pair in enumerate(pairs):
+            for j, col in enumerate(pair):
+                dtype = np.result_type(np.asarray(table[col]).dtype, np.asarray(table['pitch_pos']).dtype)
+                table['Res_'+col] = resolved[p, j, t, 0:lengths[t]].astype(dtype)
+                if computed is not None:
+                    computed[t]['Res_'+col] = ('resolve',)
+
+    return tables
+
+
+def resolveTrials(dataSets, rod=0, torques=0):
+    """
+    Resolves forces (see FlapperData.resolveForces) for many FlapperData
+    objects at once, with resolveTables.
+
+    Inputs:
+
+    -dataSets - list of FlapperData objects
+
+    -rod - default is 0.  Set to 1 to resolve their rod data too (except
+        rod data shared between trials, which is left alone).
+
+    -torques - default is 0.  Set to 1 to also resolve Tx and Ty.
+    """
+    tables = []
+    computed = []
+    for dataSet in dataSets:
+        tables.append(dataSet.foilData)
+        computed.append(dataSet.computed['foil'])
+        if rod == 1 and not dataSet.rodShared:
+            tables.append(dataSet.rodData)
+            computed.append(dataSet.computed['rod'])
+
+    resolveTables(tables, torques=torques, computed=computed)
+
+
+#Filter designs already made by filterDesign, by (order, cutoff, fs)
+_filterDesigns = {}
+
+
+def filterDesign(order, cutoff, fs):
+    """
+    Makes a low-pass Butterworth filter, as second-order sections, for the
+    given order, cutoff frequency (Hz) and sampling frequency (Hz).  Each
+    design is only made once and then re-used.
+    """
+    from scipy.signal import butter
+    
+    key = (order, float(cutoff), float(fs))
+    
+    if key not in _filterDesigns:
+        #fs/2 is the Nyquist frequency, or half of the sampling frequency
+        _filterDesigns[key] = butter(order, cutoff/(fs/2.), btype = 'low', output = 'sos')
+    
+    return _filterDesigns[key]
+
+
+@profiled('filterFrame')
+def filterFrame(df, cutoffFreq, resolved, channels=None, fs=1000., computed=None):
+    """
+    Applies a Butterworth filter to a ChannelTable of Flapper data (see
+    FlapperData.filterData) & inserts results into new channels, named
+    with '_filt' added to the channel names.
+    
+    Applies the Butterworth filter in 2 pass - at a fraction of the 
+    cut-off frequency each time - to eliminate phase-shifts from the 
+    outcome.
+    
+    All channels are filtered together in one pass over a channels x
+    samples array, along each channel's contiguous row.  The
+    filter is used as second-order sections, which is more numerically
+    stable than the transfer function (b, a) form.
+    
+    Inputs:
+    
+    -df - the ChannelTable to filter
+    
+    -cutoffFreq - cutoff frequency, in Hz
+    
+    -resolved - set to 1 to filter Res_Fx and Res_Fy instead of Fx and Fy
+        (when channels is None)
+    
+    -channels - list of columns to filter.  Default is None (Fx, Fy, and
+        Tz, or Res_Fx, Res_Fy, and Tz if resolved == 1).
+    
+    -fs - sampling frequency, in Hz.  Default is 1000.
+
+    -computed - a dictionary to note the new columns in (see
+        FlapperData.computed).  Default is None.
+    """
+    #Load filtering functions
+    from scipy.signal import sosfiltfilt
+    
+    #C is a proprotionality factor by which the desired cutoff 
+    #frequency will be adjusted to account for multiple passes.
+    #C = 0.802 for n=2 passes, calculated by:
+    # C = (2^(1/n)-1)^(1/4)
+    
+    C = 0.802
+    
+    #Create filter operation
+    sos = filterDesign(2, cutoffFreq/C, fs)
+    
+    #Choose the channels to filter
+    if channels is None:
+        if resolved == 0:
+            channels = ['Fx', 'Fy', 'Tz']
+        
+        #Apply the filter instead to the resolved forces, if available.
+        else:
+            channels = ['Res_Fx', 'Res_Fy', 'Tz']
+    
+    #Apply the filter to all channels at once
+    filtered = sosfiltfilt(sos, df.take(channels), axis=1)
+
+    for k, col in enumerate(channels):
+        df[col+'_filt'] = filtered[k]
+
+    #Note the cutoff and what was filtered
+    if computed is not None:
+        made = [('filter', float(cutoffFreq), float(fs), computed.get(col, 'raw')) for col in channels]
+        for col, record in zip(channels, made):
+            computed[col+'_filt'] = record
+
+    return df
+
+
+#Force and torque channels, the ones spectra are found for by default
+forceChannels = ['Fx', 'Fy', 'Fz', 'Tx', 'Ty', 'Tz']
+
+
+def segmentLength(n, freq, fs=1000., cycles=4):
+    """
+    Finds the number of rows in each Welch segment: cycles whole motion
+    cycles (so the harmonics of freq fall on frequency bins when fs/freq
+    is a whole number), or cycles seconds in the static case, but no more
+    than the n rows of data.
+    """
+    if freq > 0:
+        rows = int(round(cycles*fs/freq))
+    else:
+        rows = int(round(cycles*fs))
+    
+    return max(2, min(n, rows))
+
+
+def welchSpectra(values, fs=1000., nperseg=256):
+    """
+    Finds Welch power spectral densities of every row of a 2-D array
+    (channels x samples) in one pass: Hann-windowed segments of nperseg
+    rows, overlapping by half, with each segment's mean removed.
+    
+    Returns the frequencies (Hz) and a (channels, frequencies) array of
+    PSDs (units^2/Hz).
+    """
+    from scipy.signal import welch
+    
+    return welch(values, fs=fs, window='hann', nperseg=nperseg, detrend='constant', axis=-1)
+
+
+def harmonicAmplitudes(f, psd, freq, nHarmonics=10):
+    """
+    Finds the amplitudes of the sinusoids at 1, 2, ... nHarmonics times
+    freq from Welch PSDs (channels, frequencies at f).  Each harmonic's
+    power is the PSD summed over the 5 bins around it (the width of a Hann
+    window's peak) times the bin width, and its amplitude is
+    sqrt(2*power).
+    
+    Returns a (channels, nHarmonics) array, with NaN for harmonics above
+    the Nyquist frequency.
+    """
+    import numpy as np
+    
+    psd = np.atleast_2d(psd)
+    df = f[1] - f[0]
+    
+    #bins of each harmonic and its neighbors: (harmonics, 5)
+    bins = np.round(np.arange(1, nHarmonics+1)*freq/df).astype(int)
+    around = bins.reshape(-1, 1) + np.arange(-2, 3)
+    inside = (around >= 0) & (around < f.shape[0])
+    
+    power = (psd[:, np.clip(around, 0, f.shape[0]-1)]*inside).sum(axis=2)*df
+    amplitudes = np.sqrt(2.*power)
+    amplitudes[:, bins >= f.shape[0]] = np.nan
+    
+    return amplitudes
+
+
+def suggestCutoff(f, psd, freq, nHarmonics=10, snr=10., fs=1000.):
+    """
+    Suggests a low-pass cutoff frequency from Welch PSDs (channels,
+    frequencies at f) of force and torque channels.
+    
+    With a flapping frequency (freq > 0), the harmonics of the motion are
+    the signal.  A harmonic counts if its PSD peak is more than snr times
+    the noise floor (the median PSD up to nHarmonics+1 times freq) in any
+    channel, and the cutoff is halfway between the highest harmonic that
+    counts and the next - at least 1.5*freq.  Vibration or rod resonance
+    between the harmonics is left out.
+    
+    In the static case (freq = 0), there are no harmonics to tell signal
+    from vibration, so the cutoff is just above the highest frequency at
+    which any channel's PSD is more than snr times its noise floor (its
+    median PSD).
+    
+    The cutoff is kept below 0.35*fs, so filterFrame's adjusted cutoff
+    stays under the Nyquist frequency.
+    """
+    import numpy as np
+    
+    psd = np.atleast_2d(psd)
+    df = f[1] - f[0]
+    
+    if freq > 0:
+        #peak PSD at each harmonic below the Nyquist frequency
+        k = np.arange(1, nHarmonics+1)
+        bins = np.round(k*freq/df).astype(int)
+        k = k[bins < f.shape[0]-1]
+        bins = bins[bins < f.shape[0]-1]
+        peaks = np.maximum(np.maximum(psd[:, np.maximum(bins-1, 0)], psd[:, bins]), psd[:, bins+1])
+        
+        #the noise floor, over the band the harmonics are in
+        band = (f > 0) & (f <= (nHarmonics+1)*freq)
+        floor = np.median(psd[:, band], axis=1).reshape(-1, 1)
+        
+        counts = (peaks > snr*floor).any(axis=0)
+        if counts.any():
+            cutoff = (k[counts].max() + 0.5)*freq
+        else:
+            cutoff = 1.5*freq
+    
+    else:
+        #the highest frequency standing out from the noise
+        floor = np.median(psd[:, 1:], axis=1).reshape(-1, 1)
+        above = np.flatnonzero((psd[:, 1:] > snr*floor).any(axis=0))
+        if above.shape[0] > 0:
+            cutoff = f[1:][above.max()] + df
+        else:
+            cutoff = f[1]
+    
+    return float(min(cutoff, 0.35*fs))
+
+
+@profiled('trialSpectra')
+def trialSpectra(dataSets, freq, columns=None, rod=0, nperseg='auto'):
+    """
+    Finds spectra (see FlapperData.spectrum) for many FlapperData objects.
+    The trials with the same number of rows, segment length and channels
+    are stacked and go through one Welch pass together.  The spectra are
+    kept in each object's self.spectra, under the columns' records in
+    self.computed, so they're re-used until those columns are made again.
+    
+    Inputs:
+    
+    -dataSets - list of FlapperData objects
+    
+    -freq - flapping frequency, or a list with one for each object
+    
+    -columns, rod, nperseg - see FlapperData.spectrum
+    
+    Returns a list of dataframes, one for each object.
+    """
+    import numpy as np
+    import pandas as pd
+    
+    if not isinstance(freq, (list, tuple, np.ndarray)):
+        freq = [freq]*len(dataSets)
+    
+    if rod == 1:
+        frame = 'rod'
+    else:
+        frame = 'foil'
+    
+    results = [None]*len(dataSets)
+    groups = {}
+    for i, dataSet in enumerate(dataSets):
+        if rod == 1:
+            df = dataSet.rodData
+        else:
+            df = dataSet.foilData
+        
+        names = columns
+        if names is None:
+            names = [col for col in forceChannels if col in df]
+        
+        if nperseg == 'auto':
+            rows = segmentLength(df.shape[0], freq[i], dataSet.schema.fs)
+        else:
+            rows = int(nperseg)
+        
+        #spectra found before
+        key = (frame, tuple(names), rows, repr([dataSet.computed[frame].get(col) for col in names]))
+        if key in dataSet.spectra:
+            results[i] = dataSet.spectra[key]
+        else:
+            groups.setdefault((df.shape[0], rows, dataSet.schema.fs, tuple(names)), []).append((i, df, key))
+    
+    #one Welch pass for each group
+    for (n, rows, fs, names), members in groups.items():
+        stacked = np.concatenate([df.take(list(names)) for (i, df, key) in members])
+        f, psd = welchSpectra(stacked, fs, rows)
+        
+        for j, (i, df, key) in enumerate(members):
+            spectrum = pd.DataFrame(psd[j*len(names):(j+1)*len(names)].T, columns=list(names))
+            spectrum.insert(0, 'freq', f)
+            dataSets[i].spectra[key] = spectrum
+            results[i] = spectrum
+    
+    return results
+
+
+
+class PhaseAccumulator(object):
+    """
+    Collects phase-averages and net values of data columns a piece at a
+    time - a cycle, a chunk of rows, or another accumulator - so long
+    records don't need to be held in memory all at once.
+    
+    Each row is added to one of nBins phase bins (its position within the
+    motion cycle) - the caller decides which, so the results are only as
+    much like FlapperData.phaseAvg as the binning is.  A running count,
+    mean and sum of squared differences from the mean (M2) are kept for
+    each bin, updated with Welford's method, which stays accurate over many
+    cycles.  Fed the same cycles phaseAvg stacks (one row per bin per
+    cycle, e.g. with addCycle), it gives the same phase-averages and
+    standard deviations across cycles, to rounding.  The net value is the
+    mean of every row added, which is netValue's only when the same rows
+    are added (netValue with phase = 'rows' averages round(nCycles*fs/freq)
+    rows, not nCycles whole cycles of round(fs/freq) rows).  See
+    streamFlapperData for binning that matches.
+    
+    Accumulators filled separately (e.g. from different chunks of a record,
+    or in different processes) can be combined with merge.
+    
+    Inputs:
+        columns - list of names of the columns being averaged
+        
+        nBins - number of phase bins per cycle
+    """
+    
+    def __init__(self, columns, nBins):
+        import numpy as np
+        
+        self.columns = list(columns)
+        self.nBins = int(nBins)
+        
+        #number of rows, mean, and sum of squared differences from the mean
+        #in each bin
+        self.count = np.zeros(self.nBins)
+        self.mean = np.zeros((self.nBins, len(self.columns)))
+        self.M2 = np.zeros((self.nBins, len(self.columns)))
+    
+    
+    def addCycle(self, values):
+        """
+        Adds one whole cycle of data: an array with one row per phase bin
+        (nBins rows) and one column per column.
+        """
+        import numpy as np
+        
+        values = np.asarray(values, dtype=float)
+        
+        #Welford's update
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta/self.count.reshape(-1,1)
+        self.M2 += delta*(values - self.mean)
+    
+    
+    def add(self, bins, values):
+        """
+        Adds rows of data, any number of rows per bin.
+        
+        Inputs:
+        -bins - array of the phase bin (0 to nBins-1) of each row
+        
+        -values - array of data, one row per bin and one column per column
+        """
+        import numpy as np
+        
+        values = np.asarray(values, dtype=float)
+        
+        #find the count, mean and M2 of the new rows in each bin...
+        count = np.bincount(bins, minlength=self.nBins).astype(float)
+        mean = np.zeros_like(self.mean)
+        M2 = np.zeros_like(self.M2)
+        filled = count > 0
+        for k in range(0, len(self.columns)):
+            mean[filled,k] = np.bincount(bins, weights=values[:,k], minlength=self.nBins)[filled]/count[filled]
+            M2[:,k] = np.bincount(bins, weights=(values[:,k] - mean[bins,k])**2, minlength=self.nBins)
+        
+        #...and combine them with the running values
+        self._combine(count, mean, M2)
+    
+    
+    def merge(self, other):
+        """
+        Adds everything collected by another PhaseAccumulator with the same
+        columns and nBins.
+        """
+        if other.columns != self.columns or other.nBins != self.nBins:
+            raise ValueError('Can only merge PhaseAccumulators with the same columns and nBins.')
+        
+        self._combine(other.count, other.mean, other.M2)
+    
+    
+    def _combine(self, count, mean, M2):
+        """
+        Combines the running count, mean and M2 of each bin with those of
+        another set of rows (Chan et al.'s parallel form of Welford's
+        method).
+        """
+        import numpy as np
+        
+        total = self.count + count
+        
+        #weight of the other rows in each bin (0 where both are empty)
+        w = np.zeros_like(total)
+        filled = total > 0
+        w[filled] = count[filled]/total[filled]
+        w = w.reshape(-1,1)
+        
+        delta = mean - self.mean
+        self.M2 += M2 + delta**2*(self.count.reshape(-1,1)*w)
+        self.mean += delta*w
+        self.count = total
+    
+    
+    def phaseAvg(self, period=1.):
+        """
+        Returns a dataframe with the phase-average of each column, its
+        standard deviation (col_std) across cycles, and a time column, for
+        a cycle lasting period seconds.
+        """
+        import numpy as np
+        import pandas as pd
+        
+        #sample standard deviation - sum of square errors over count-1
+        stdev = np.sqrt(self.M2/(self.count.reshape(-1,1) - 1))
+        
+        avgs = pd.DataFrame(index=range(0,self.nBins))
+        for k, col in enumerate(self.columns):
+            avgs[col] = self.mean[:,k]
+            avgs[col+'_std'] = stdev[:,k]
+        avgs['time'] = np.arange(0,self.nBins)*period/self.nBins
+        
+        return avgs
+    
+    
+    def netValue(self):
+        """
+        Returns a dictionary with the net (time-averaged) value of each
+        column over all rows added, in the same form as
+        FlapperData.netValue.
+        """
+        import numpy as np
+        
+        net = np.dot(self.count, self.mean)/self.count.sum()
+        return dict((col, [net[k]]) for k, col in enumerate(self.columns))
+
+
+def streamFlapperData(foil, freq, columns=None, pitch=0, resolved=0, cutoffFreq=7,
+                      nCycles=None, phase='rows', nBins=1000, chunksize=100000,
+                      dtype='float64', engine='c', filepath='none', schema=None):
+    """
+    Processes a foil combo file in chunks, for records too long to load into
+    a FlapperData object.  Memory use depends on chunksize, not on the
+    length of the record (except with phase = 'heave', see below).
+    
+    Does the same steps as FlapperData: centers positions, optionally
+    resolves forces, applies the 2-pass low-pass Butterworth filter, and
+    finds net values and phase-averages.  The filter carries its state from
+    one chunk to the next, and the backward pass looks ahead
+    10*fs/cutoffFreq rows (fs is the sampling frequency) past the end of
+    each chunk, so filtered data match
+    filtering the whole record at once.  Rows are cut into cycles and
+    phases the same way netValue and phaseAvg do for the same phase
+    option, so the results match theirs (to rounding - the averages are
+    kept with a PhaseAccumulator).  Rod subtraction isn't done.
+    
+    Inputs:
+    
+    -foil - filepath and name of the foil combo file
+    
+    -freq - flapping frequency used (0 for static)
+    
+    -columns - columns to find net values and phase-averages of.  Default is
+        None (the filtered Fx, Fy, and Tz, or Res_Fx, Res_Fy, and Tz).
+    
+    -pitch, resolved, cutoffFreq - as for FlapperData, resolveForces and
+        filterData.  resolved = 1 resolves the forces too.
+    
+    -nCycles - number of cycles to average over.  Default is None (every
+        whole cycle in the record, as nCycles = 'auto' does).
+    
+    -phase - default is 'rows'.  See phaseAvg.  With 'heave', the centered
+        heave_pos of the whole record is kept in memory to find the cycle
+        starts (one column, not the whole record).
+    
+    -nBins - number of phases per cycle when phase is 'freq' or 'heave'.
+        Default is 1000.
+    
+    -chunksize - number of rows to read at a time.  Default is 100000.
+    
+    -dtype, engine - as for loadCombo
+    
+    -filepath - optionally, a .csv file to write the processed data to, a
+        chunk at a time.  Default is 'none'.
+    
+    -schema - an AcquisitionSchema.  Default is None (defaultSchema).
+    
+    Returns the net values (a dictionary, as netValue) and the
+    phase-averages (a dataframe, as phaseAvg).
+    """
+    import numpy as np
+    import pandas as pd
+    from scipy.signal import sosfilt, sosfilt_zi
+    
+    if phase not in ('rows', 'freq', 'heave'):
+        raise ValueError("phase must be 'rows', 'freq' or 'heave', not " + repr(phase))
+    
+    #sampling frequency
+    if schema is None:
+        schema = defaultSchema
+    fs = schema.fs
+    
+    #Find the channels to filter and the columns to average
+    if resolved == 0:
+        channels = ['Fx', 'Fy', 'Tz']
+    else:
+        channels = ['Res_Fx', 'Res_Fy', 'Tz']
+    if columns is None:
+        columns = [col+'_filt' for col in channels]
+    
+    #rows per cycle - in static case, treat each fs rows as a cycle
+    if freq == 0:
+        period = 1.
+    else:
+        period = 1./freq
+    rowsPerCycle = fs*period
+    
+    #First pass: read just the positions to count the rows and find the
+    #values to center them on.  Heave is centered on its mean over whole
+    #cycles, so keep a running total plus the last cycle's worth of rows.
+    n = 0
+    heaveTotal = 0.
+    pitchTotal = 0.
+    tail = np.zeros(0)
+    heave = []
+    for chunk in loadCombo(foil, dtype=dtype, engine=engine, names=['pitch_pos', 'heave_pos'], chunksize=chunksize, schema=schema):
+        n += chunk.shape[0]
+        heaveTotal += chunk.heave_pos.sum()
+        pitchTotal += chunk.pitch_pos.sum()
+        tail = np.concatenate([tail, chunk.heave_pos.values])[-(int(np.ceil(rowsPerCycle))+1):]
+        if phase == 'heave':
+            heave.append(chunk.heave_pos.values)
+    
+    #center positions, as centerPositions does
+    last = wholeCycleRows(n, freq, fs)
+    if freq == 0:
+        heaveMean = 0.
+    else:
+        heaveMean = (heaveTotal - tail[tail.shape[0]-(n-last):].sum())/last
+    pitchMean = pitchTotal/n
+    
+    #How many cycles have passed at each row (as findPhase)
+    if phase == 'heave' and freq != 0:
+        allCycles = heaveCycles(np.concatenate(heave) - heaveMean, fs, freq)
+        
+        def cyclesAt(index):
+            return allCycles[index]
+    
+    elif freq == 0:
+        def cyclesAt(index):
+            return index/float(fs)
+    
+    else:
+        def cyclesAt(index):
+            return index*freq/float(fs)
+    
+    #Choose the cycles to average over and check there are enough (as
+    #countCycles, phaseAvg and netValue)
+    if phase == 'rows':
+        #p is the number of rows in 1 motion cycle, rounded
+        p = int(round(rowsPerCycle))
+        available = n // p
+    else:
+        p = int(nBins)
+        available = max(0, int(np.floor(cyclesAt(n-1) + 1e-9)))
+    if nCycles is None:
+        nCycles = available
+    nCycles = int(nCycles)
+    if nCycles < 1 or nCycles > available:
+        raise ValueError(str(nCycles) + ' cycles were asked for, but there are ' + str(available) + ' whole cycles in the data.')
+    
+    #rows averaged for the net values with phase = 'rows' (netValue)
+    if freq == 0:
+        netRows = int(round(1./nCycles*fs*nCycles))
+    else:
+        netRows = int(round(period*fs*nCycles))
+    if phase == 'rows' and netRows > n:
+        raise ValueError(str(nCycles) + ' cycles need ' + str(netRows) + ' rows, but there are only ' + str(n) + '.')
+    
+    accumulator = PhaseAccumulator(columns, p)
+    netTotal = np.zeros(len(columns))
+    netCount = [0]
+    
+    #Set up the filter, as in filterFrame
+    C = 0.802
+    sos = filterDesign(2, cutoffFreq/C, fs)
+    ziSteady = sosfilt_zi(sos)[:,:,np.newaxis]
+    
+    #Pad the ends with an odd extension, like filtfilt
+    ntaps = 2*sos.shape[0] + 1 - min((sos[:,2] == 0).sum(), (sos[:,5] == 0).sum())
+    padlen = 3*ntaps
+    
+    #rows of look-ahead for the backward pass
+    ahead = int(10*fs/cutoffFreq)
+    
+    #rows waiting for the backward pass - their data, and the output of the
+    #forward pass
+    pending = None
+    pendingF = None
+    zi = None
+    
+    #row number of the first pending row
+    start = [0]
+    
+    #the cycles and values of the last row added, and the next phase to
+    #interpolate to (phase = 'freq' or 'heave')
+    previous = [None, None]
+    nextTarget = [0]
+    
+    def emit(rows, filtered):
+        """
+        A helper-code that takes rows which are done being filtered, adds
+        them to the averages, and optionally writes them out.
+        """
+        for k, col in enumerate(channels):
+            rows[col+'_filt'] = filtered[:,k]
+        
+        index = start[0] + np.arange(rows.shape[0])
+        values = rows[columns].values
+        
+        if phase == 'rows':
+            #cut into cycles of p rows, as phaseAvg
+            keep = index < nCycles*p
+            accumulator.add(index[keep] % p, values[keep])
+            
+            #and the first netRows rows, as netValue
+            net = index < netRows
+        
+        else:
+            #interpolate onto the phases k + j/p, as phaseAvg, carrying
+            #the last row over from the chunk before
+            cycles = cyclesAt(index)
+            if previous[0] is not None:
+                cycles = np.concatenate([previous[0], cycles])
+                values = np.concatenate([previous[1], values])
+            
+            stop = min(nCycles*p, (int(np.floor(cycles[-1])) + 1)*p)
+            targets = np.arange(nextTarget[0], max(stop, nextTarget[0]))
+            phases = targets//p + (targets % p)/float(p)
+            targets = targets[phases <= cycles[-1]]
+            phases = phases[phases <= cycles[-1]]
+            
+            if targets.shape[0] > 0:
+                stacked = np.empty((targets.shape[0], len(columns)))
+                for k in range(0, len(columns)):
+                    stacked[:,k] = np.interp(phases, cycles, values[:,k])
+                accumulator.add(targets % p, stacked)
+                nextTarget[0] = targets[-1] + 1
+            
+            previous[0] = cycles[-1:]
+            previous[1] = values[-1:]
+            
+            #and the rows within the first nCycles cycles, as netValue
+            cycles = cycles[cycles.shape[0] - index.shape[0]:]
+            values = values[values.shape[0] - index.shape[0]:]
+            net = (cycles >= 0) & (cycles < nCycles)
+        
+        netTotal[:] += values[net].sum(axis=0)
+        netCount[0] += int(net.sum())
+        
+        if filepath != 'none':
+            rows.index = index
+            rows.to_csv(filepath, mode='a', header=(start[0] == 0))
+        
+        start[0] += rows.shape[0]
+    
+    def backward(forward):
+        """
+        A helper-code that runs the backward pass of the filter.
+        """
+        out, z = sosfilt(sos, forward[::-1], axis=0, zi=ziSteady*forward[-1])
+        return out[::-1]
+    
+    #Second pass: process the data a chunk at a time
+    for chunk in loadCombo(foil, dtype=dtype, engine=engine, chunksize=chunksize, schema=schema):
+        
+        #Add a time column, from the row numbers and sampling frequency
+        rowStart = start[0] + (0 if pending is None else pending.shape[0])
+        chunk.index = np.arange(rowStart, rowStart + chunk.shape[0])
+        chunk['time'] = chunk.index/float(fs)
+        
+        #Set pitch to 0 degrees in heave only datasets, and center positions
+        if pitch == 0:
+            chunk['pitch_pos'] = 0.
+        else:
+            chunk['pitch_pos'] = chunk['pitch_pos'] - pitchMean
+        if freq == 0:
+            chunk['heave_pos'] = 0.
+        else:
+            chunk['heave_pos'] = chunk['heave_pos'] - heaveMean
+        
+        #Resolve forces
+        if resolved == 1:
+            chunk = resolveFrame(chunk)
+        
+        x = chunk[channels].values
+        
+        #Forward pass, starting from the padded beginning of the record
+        if zi is None:
+            pad = 2*x[0] - x[padlen:0:-1]
+            zi = ziSteady*pad[0]
+            skip, zi = sosfilt(sos, pad, axis=0, zi=zi)
+        forward, zi = sosfilt(sos, x, axis=0, zi=zi)
+        
+        #add to the rows waiting for the backward pass
+        if pending is None:
+            pending, pendingF, lastX = chunk, forward, x[-(padlen+1):]
+        else:
+            pending = pd.concat([pending, chunk])
+            pendingF = np.concatenate([pendingF, forward])
+            lastX = np.concatenate([lastX, x])[-(padlen+1):]
+        
+        #Rows more than 'ahead' rows from the end can be finished
+        done = pending.shape[0] - ahead
+        if done > 0:
+            emit(pending.iloc[0:done].copy(), backward(pendingF)[0:done])
+            pending = pending.iloc[done:]
+            pendingF = pendingF[done:]
+    
+    #Finish the last rows, with the padded end of the record
+    pad = 2*lastX[-1] - lastX[-2:-(padlen+2):-1]
+    padF, zi = sosfilt(sos, pad, axis=0, zi=zi)
+    filtered = backward(np.concatenate([pendingF, padF]))[0:pending.shape[0]]
+    emit(pending.copy(), filtered)
+    
+    #Report the results, in the same form as netValue and phaseAvg
+    net = netTotal/netCount[0]
+    avgs = accumulator.phaseAvg(period)
+    if phase == 'rows':
+        avgs['time'] = np.arange(0,p)/float(fs)
+    else:
+        avgs.insert(list(avgs.columns).index('time'), 'phase', np.arange(0,p)/float(p))
+    
+    return dict((col, [net[k]]) for k, col in enumerate(columns)), avgs
+
+
+
+def storePath(filepath, storeDir):
+    """
+    Gives the folder where storeCombo keeps the store for a combo file:
+    named for the file and a hash of its full path, so files with the same
+    name in different folders get different stores.
+    """
+    import os
+    import hashlib
+    
+    full = os.path.abspath(filepath)
+    tag = hashlib.sha1(full.encode('utf-8')).hexdigest()[0:12]
+    
+    return os.path.join(storeDir, os.path.basename(filepath) + '.' + tag + '.store')
+
+
+def storeInfo(filepath, dtype='float64', schema=None):
+    """
+    Describes what a store of a combo file is made from (see storeCombo):
+    the file's full path, size and modification time, the number type,
+    and the schema's sampling frequency, duration and columns.  A store is
+    only re-used when this matches.
+    """
+    import os
+    import numpy as np
+    
+    if schema is None:
+        schema = defaultSchema
+    
+    stat = os.stat(filepath)
+    
+    return {'source': os.path.abspath(filepath),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'dtype': np.dtype(dtype).str,
+            'fs': schema.fs,
+            'duration': schema.duration,
+            'channels': sorted(schema.channels.items()),
+            'dropped': sorted(schema.dropped)}
+
+
+def storeCombo(filepath, storeDir, dtype='float64', engine='c', schema=None):
+    """
+    Converts the force, torque, and position columns of a combo file to a
+    store that can be memory-mapped (see openStore), unless an up-to-date
+    store already exists.  Returns the store's folder.
+    
+    A store is a folder holding raw.npy - the data as one array, stored
+    column by column - columns.txt, the column names, and info.json, what
+    the store was made from (see storeInfo).  If the combo file or the
+    settings have changed since, the store is made again, and processed
+    columns added to it by storeDerived (in sub-folders) are deleted.
+    
+    Inputs:
+    
+    -filepath - filepath and name of the combo file
+    
+    -storeDir - folder to keep stores in
+    
+    -dtype, engine, schema - as for loadCombo
+    
+    """
+    import os
+    import json
+    import shutil
+    import numpy as np
+    
+    store = storePath(filepath, storeDir)
+    raw = os.path.join(store, 'raw.npy')
+    info = json.loads(json.dumps(storeInfo(filepath, dtype=dtype, schema=schema)))
+    
+    #Re-use the store if it was made from the same file, the same way
+    try:
+        with open(os.path.join(store, 'info.json')) as f:
+            if os.path.exists(raw) and json.load(f) == info:
+                return store
+    except (IOError, OSError, ValueError):
+        pass
+    
+    if not os.path.isdir(store):
+        os.makedirs(store)
+    
+    #processed columns of an old store are out of date
+    for name in os.listdir(store):
+        if os.path.isdir(os.path.join(store, name)):
+            shutil.rmtree(os.path.join(store, name), ignore_errors=True)
+    
+    df = loadCombo(filepath, dtype=dtype, engine=engine, schema=schema)
+    
+    #Write to temporary files first, so other processes never map a
+    #half-written store.  info.json goes last, so the store only counts as
+    #up to date once the rest is there.
+    temp = '.' + str(os.getpid()) + '.tmp'
+    with open(os.path.join(store, 'columns.txt' + temp), 'w') as f:
+        f.write('\n'.join(df.columns) + '\n')
+    with open(raw + temp, 'wb') as f:
+        np.save(f, np.asfortranarray(df.values))
+    with open(os.path.join(store, 'info.json' + temp), 'w') as f:
+        json.dump(info, f)
+    os.rename(os.path.join(store, 'columns.txt' + temp), os.path.join(store, 'columns.txt'))
+    os.rename(raw + temp, raw)
+    os.rename(os.path.join(store, 'info.json' + temp), os.path.join(store, 'info.json'))
+    
+    return store
+
+
+def openStore(store, tag='none'):
+    """
+    Opens a store made by storeCombo as a ChannelTable whose data stay on
+    disk and are read in as needed.  Every process that opens the same
+    store shares the same pages of memory.
+    
+    The data are mapped copy-on-write: changing them (e.g. centering
+    positions) only copies the changed pages into this process, and never
+    changes the store.
+    
+    Inputs:
+    
+    -store - the store's folder
+    
+    -tag - default is 'none'.  Set to the tag of processed columns written
+        by storeDerived to map them too.
+    
+    """
+    import os
+    import numpy as np
+
+    with open(os.path.join(store, 'columns.txt')) as f:
+        columns = f.read().split()
+
+    #raw.npy is stored one column after another, so its transpose is
+    #already channels x samples
+    raw = np.load(os.path.join(store, 'raw.npy'), mmap_mode='c')
+    df = ChannelTable(raw.T, columns)
+
+    #add processed columns, each mapped as a row of its own
+    if tag != 'none':
+        folder = os.path.join(store, tag)
+        with open(os.path.join(folder, 'columns.txt')) as f:
+            derived = f.read().split()
+        for col in derived:
+            df.addBlock(np.load(os.path.join(folder, col + '.npy'), mmap_mode='r').reshape(1, -1), [col])
+
+    return df
+
+
+def storeDerived(df, store, tag):
+    """
+    Writes the channels of df (a ChannelTable) that aren't raw data in the
+    store (see storeCombo) to memory-mappable files in the store's tag
+    sub-folder.
+    """
+    import os
+    import numpy as np
+    
+    with open(os.path.join(store, 'columns.txt')) as f:
+        columns = f.read().split()
+    
+    derived = [col for col in df.columns if col not in columns]
+    
+    folder = os.path.join(store, tag)
+    if not os.path.isdir(folder):
+        try:
+            os.makedirs(folder)
+        except OSError:
+            #another process made it first
+            if not os.path.isdir(folder):
+                raise
+    
+    #Write to temporary files first, so other processes never map a
+    #half-written column.  columns.txt goes last.
+    temp = '.' + str(os.getpid()) + '.tmp'
+    for col in derived:
+        filepath = os.path.join(folder, col + '.npy')
+        with open(filepath + temp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(df[col]))
+        os.rename(filepath + temp, filepath)
+    
+    filepath = os.path.join(folder, 'columns.txt')
+    with open(filepath + temp, 'w') as f:
+        f.write('\n'.join(derived) + '\n')
+    os.rename(filepath + temp, filepath)
+
+
+
+class FlapperPipeline(object):
+    """
+    Computes only the columns of a FlapperData object that are asked for,
+    and only once.  Say which outputs are wanted, e.g.
+
+        pipe = FlapperPipeline(dataSet, cutoffFreq=7, resolved=1)
+        pipe.phaseAvg(['Fx_noRod'], freq, nCycles)
+
+    and the pipeline works out the stages they need (Res_Fx and Res_Fy ->
+    Fx_filt, Res_Fx_filt, ... -> Fx_noRod, ...), runs just those, and
+    skips any column already made with the same settings (see
+    FlapperData.computed).  Changing a setting with set() only causes the
+    columns that depend on it to be made again: a new cutoffFreq re-filters
+    but doesn't resolve the forces again.
+
+    Inputs:
+        data - the FlapperData object to work on
+
+        cutoffFreq - cutoff frequency for _filt columns.  Default is 10 Hz.
+
+        resolved - default is 0 (subtract the rod from Fx_filt and
+            Fy_filt).  Set to 1 to use Res_Fx_filt and Res_Fy_filt for the
+            _noRod columns.
+
+        align - how to line up rod and foil data for the _noRod columns
+            (see FlapperData.combineWithRod).  Default is 'heave'.
+    """
+
+    def __init__(self, data, cutoffFreq=10, resolved=0, align='heave'):
+        self.data = data
+        self.params = {'cutoffFreq': cutoffFreq, 'resolved': resolved, 'align': align}
+
+
+    def set(self, **params):
+        """
+        Changes settings (cutoffFreq, resolved, align).  Nothing is
+        computed until a column is asked for.
+        """
+        for name in params:
+            if name not in self.params:
+                raise ValueError('Unknown pipeline setting ' + repr(name))
+        self.params.update(params)
+
+
+    def noRodInputs(self):
+        """
+        The filtered columns the _noRod columns are made from.
+        """
+        if self.params['resolved'] == 0:
+            return ['Fx_filt', 'Fy_filt', 'Tz_filt']
+        else:
+            return ['Res_Fx_filt', 'Res_Fy_filt', 'Tz_filt']
+
+
+    def record(self, col, frame='foil'):
+        """
+        How col would be made with the current settings, in the form noted
+        in FlapperData.computed.  'raw' for columns loaded from the file.
+        """
+        if col in ['Res_Fx', 'Res_Fy', 'Res_Tx', 'Res_Ty']:
+            return ('resolve',)
+
+        elif col.endswith('_filt'):
+            return ('filter', float(self.params['cutoffFreq']), float(self.data.schema.fs), self.record(col[:-5], frame))
+
+        elif col in ['Fx_noRod', 'Fy_noRod', 'Tz_noRod'] and frame == 'foil':
+            cols = self.noRodInputs()
+            return ('noRod', self.params['resolved'], self.params['align'],
+                    tuple([self.record(c, 'foil') for c in cols]),
+                    tuple([self.record(c, 'rod') for c in cols]))
+
+        return 'raw'
+
+
+    def current(self, col, frame='foil'):
+        """
+        True if col is already in the data and was made with the current
+        settings.
+        """
+        if frame == 'foil':
+            df = self.data.foilData
+        else:
+            df = self.data.rodData
+
+        wanted = self.record(col, frame)
+        if wanted == 'raw':
+            if col not in df.columns:
+                raise KeyError('No column ' + repr(col) + ' in the ' + frame + ' data')
+            return True
+
+        return col in df.columns and self.data.computed[frame].get(col) == wanted
+
+
+    def require(self, columns, frame='foil'):
+        """
+        Makes sure each of columns (a list) is in the foil (frame='foil') or
+        rod (frame='rod') data and up to date, computing it and the columns
+        it depends on if not.
+        """
+        stale = [col for col in columns if not self.current(col, frame)]
+        if len(stale) == 0:
+            return
+
+        #rod data shared with other trials can't be changed from here
+        if frame == 'rod' and self.data.rodShared:
+            raise ValueError('The shared rod data does not have ' + ', '.join(stale) + ' made with these settings.')
+
+        resolve = [col for col in stale if col in ['Res_Fx', 'Res_Fy', 'Res_Tx', 'Res_Ty']]
+        filt = [col[:-5] for col in stale if col.endswith('_filt')]
+        noRod = [col for col in stale if col.endswith('_noRod')]
+
+        #Resolve forces, and torques if they're needed
+        if len(resolve) > 0:
+            torques = int('Res_Tx' in resolve or 'Res_Ty' in resolve)
+            if frame == 'foil':
+                self.data.foilData = resolveFrame(self.data.foilData, computed=self.data.computed['foil'], torques=torques)
+            else:
+                self.data.rodData = resolveFrame(self.data.rodData, computed=self.data.computed['rod'], torques=torques)
+
+        #Filter just the stale channels, all at once
+        if len(filt) > 0:
+            self.require(filt, frame)
+            if frame == 'foil':
+                self.data.filterData(self.params['cutoffFreq'], self.params['resolved'], channels=filt)
+            else:
+                self.data.rodData = filterFrame(self.data.rodData, self.params['cutoffFreq'], self.params['resolved'],
+                                                channels=filt, fs=self.data.schema.fs, computed=self.data.computed['rod'])
+
+        #Subtract the rod
+        if len(noRod) > 0:
+            self.require(self.noRodInputs(), 'foil')
+            self.require(self.noRodInputs(), 'rod')
+            self.data.combineWithRod(resolved=self.params['resolved'], align=self.params['align'])
+
+
+    def columns(self, columns, rod=0):
+        """
+        Returns a dataframe of the given columns, computing them if needed.
+        With rod = 1, the rod data's columns are returned as well, with
+        '_rod' added to their names.
+        """
+        self.require(columns)
+        df = self.data.foilData.frame(columns)
+
+        if rod == 1:
+            self.require(columns, 'rod')
+            df = df.join(self.data.rodData.frame(columns).add_suffix('_rod'))
+
+        return df
+
+
+    def netValue(self, columns, freq, nCycles, rod=0, save=0, filepath='none', phase='rows', ci=0, nBoot=2000, seed=0, workers=1):
+        """
+        Computes columns if needed, then finds their net values (see
+        FlapperData.netValue).
+        """
+        self.require(columns)
+        if rod == 1:
+            self.require(columns, 'rod')
+
+        return self.data.netValue(columns, freq, nCycles, rod=rod, save=save, filepath=filepath, phase=phase,
+                                  ci=ci, nBoot=nBoot, seed=seed, workers=workers)
+
+
+    def phaseAvg(self, columns, freq, nCycles, filepath='none', rod=0, phase='rows', nBins=1000, ci=0, nBoot=2000, seed=0, workers=1):
+        """
+        Computes columns if needed, then phase averages them (see
+        FlapperData.phaseAvg).
+        """
+        self.require(columns)
+        if rod == 1:
+            self.require(columns, 'rod')
+
+        return self.data.phaseAvg(columns, freq, nCycles, filepath=filepath, rod=rod, phase=phase, nBins=nBins,
+                                  ci=ci, nBoot=nBoot, seed=seed, workers=workers)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic combo files for the tests.
+"""
+
+#Columns of a combo file, in the order the acquisition software writes them
+comboHeaders = ['Fx (N)',
+                'Fy (N)',
+                'Fz (N)',
+                'Tx (N-mm)',
+                'Ty (N-mm)',
+                'Tz (N-mm)',
+                'Pressure 1 Ai2',
+                'Pressure 2 Ai3',
+                'Pressure 3 Ai4',
+                'Pressure 4 Ai5',
+                'X axis encoder 6602 degrees',
+                'Y axis encoder 6602 meters',
+                'digital in loop start 6221',
+                'camera trigger echo 6221',
+                'Loop Pulse']
+
+
+def writeCombo(filepath, freq=1.0, n=10000, fs=1000., phase=0., heaveAmp=0.05, pitchAmp=20., noise=1., seed=0):
+    """
+    Writes a tab-delimited combo file of n rows: sinusoidal heave (m) and
+    pitch (degrees) encoder traces starting at the given phase (radians),
+    and forces and torques at twice the flapping frequency plus random
+    noise.  Returns the filepath.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.RandomState(seed)
+
+    #phase of the motion at each row
+    w = 2*np.pi*freq*np.arange(n)/float(fs) + phase
+
+    data = {}
+    data['X axis encoder 6602 degrees'] = pitchAmp*np.cos(w)
+    data['Y axis encoder 6602 meters'] = heaveAmp*np.sin(w)
+    for k, col in enumerate(['Fx (N)', 'Fy (N)', 'Fz (N)', 'Tx (N-mm)', 'Ty (N-mm)', 'Tz (N-mm)']):
+        data[col] = (k+1)*np.sin(2*w + k) + noise*rng.randn(n)
+
+    #everything else is just noise
+    for col in comboHeaders:
+        if col not in data:
+            data[col] = rng.randn(n)
+
+    pd.DataFrame(data, columns=comboHeaders).to_csv(filepath, sep='\t', index=False)
+
+    return filepath
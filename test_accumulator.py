@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Checks PhaseAccumulator against two-pass averages and standard deviations
+of the same cycles, including accumulators filled separately and merged.
+
+Run with:  python -m unittest test_accumulator
+"""
+
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import PhaseAccumulator
+
+
+class PhaseAccumulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        #20 noisy cycles of 50 bins and 2 columns, with a large offset so a
+        #naive sum of squares would lose precision
+        rng = np.random.RandomState(0)
+        bins = np.arange(50)/50.
+        self.cycles = np.empty((20, 50, 2))
+        for k in range(0, 20):
+            self.cycles[k,:,0] = 1e6 + np.sin(2*np.pi*bins) + rng.randn(50)
+            self.cycles[k,:,1] = np.cos(4*np.pi*bins) + 0.1*rng.randn(50)
+
+    def check(self, accumulator, cycles):
+        """
+        Checks the accumulator's phase-averages and net values against the
+        two-pass results for the cycles.
+        """
+        avgs = accumulator.phaseAvg(period=2.)
+        self.assertTrue(np.allclose(avgs['a'], cycles[:,:,0].mean(axis=0), rtol=0, atol=1e-8))
+        self.assertTrue(np.allclose(avgs['b'], cycles[:,:,1].mean(axis=0), rtol=0, atol=1e-12))
+        self.assertTrue(np.allclose(avgs['a_std'], cycles[:,:,0].std(axis=0, ddof=1), rtol=1e-8))
+        self.assertTrue(np.allclose(avgs['b_std'], cycles[:,:,1].std(axis=0, ddof=1), rtol=1e-8))
+        self.assertTrue(np.allclose(avgs['time'], np.arange(50)*2./50))
+
+        net = accumulator.netValue()
+        self.assertTrue(np.allclose(net['a'], cycles[:,:,0].mean(), rtol=0, atol=1e-8))
+        self.assertTrue(np.allclose(net['b'], cycles[:,:,1].mean(), rtol=0, atol=1e-12))
+
+    def test_addCycle(self):
+        accumulator = PhaseAccumulator(['a', 'b'], 50)
+        for cycle in self.cycles:
+            accumulator.addCycle(cycle)
+        self.check(accumulator, self.cycles)
+
+    def test_add_rows(self):
+        #the rows of all the cycles at once, in row order
+        accumulator = PhaseAccumulator(['a', 'b'], 50)
+        accumulator.add(np.tile(np.arange(50), 20), self.cycles.reshape(-1, 2))
+        self.check(accumulator, self.cycles)
+
+    def test_merge(self):
+        #cycles split between accumulators filled different ways, as by
+        #different chunks or workers
+        first = PhaseAccumulator(['a', 'b'], 50)
+        for cycle in self.cycles[0:7]:
+            first.addCycle(cycle)
+        second = PhaseAccumulator(['a', 'b'], 50)
+        second.add(np.tile(np.arange(50), 13), self.cycles[7:].reshape(-1, 2))
+
+        first.merge(second)
+        self.check(first, self.cycles)
+
+        #merging into an empty accumulator copies the other
+        empty = PhaseAccumulator(['a', 'b'], 50)
+        empty.merge(first)
+        self.check(empty, self.cycles)
+
+    def test_merge_mismatch(self):
+        self.assertRaises(ValueError, PhaseAccumulator(['a', 'b'], 50).merge, PhaseAccumulator(['a'], 50))
+        self.assertRaises(ValueError, PhaseAccumulator(['a', 'b'], 50).merge, PhaseAccumulator(['a', 'b'], 40))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the benchmark helpers in Flapper_benchmark.py: synthetic combo
+files load like real ones, a synthetic batch runs, and compareBenchmarks
+reports slowdowns.
+
+Run with:  python -m unittest test_benchmark
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_benchmark import makeCombo, makeTrials, compareBenchmarks
+from Flapper_data_analysis import loadCombo, comboColumns
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def test_makeCombo_loads(self):
+        filepath = os.path.join(self.folder, 'combo.xls')
+        makeCombo(filepath, freq=2.0, duration=3., fs=1000., pitchAmp=15., heaveAmp=0.03)
+
+        df = loadCombo(filepath)
+        w = 2*np.pi*2.0*np.arange(3000)/1000.
+
+        self.assertEqual(df.shape[0], 3000)
+        self.assertEqual(sorted(df.columns), sorted(comboColumns.values()))
+        self.assertTrue(np.allclose(df['pitch_pos'], 15.*np.cos(w)))
+        self.assertTrue(np.allclose(df['heave_pos'], 0.03*np.sin(w) + 0.001))
+
+    def test_makeTrials_batch(self):
+        from Flapper_analysis_wrapper import analyzeFlapperData
+
+        files = makeTrials(self.folder, 2, freq=1.0, duration=10.)
+        results = analyzeFlapperData(files, fmt='npz')
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual([outcome['status'] for outcome in results], ['ok', 'ok'])
+        self.assertTrue(os.path.exists(os.path.join(self.folder, 'out', 'trial0_resfix.npz')))
+
+    def test_compareBenchmarks(self):
+        baseline = {'methods': {'10': {'filterData': {'wall': 1.0, 'peakRSS': 100.},
+                                       'netValue': {'wall': 0.001, 'peakRSS': 100.}}},
+                    'batch': {'1': {'wall': 2.0, 'peakRSS': 200., 'failed': 0}}}
+        current = {'methods': {'10': {'filterData': {'wall': 1.5, 'peakRSS': 101.},
+                                      'netValue': {'wall': 0.005, 'peakRSS': 100.}}},
+                   'batch': {'1': {'wall': 2.1, 'peakRSS': 300., 'failed': 0}}}
+
+        regressions = compareBenchmarks(baseline, current)
+
+        #filterData 50% slower, and the batch 50% bigger; netValue is
+        #slower too, but by less than minChange
+        self.assertEqual(sorted([(r[0], r[2], r[3]) for r in regressions]),
+                         [('batch', 'analyzeFlapperData', 'peakRSS'), ('methods', 'filterData', 'wall')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the cycle bootstrap confidence intervals of netValue and phaseAvg
+against a plain loop over replicates, on synthetic combo files.
+
+Run with:  python -m unittest test_bootstrap
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import FlapperData, bootstrapCycles
+from Flapper_test_data import writeCombo
+
+
+def loopBootstrap(cycles, nBoot, ci, seed):
+    """
+    Bootstrap intervals the slow way: for each replicate, draw whole
+    cycles (a list of arrays, one per cycle, rows first) with replacement,
+    average all their rows together, and take percentiles of the
+    replicate averages.  Draws the same cycles as bootstrapCycles for the
+    same seed.
+    """
+    n = len(cycles)
+    draws = np.random.RandomState(seed).multinomial(n, np.ones(n)/n, size=nBoot)
+
+    replicates = []
+    for counts in draws:
+        drawn = []
+        for k in range(0, n):
+            drawn += [cycles[k]]*counts[k]
+        replicates.append(np.concatenate(drawn, axis=0).mean(axis=0))
+
+    return np.percentile(np.array(replicates), [50.*(1 - ci), 50.*(1 + ci)], axis=0)
+
+
+class BootstrapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        foil = writeCombo(os.path.join(self.folder, 'foil.xls'), freq=1.0, seed=0)
+        self.dataSet = FlapperData(foil, 1.0, pitch=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def test_netValue(self):
+        net = self.dataSet.netValue(['Fx', 'Fy'], 1.0, 5, ci=0.9, nBoot=300, seed=3)
+
+        #cycles of 1000 rows
+        values = np.array([np.asarray(self.dataSet.foilData[col])[0:5000] for col in ['Fx', 'Fy']]).T
+        low, high = loopBootstrap([values[k*1000:(k+1)*1000] for k in range(0, 5)], 300, 0.9, 3)
+
+        for k, col in enumerate(['Fx', 'Fy']):
+            self.assertTrue(np.allclose(net[col + '_ci_low'], low[k], rtol=1e-10, atol=1e-12))
+            self.assertTrue(np.allclose(net[col + '_ci_high'], high[k], rtol=1e-10, atol=1e-12))
+            self.assertTrue(low[k] < net[col][0] < high[k])
+
+    def test_phaseAvg(self):
+        avgs = self.dataSet.phaseAvg(['Fx'], 1.0, 4, ci=0.95, nBoot=200, seed=1)
+
+        values = np.asarray(self.dataSet.foilData['Fx'])[0:4000].reshape(4, 1, 1000)
+        low, high = loopBootstrap(list(values), 200, 0.95, 1)
+
+        self.assertTrue(np.allclose(np.asarray(avgs['Fx_ci_low']), low, rtol=1e-10, atol=1e-12))
+        self.assertTrue(np.allclose(np.asarray(avgs['Fx_ci_high']), high, rtol=1e-10, atol=1e-12))
+
+    def test_no_intervals_by_default(self):
+        net = self.dataSet.netValue(['Fx'], 1.0, 5)
+        self.assertEqual(sorted(net.keys()), ['Fx'])
+
+    def test_seed_and_workers(self):
+        #more columns than one chunk, so the threads share them
+        values = np.random.RandomState(0).randn(6, 700, 3)
+
+        low, high = bootstrapCycles(values, nBoot=2000, seed=5)
+        low2, high2 = bootstrapCycles(values, nBoot=2000, seed=5, workers=3)
+        low3, high3 = bootstrapCycles(values, nBoot=2000, seed=6)
+
+        self.assertEqual(low.shape, (700, 3))
+        self.assertTrue(np.array_equal(low, low2) and np.array_equal(high, high2))
+        self.assertFalse(np.array_equal(low, low3))
+        self.assertTrue((low < values.mean(axis=0)).all() and (values.mean(axis=0) < high).all())
+
+    def test_too_few_cycles(self):
+        self.assertRaises(ValueError, bootstrapCycles, np.ones((1, 5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
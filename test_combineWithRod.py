@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Checks FlapperData.combineWithRod against the row-by-row loop it replaced,
+on synthetic foil and rod combo files.
+
+Run with:  python -m unittest test_combineWithRod
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import FlapperData
+from Flapper_test_data import writeCombo
+
+
+def oldCombineWithRod(foilHeave, rodHeave, foil, rod):
+    """
+    The original combineWithRod loop, on plain arrays: foilHeave and
+    rodHeave are the heave positions, and foil and rod are lists of the
+    three filtered channels to subtract (Fx, Fy, Tz).  Returns the three
+    corrected channels and the rod row matched to the first foil row.
+    """
+
+    #Find the first heave position in the foil data.
+    firstHeave = foilHeave[0]
+
+    #Find out if heave is decreasing or increasing by comparing to next
+    #heave position.
+    if firstHeave < foilHeave[1]:
+        direction = 'incr'
+    else:
+        direction = 'decr'
+
+    #initialize an index to let us note where we are in rod data (below)
+    i=0
+
+    #Read each heave position in the rod data, one at a time.
+    for heave in rodHeave:
+
+    #If heave position in the rod data matches the one noted from foil data
+    #(Because different passes of the Flapper rarely are identical in
+    #position reports, allow for error of 0.00005 m.)
+        if firstHeave - heave < 0.00005:
+
+            #Determine if heave is increasing or decreasing at the first
+            #occurance by comparing to the next heave position.
+            try:
+                if heave < rodHeave[i+1]:
+                    rDirection = 'incr'
+                else:
+                    rDirection = 'decr'
+
+            #If the matching heave occurs at the end of the list of heave
+            #positions, check for incr/decr using the previous value instead
+            except IndexError:
+                if heave < rodHeave[i-1]:
+                    rDirection = 'decr'
+                else:
+                    rDirection = 'incr'
+
+            #if direction of motion matches,
+            if direction == rDirection:
+
+                #note the index in rod where this happens.
+                matchIndex = i
+
+                #break out of loop
+                break
+
+        #increment i
+        i+=1
+
+    #initialize storage for corrected data
+    newFx = []
+    newFy = []
+    newTz = []
+
+    #initialize index to go through rod data row-by-row
+    j=matchIndex
+
+    #going line by line, starting at the beginning of foil data and
+    #the noted index from rod data (corresponding points)
+    for index in range(0,len(foilHeave)):
+
+        try:
+
+            #subtract the rod Fx, Fy, and Tz (filtered) from the foil
+            newFx.append(foil[0][index] - rod[0][j])
+            newFy.append(foil[1][index] - rod[1][j])
+            newTz.append(foil[2][index] - rod[2][j])
+
+        #when we run out rows in the rod data,
+        except IndexError:
+
+            #start at the beginning of the rod data
+            j=0
+            newFx.append(foil[0][index] - rod[0][j])
+            newFy.append(foil[1][index] - rod[1][j])
+            newTz.append(foil[2][index] - rod[2][j])
+
+        #and continue to next row
+        j+=1
+
+    return np.array(newFx), np.array(newFy), np.array(newTz), matchIndex
+
+
+class CombineWithRodTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.rodpath = writeCombo(os.path.join(self.folder, 'rod.xls'), seed=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def load(self, phase, resolved=0, rodpath=None):
+        """
+        Loads and filters a foil file starting at the given phase of the
+        motion, with the rod data.
+        """
+        if rodpath is None:
+            rodpath = self.rodpath
+        foil = writeCombo(os.path.join(self.folder, 'foil.xls'), phase=phase, seed=0)
+
+        dataSet = FlapperData(foil, 1.0, pitch=1, rod=1, rodpath=rodpath)
+        if resolved == 1:
+            dataSet.resolveForces(rod=1)
+        dataSet.filterData(7, resolved, rod=1)
+
+        return dataSet
+
+    def combine(self, phase, resolved=0):
+        """
+        Runs the old loop and combineWithRod on the same data, and checks
+        they give the same corrected channels.  Returns the old match
+        index.
+        """
+        dataSet = self.load(phase, resolved)
+        if resolved == 1:
+            cols = ['Res_Fx_filt', 'Res_Fy_filt', 'Tz_filt']
+        else:
+            cols = ['Fx_filt', 'Fy_filt', 'Tz_filt']
+
+        newFx, newFy, newTz, matchIndex = oldCombineWithRod(
+            np.array(dataSet.foilData['heave_pos']), np.array(dataSet.rodData['heave_pos']),
+            [np.array(dataSet.foilData[col]) for col in cols],
+            [np.array(dataSet.rodData[col]) for col in cols])
+
+        dataSet.combineWithRod(resolved=resolved)
+
+        self.assertTrue(np.array_equal(np.asarray(dataSet.foilData['Fx_noRod']), newFx))
+        self.assertTrue(np.array_equal(np.asarray(dataSet.foilData['Fy_noRod']), newFy))
+        self.assertTrue(np.array_equal(np.asarray(dataSet.foilData['Tz_noRod']), newTz))
+
+        return matchIndex
+
+    def test_no_lag(self):
+        self.assertEqual(self.combine(0.), 0)
+
+    def test_lag_wraps_around_rod_data(self):
+        #the foil starts partway through a cycle, so the rod rows run off
+        #the end of the rod data and start over
+        self.assertTrue(self.combine(1.) > 0)
+
+    def test_resolved(self):
+        self.assertTrue(self.combine(0.5, resolved=1) > 0)
+
+    def test_no_match(self):
+        #rod heave never reaches the first foil heave position (the old
+        #loop failed with a NameError here)
+        rodpath = writeCombo(os.path.join(self.folder, 'still.xls'), heaveAmp=0.001, seed=1)
+        dataSet = self.load(1., rodpath=rodpath)
+        self.assertRaises(ValueError, dataSet.combineWithRod)
+
+
+if __name__ == '__main__':
+    unittest.main()
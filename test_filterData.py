@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Checks FlapperData.filterData against the filtfilt calls it replaced, on
+synthetic combo files.
+
+Run with:  python -m unittest test_filterData
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import FlapperData
+from Flapper_test_data import writeCombo
+
+
+def oldFilter(values, cutoffFreq):
+    """
+    The original filter: a 2nd order Butterworth filter, run forwards and
+    backwards with filtfilt, at cutoffFreq/C so the two passes together
+    cut off at cutoffFreq.
+    """
+    from scipy.signal import butter, filtfilt
+
+    C = 0.802
+    b, a = butter(2, (cutoffFreq/C)/(1000/2), btype = 'low')
+
+    return filtfilt(b, a, values)
+
+
+class FilterDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        foil = writeCombo(os.path.join(self.folder, 'foil.xls'), seed=0)
+        rod = writeCombo(os.path.join(self.folder, 'rod.xls'), phase=1., seed=1)
+        self.dataSet = FlapperData(foil, 1.0, pitch=1, rod=1, rodpath=rod)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def check(self, pairs, cutoffFreq):
+        """
+        Checks each (channel, filtered channel) pair against the old
+        filter, for the foil and the rod.  For the 2nd order filter the
+        results are identical.
+        """
+        for df in [self.dataSet.foilData, self.dataSet.rodData]:
+            for col, filt in pairs:
+                old = oldFilter(np.array(df[col]), cutoffFreq)
+                self.assertTrue(np.array_equal(np.asarray(df[filt]), old))
+
+    def test_forces(self):
+        self.dataSet.filterData(7, rod=1)
+        self.check([('Fx', 'Fx_filt'), ('Fy', 'Fy_filt'), ('Tz', 'Tz_filt')], 7)
+
+    def test_resolved_forces(self):
+        self.dataSet.resolveForces(rod=1)
+        self.dataSet.filterData(10, resolved=1, rod=1)
+        self.check([('Res_Fx', 'Res_Fx_filt'), ('Res_Fy', 'Res_Fy_filt'), ('Tz', 'Tz_filt')], 10)
+
+    def test_channels(self):
+        channels = ['Fx', 'Fy', 'Fz', 'Tx', 'Ty', 'Tz', 'heave_pos', 'pitch_pos']
+        self.dataSet.filterData(5, rod=1, channels=channels)
+        self.check([(col, col + '_filt') for col in channels], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
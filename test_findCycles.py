@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Checks findCycles on clean and noisy synthetic sine traces.
+
+Run with:  python -m unittest test_findCycles
+"""
+
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import findCycles
+
+
+def sineTrace(freq, n=10000, fs=1000., phase=0., amp=0.02, noise=0., seed=0):
+    """
+    Makes a sine position trace with white noise of standard deviation
+    noise added.
+    """
+    t = np.arange(n)/fs
+    rng = np.random.RandomState(seed)
+
+    return amp*np.sin(2*np.pi*freq*t + phase) + noise*rng.randn(n)
+
+
+class FindCyclesTest(unittest.TestCase):
+
+    def test_clean_zero(self):
+        #upward zero crossings of a sine, one per second (the trace starts
+        #at zero, which isn't a crossing)
+        starts = findCycles(sineTrace(1.0), 1000., 1.0)
+        self.assertEqual(len(starts), 9)
+        self.assertTrue(np.allclose(starts, 1000.*np.arange(1, 10), atol=1e-3))
+
+    def test_clean_peak(self):
+        starts = findCycles(sineTrace(1.7, phase=1.), 1000., 1.7, method='peak')
+        expected = (np.arange(17)*2*np.pi + 0.5*np.pi - 1.)/(2*np.pi*1.7)*1000.
+        expected = expected[expected >= 0]
+        self.assertEqual(len(starts), len(expected))
+        self.assertTrue(np.allclose(starts, expected, atol=0.5))
+
+    def test_noisy_cycle_count(self):
+        #noise makes x cross zero several times around each real crossing,
+        #and those mustn't add or merge cycles
+        for seed in range(20):
+            for noise in (0.002, 0.005, 0.008):
+                for freq in (0, 1.0):
+                    x = sineTrace(1.0, phase=0.5, noise=noise, seed=seed)
+                    starts = findCycles(x, 1000., freq)
+                    self.assertEqual(len(starts) - 1, 9)
+                    self.assertTrue(np.allclose(np.diff(starts), 1000., atol=150))
+
+    def test_noisy_peak_cycle_count(self):
+        for seed in range(20):
+            x = sineTrace(1.7, noise=0.006, seed=seed)
+            starts = findCycles(x, 1000., 1.7, method='peak')
+            self.assertEqual(len(starts) - 1, 16)
+            self.assertTrue(np.allclose(np.diff(starts), 1000./1.7, atol=150))
+
+    def test_bad_method(self):
+        self.assertRaises(ValueError, findCycles, sineTrace(1.0), 1000., 1.0, 'valley')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Checks FlapperData.phaseAvg against the row-by-row loop it replaced, on
+synthetic combo files.
+
+Run with:  python -m unittest test_phaseAvg
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import FlapperData
+from Flapper_test_data import writeCombo
+
+
+def oldPhaseAvg(values, p, nCycles):
+    """
+    The original phaseAvg loop for one column (values, a plain array) with
+    p rows per cycle.  Returns the phase-average and standard deviation of
+    each row of a cycle.  The sum of square errors was always divided by
+    2, which is the sample standard deviation for nCycles = 3.
+    """
+
+    #make a list of the each time-point's phase-average and standard deviation
+    averageList = []
+    stdevList = []
+
+    #look at the ith row in a cycle
+    for i in range(0,p):
+
+        #initialize storage for the sum of corresponding values
+        total = 0
+        #make a list of the values
+        values_i = []
+
+        #look at the ith row in the nth cycle (all in turn)
+        for n in range(0, nCycles):
+
+            #Get the value in the ith row of the nth cycle
+            total += values[i+n*p]
+
+            #Get the values themselves
+            values_i.append(values[i+n*p])
+
+        #divide by nCycles to get the average for that time point
+        newAvg = total/nCycles
+
+        #add the average to the collection
+        averageList.append(newAvg)
+
+        #make a list of square errors
+        sqerrors = []
+
+        #calculate the standard deviation
+        for v in values_i:
+            sqerrors.append(abs(v-newAvg)**2.)
+        sumsqerrors = np.sum(sqerrors)
+        stdev = np.sqrt(sumsqerrors/2.)
+
+        #add standard deviation to the list
+        stdevList.append(stdev)
+
+    return np.array(averageList), np.array(stdevList)
+
+
+class PhaseAvgTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def load(self, freq):
+        """
+        Loads synthetic foil and rod files flapping at freq.
+        """
+        foil = writeCombo(os.path.join(self.folder, 'foil.xls'), freq=freq, seed=0)
+        rod = writeCombo(os.path.join(self.folder, 'rod.xls'), freq=freq, phase=1., seed=1)
+
+        return FlapperData(foil, freq, pitch=1, rod=1, rodpath=rod)
+
+    def check(self, freq, nCycles):
+        """
+        Compares phaseAvg of Fx and Fy, for the foil and the rod, to the
+        old loop.
+        """
+        dataSet = self.load(freq)
+        p = int(round(1000./freq))
+
+        avgs = dataSet.phaseAvg(['Fx', 'Fy'], freq, nCycles, rod=1)
+
+        self.assertEqual(avgs.shape[0], p)
+        self.assertTrue(np.allclose(np.asarray(avgs['time']), np.arange(p)/1000.))
+        for col in ['Fx', 'Fy']:
+            for suffix, df in [('', dataSet.foilData), ('_rod', dataSet.rodData)]:
+                average, stdev = oldPhaseAvg(np.array(df[col]), p, nCycles)
+                self.assertTrue(np.allclose(np.asarray(avgs[col+suffix]), average, rtol=1e-12, atol=1e-12))
+
+                #the old standard deviation is only right for 3 cycles
+                if nCycles == 3:
+                    self.assertTrue(np.allclose(np.asarray(avgs[col+suffix+'_std']), stdev, rtol=1e-12, atol=1e-12))
+                else:
+                    stacked = np.array(df[col])[0:nCycles*p].reshape(nCycles, p)
+                    self.assertTrue(np.allclose(np.asarray(avgs[col+suffix+'_std']), stacked.std(axis=0, ddof=1), rtol=1e-12, atol=1e-12))
+
+    def test_three_cycles(self):
+        self.check(1.0, 3)
+
+    def test_period_rounded_to_rows(self):
+        #1.7 Hz is 588.2 rows per cycle, averaged as 588 rows as before
+        self.check(1.7, 3)
+
+    def test_sample_standard_deviation(self):
+        self.check(2.0, 7)
+
+    def test_too_few_rows(self):
+        dataSet = self.load(1.0)
+        self.assertRaises(ValueError, dataSet.phaseAvg, ['Fx'], 1.0, 11)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that ResultStore keeps each trial's rod alignment, including in
+store files made before it had columns for it.
+
+Run with:  python -m unittest test_resultStore
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_analysis_wrapper import ResultStore
+
+
+def makeTrial(name, rod=1):
+    return {'trial': name, 'testtype': 'flex', 'frequency': 1.0, 'pitch': 1, 'resolve': 1,
+            'rod': rod, 'nCycles': 9, 'name': name, 'path': '/data'}
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.folder, 'results.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def test_rod_alignment(self):
+        store = ResultStore(self.filepath)
+        store.add(makeTrial('a'), net={'Fx_noRod': [0.5]},
+                  rodAlignment={'method': 'xcorr', 'lag': 183.25, 'confidence': 0.998})
+        store.add(makeTrial('b', rod=0), net={'Fx_filt': [0.25]})
+
+        trials = store.trials()
+        self.assertEqual(list(trials['trial']), ['a', 'b'])
+        self.assertEqual(trials['align'][0], 'xcorr')
+        self.assertEqual(trials['rodLag'][0], 183.25)
+        self.assertEqual(trials['rodConfidence'][0], 0.998)
+
+        #blank without rod data
+        self.assertTrue(trials['align'][1] is None)
+        self.assertTrue(trials['rodLag'][1] is None or np.isnan(trials['rodLag'][1]))
+
+        #and the alignment can be filtered on
+        self.assertEqual(list(store.trials(align='xcorr')['trial']), ['a'])
+
+    def test_old_store(self):
+        #a trials table from before the alignment columns
+        conn = sqlite3.connect(self.filepath)
+        conn.execute('CREATE TABLE trials (trial TEXT PRIMARY KEY, testtype TEXT, frequency REAL, pitch INTEGER, '
+                     'resolve INTEGER, rod INTEGER, nCycles INTEGER, name TEXT, path TEXT, fs REAL, added TEXT)')
+        conn.execute("INSERT INTO trials VALUES ('old', 'flex', 1.0, 1, 1, 0, 9, 'old', '/data', 1000.0, '2015-07-31 11:40:36')")
+        conn.commit()
+        conn.close()
+
+        store = ResultStore(self.filepath)
+        store.add(makeTrial('new'), rodAlignment={'method': 'heave', 'lag': 12., 'confidence': 0.95})
+
+        trials = store.trials()
+        self.assertEqual(list(trials['trial']), ['new', 'old'])
+        self.assertEqual(trials['rodLag'][0], 12.)
+        self.assertTrue(trials['align'][1] is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
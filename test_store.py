@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that FlapperData loaded from a memory-mapped store (storeDir) has
+the same data as loaded straight from the combo files, and that
+processed columns saved with storeDerived read back the same.
+
+Run with:  python -m unittest test_store
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import FlapperData
+from Flapper_test_data import writeCombo
+
+
+def fileHash(filepath):
+    with open(filepath, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.storeDir = os.path.join(self.folder, 'stores')
+        self.foil = writeCombo(os.path.join(self.folder, 'foil.xls'), phase=1., seed=0)
+        self.rod = writeCombo(os.path.join(self.folder, 'rod.xls'), seed=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def load(self, **kwargs):
+        return FlapperData(self.foil, 1.0, pitch=1, rod=1, rodpath=self.rod, **kwargs)
+
+    def assertSameData(self, a, b, columns=None):
+        if columns is None:
+            columns = list(a.columns)
+        self.assertEqual(sorted(columns), sorted([col for col in b.columns if col in columns]))
+        for col in columns:
+            self.assertTrue(np.array_equal(np.asarray(a[col]), np.asarray(b[col])), col)
+
+    def test_same_as_loaded(self):
+        loaded = self.load()
+        stored = self.load(storeDir=self.storeDir)
+
+        self.assertSameData(loaded.foilData, stored.foilData)
+        self.assertSameData(loaded.rodData, stored.rodData)
+
+    def test_store_not_changed(self):
+        #centering positions changes the data, but never the store
+        stored = self.load(storeDir=self.storeDir)
+        raw = os.path.join(stored.foilStore, 'raw.npy')
+        before = fileHash(raw)
+
+        again = self.load(storeDir=self.storeDir)
+        self.assertEqual(fileHash(raw), before)
+        self.assertSameData(stored.foilData, again.foilData)
+
+    def test_derived_round_trip(self):
+        stored = self.load(storeDir=self.storeDir)
+        stored.resolveForces(rod=1)
+        stored.filterData(7, resolved=1, rod=1)
+        stored.combineWithRod(resolved=1)
+        stored.storeDerived('processed', rod=1)
+
+        reopened = self.load(storeDir=self.storeDir, storeTag='processed')
+
+        derived = ['Res_Fx', 'Res_Fy', 'Res_Fx_filt', 'Res_Fy_filt', 'Tz_filt', 'Fx_noRod', 'Fy_noRod', 'Tz_noRod']
+        self.assertSameData(stored.foilData, reopened.foilData, derived)
+        self.assertSameData(stored.rodData, reopened.rodData, derived[0:5])
+
+
+if __name__ == '__main__':
+    unittest.main()
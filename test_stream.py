@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Checks streamFlapperData against loading the whole record into a
+FlapperData object, on a synthetic combo file.
+
+Run with:  python -m unittest test_stream
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from Flapper_data_analysis import FlapperData, streamFlapperData
+from Flapper_test_data import writeCombo
+
+
+class StreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+        #1.7 Hz doesn't have a whole number of rows per cycle at 1000 Hz
+        self.freq = 1.7
+        self.foil = writeCombo(os.path.join(self.folder, 'foil.xls'), freq=self.freq, n=12000, phase=0.5, seed=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, True)
+
+    def compare(self, phase, resolved=0):
+        """
+        Streams the file in small chunks and checks the net values and
+        phase-averages against netValue and phaseAvg with the same phase
+        option.
+        """
+        net, avgs = streamFlapperData(self.foil, self.freq, pitch=1, resolved=resolved,
+                                      phase=phase, nBins=500, chunksize=1500)
+
+        dataSet = FlapperData(self.foil, self.freq, pitch=1)
+        if resolved == 1:
+            dataSet.resolveForces()
+            columns = ['Res_Fx_filt', 'Res_Fy_filt', 'Tz_filt']
+        else:
+            columns = ['Fx_filt', 'Fy_filt', 'Tz_filt']
+        dataSet.filterData(7, resolved)
+
+        expectedNet = dataSet.netValue(columns, self.freq, 'auto', phase=phase)
+        expected = dataSet.phaseAvg(columns, self.freq, 'auto', phase=phase, nBins=500)
+
+        self.assertEqual(sorted(net.keys()), sorted(expectedNet.keys()))
+        for col in columns:
+            self.assertTrue(np.allclose(net[col], expectedNet[col], rtol=0, atol=1e-10))
+
+        self.assertEqual(list(avgs.columns), list(expected.columns))
+        self.assertTrue(np.allclose(avgs.values, expected.values, rtol=0, atol=1e-10))
+
+        return avgs
+
+    def test_rows(self):
+        avgs = self.compare('rows')
+        #cycles of 588 rows, as phaseAvg
+        self.assertEqual(avgs.shape[0], 588)
+
+    def test_freq(self):
+        avgs = self.compare('freq')
+        self.assertEqual(avgs.shape[0], 500)
+
+    def test_heave(self):
+        self.compare('heave', resolved=1)
+
+    def test_too_many_cycles(self):
+        self.assertRaises(ValueError, streamFlapperData, self.foil, self.freq, nCycles=50)
+
+
+if __name__ == '__main__':
+    unittest.main()